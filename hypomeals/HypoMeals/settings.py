@@ -289,6 +289,13 @@ CELERY_RESULT_BACKEND = "django-db"
 CELERY_REDIS_HOST = os.getenv("CELERY_REDIS_HOST", "localhost")
 CELERY_REDIS_PORT = os.getenv("CELERY_REDIS_PORT", "6379")
 CELERY_BROKER_URL = f"redis://{CELERY_REDIS_HOST}:{CELERY_REDIS_PORT}/0"
+# Installed into the database scheduler of django-celery-beat when it starts
+CELERY_BEAT_SCHEDULE = {
+    "purge-expired-exports": {
+        "task": "meals.tasks.purge_expired_exports",
+        "schedule": 10 * 60,
+    }
+}
 
 # Sales
 SALES_INTERFACE_URL = "http://hypomeals-sales.colab.duke.edu:8080/"
@@ -297,6 +304,42 @@ SALES_REQUEST_READ_TIMEOUT = 30
 SALES_REQUEST_MAX_RETRIES = 5
 SALES_TIMEOUT = 30
 SALES_YEAR_START = 1999
+# Maximum number of requests per second made to the sales interface
+SALES_REQUEST_RATE_LIMIT = 5
+# Redis server through which all processes share the rate limit above. If None, the
+# limit applies to each process separately.
+SALES_RATE_LIMIT_REDIS_URL = CELERY_BROKER_URL
+# Number of concurrent requests (and pooled connections) per fetcher
+SALES_FETCH_CONCURRENCY = 8
+# Number of (SKU, year) pairs fetched by a single task
+SALES_FETCH_BATCH_SIZE = 50
+# Size of the chunks in which responses from the sales interface are parsed
+SALES_STREAM_CHUNK_SIZE = 16 * 1024
+# Whether the sales table is partitioned by year (PostgreSQL 11+). Only takes effect
+# when migration 0018 is applied. See meals/migrations/0018_partition_sale.py
+SALES_PARTITION_BY_YEAR = False
+# The number of SKUs whose sales are still being retrieved is counted again after
+# this many seconds, see SalesReadiness.pending_count()
+SALES_PENDING_COUNT_TTL = 5 * 60
+
+# Exports
+# Exports run in the background are stored in the default storage under this prefix
+EXPORT_STORAGE_DIR = "exports/"
+# Identical exports requested within this many seconds reuse the same file
+EXPORT_CACHE_TTL = 10 * 60
+
+# Imports
+# Number of processes on which rows of large CSV files are parsed. 1 disables it.
+# The processes are spawned for each import, which takes a second or so, so this
+# only pays off for very large files.
+IMPORT_PARSE_WORKERS = 1
+# Number of rows parsed by each process at a time. Smaller files are parsed in the
+# request's process.
+IMPORT_PARSE_CHUNK_ROWS = 2000
+# Imports with collisions are staged for review for this many seconds
+IMPORT_TRANSACTION_TTL = 30 * 60
+# Maximum number of (compressed) bytes staged for a single import
+IMPORT_TRANSACTION_MAX_SIZE = 50 * 1024 * 1024
 
 # Backups
 BACKUP_STORAGE_DIR = "backup/"  # will be stored on Google Cloud Storage
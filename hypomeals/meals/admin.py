@@ -20,6 +20,11 @@ from .models import (
     GoalSchedule,
     Customer,
     Sale,
+    SalesRollup,
+    SalesFetchState,
+    SalesReadiness,
+    ExportJob,
+    ImportTransaction,
 )
 
 models = [
@@ -38,6 +43,11 @@ models = [
     Unit,
     Customer,
     Sale,
+    SalesRollup,
+    SalesFetchState,
+    SalesReadiness,
+    ExportJob,
+    ImportTransaction,
     Permission,
     ContentType
 ]
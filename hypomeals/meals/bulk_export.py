@@ -1,21 +1,41 @@
 import csv
+import io
+import json
 import logging
-import operator
 import tempfile
 import zipfile
-from io import BytesIO
-from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Sequence,
+    Tuple,
+)
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.fields import ArrayField
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Func, IntegerField, QuerySet, Value
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
 
 from meals import utils
 from .models import (
+    ExportJob,
     Sku,
     Ingredient,
     ProductLine,
+    Formula,
     FormulaIngredient,
-    SkuManufacturingLine,
     Sale,
+    Customer,
 )
 
 logger = logging.getLogger(__name__)
@@ -126,255 +146,430 @@ FILE_TYPE_TO_FILENAME = {file_type: f"{file_type}.csv" for file_type in FILE_TYP
 
 FILEIFY_THRESHOLD = 200
 
-TEMPDIR = Path(tempfile.gettempdir())
+# Number of CSV rows sent to the client at a time
+EXPORT_CHUNK_ROWS = 500
 
 logger = logging.getLogger(__name__)
 
 
-def _export_objs(stream, file_type, objects):
+class _Echo:
+    """A pseudo-buffer for csv.writer, whose writerow then returns the line written"""
+
+    def write(self, value):
+        return value
+
+
+class _ZipBuffer(io.RawIOBase):
+    """
+    An unseekable stream for zipfile to write into, from which everything written
+    so far can be drained. zipfile writes data descriptors after each member when it
+    cannot seek back, so an archive can be sent while it is being written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_csv(rows: Iterable[Sequence]) -> Iterator[str]:
+    """
+    Formats rows as CSV, a few rows at a time
+    :param rows: an iterable of rows, each of which is a sequence of values
+    :return: a generator of chunks of CSV text
+    """
+    writer = csv.writer(_Echo())
+    for chunk in utils.chunked(rows, EXPORT_CHUNK_ROWS):
+        yield "".join(writer.writerow(row) for row in chunk)
+
+
+def stream_zip(files: Iterable[Tuple[str, Iterable[str]]]) -> Iterator[bytes]:
+    """
+    Compresses files into a ZIP archive as their contents are generated
+    :param files: an iterable of (filename, content) pairs, where content is an
+        iterable of chunks of text
+    :return: a generator of chunks of the archive
+    """
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for filename, content in files:
+            with zip_file.open(filename, "w") as member:
+                for chunk in content:
+                    member.write(chunk.encode())
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def csv_response(content: Iterable[str], filename: str) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(content, content_type="text/csv")
+    response["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+def zip_response(
+    files: Iterable[Tuple[str, Iterable[str]]], filename: str
+) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(stream_zip(files), content_type="application/zip")
+    response["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+def _field_path(field: str) -> str:
+    return field.replace(".", "__")
+
+
+def _export_query(file_type, objects) -> QuerySet:
     """
-    Exports a particular type of objects to a CSV file / stream
-    :param directory: the directory in which the file will be placed
+    Plans the data access of an export up front: every column is retrieved by a
+    single query, projected with values(), so the number of queries does not grow
+    with the number of rows exported.
     :param file_type: the type of file being exported
-    :param objects: an iterable of objects to be exported
-    :param force_file: if True, a temporary file will always be written. This option
-        is used when generating ZIP files for export.
-    :return: a (stream, filename) tuple where stream is an IO stream instance pointing
-        to the buffer, and filename is a Path to the file written, if one is used, or
-        None, if the content of the file is written entirely to memory.
+    :param objects: a queryset (or an iterable) of objects to be exported
+    :return: a queryset of dicts, keyed by the field paths of the columns
     """
-    if file_type not in FILE_TYPES:
-        logger.error("Unknown file type '%s'", file_type)
-        raise RuntimeError(f"Unknown file type '{file_type}'")
+    if not isinstance(objects, QuerySet):
+        objects = FILE_TYPES[file_type].objects.filter(
+            pk__in=[obj.pk for obj in objects]
+        )
+    field_dict = FILE_TYPE_TO_FIELDS_REV[file_type]
+    fields = []
+    aggregates = {}
+    for header in HEADERS[file_type]:
+        if header == "ML Shortnames":
+            shortname = _field_path(field_dict[header]) + "__shortname"
+            aggregates["ml_shortnames"] = StringAgg(
+                shortname, delimiter=",", ordering=shortname
+            )
+        elif header == "Revenue":
+            fields.extend(["sales", "price"])
+        else:
+            fields.append(_field_path(field_dict[header]))
+            if header in ("Quantity", "Size"):
+                fields.append("unit__symbol")
+    if not aggregates:
+        return objects.values(*dict.fromkeys(fields))
+    # Every field ordered by is added to the GROUP BY clause, which would split the
+    # aggregated rows, so fields are only ordered by if they are exported. Ordering
+    # expressions, e.g., by the position of each SKU in a list, are kept as is.
+    ordering = objects.query.order_by or (
+        objects.model._meta.ordering if objects.query.default_ordering else []
+    )
+    pk_name = objects.model._meta.pk.name
+    ordering = [
+        order
+        for order in ordering
+        if not isinstance(order, str)
+        or (pk_name if order.lstrip("-") == "pk" else order.lstrip("-")) in fields
+    ]
+    return (
+        objects.order_by()
+        .values(*dict.fromkeys(fields))
+        .annotate(**aggregates)
+        .order_by(*ordering)
+    )
+
 
+def _export_rows(file_type, objects):
     field_dict = FILE_TYPE_TO_FIELDS_REV[file_type]
     headers = HEADERS[file_type]
-    writer = csv.DictWriter(stream, fieldnames=headers)
-    writer.writeheader()
-    for obj in objects:
-        row = {}
+    yield headers
+    for values in _export_query(file_type, objects).iterator():
+        row = []
         for header in headers:
             if header == "ML Shortnames":
-                ml_lines = SkuManufacturingLine.objects.filter(sku=obj)
-                result = ""
-                for ml_line in ml_lines:
-                    result += str(ml_line.line.shortname) + ","
-            elif header == "Quantity":
-                result = (
-                    str(getattr(obj, field_dict[header]))
-                    + " "
-                    + str(getattr(obj, "unit.symbol"))
-                )
-            elif header == "Size":
+                result = values["ml_shortnames"] or ""
+            elif header in ("Quantity", "Size"):
                 result = (
-                    str(getattr(obj, field_dict[header]))
+                    str(values[_field_path(field_dict[header])])
                     + " "
-                    + str(getattr(obj, "unit.symbol"))
+                    + str(values["unit__symbol"])
                 )
             elif header == "Revenue":
-                result = str(
-                    float(getattr(obj, "sales")) * float(getattr(obj, "price"))
-                )
+                result = str(float(values["sales"]) * float(values["price"]))
             else:
-                result = str(operator.attrgetter(field_dict[header])(obj))
-            row[header] = result
-        writer.writerow(row)
-    #
-    # writer.writerows(
-    #     {header: getattr(obj, field_dict[header]) for header in headers}
-    #     for obj in objects
-    # )
-    stream.seek(0)
-    return stream
-
-
-def export_sales(summary_stream, yearly_stream, objects):
-    summary_headers = HEADERS["sales-summary"]
-    yearly_headers = HEADERS["sales-yearly"]
-    summary_writer = csv.DictWriter(summary_stream, fieldnames=summary_headers)
-    yearly_writer = csv.DictWriter(yearly_stream, fieldnames=yearly_headers)
-    summary_writer.writeheader()
-    yearly_writer.writeheader()
-    for _, pl_summary in objects:
+                result = values[_field_path(field_dict[header])]
+                result = "" if result is None else str(result)
+            row.append(result)
+        yield row
+
+
+def _export_objs(file_type, objects):
+    """
+    Exports a particular type of objects as CSV, using a single query. Nothing is
+    read from the database or formatted until the result is iterated over.
+    :param file_type: the type of file being exported
+    :param objects: an iterable of objects to be exported
+    :return: a generator of chunks of CSV text
+    """
+    if file_type not in FILE_TYPES:
+        logger.error("Unknown file type '%s'", file_type)
+        raise RuntimeError(f"Unknown file type '{file_type}'")
+    return stream_csv(_export_rows(file_type, objects))
+
+
+def _export_sales_summary_rows(objects):
+    yield HEADERS["sales-summary"]
+    for _, pl_summary, *_ in objects:
+        for sku_summary in pl_summary:
+            yield sku_summary[: len(HEADERS["sales-summary"])]
+
+
+def _export_sales_yearly_rows(objects):
+    yield HEADERS["sales-yearly"]
+    for _, pl_summary, *_ in objects:
         for sku_summary in pl_summary:
-            row = {}
-            for i, header in enumerate(summary_headers):
-                row[header] = sku_summary[i]
-            summary_writer.writerow(row)
             for sku_one_year in sku_summary[-1]:
-                row = {}
-                for i, header in enumerate(yearly_headers):
-                    row[header] = sku_one_year[i]
-                yearly_writer.writerow(row)
-    summary_stream.seek(0)
-    yearly_stream.seek(0)
-    return summary_stream, yearly_stream
+                yield sku_one_year[: len(HEADERS["sales-yearly"])]
+
+
+def export_sales(objects):
+    """
+    Exports a sales summary report as two CSV files: a summary of each SKU, and the
+    yearly breakdown of each SKU
+    :param objects: the sales summary report, as returned by `_sales_summary`
+    :return: a pair of generators of chunks of CSV text, (summary, yearly)
+    """
+    return (
+        stream_csv(_export_sales_summary_rows(objects)),
+        stream_csv(_export_sales_yearly_rows(objects)),
+    )
 
 
 def export_skus(skus, include_formulas=False, include_product_lines=False):
     """
     Exports a list of SKUs, and optionally ZIP up the formulas if the user requested
     that, too.
-    :param request: a HttpRequest instance to obtain the session key (as namespace
-        for the exported files)
     :param skus: data to be exported
     :param include_formulas: whether to include the formulas for the SKUs. Note that
         this makes the export a ZIP file rather than a CSV file.
-    :return: response containing the exported data, either as a CSV or a ZIP file.
+    :param include_product_lines: whether to include the product lines of the SKUs.
+        Note that this makes the export a ZIP file rather than a CSV file.
+    :return: a streaming response containing the exported data, either as a CSV or
+        a ZIP file.
     """
-    directory = TEMPDIR / utils.make_token_with_timestamp("skus")
-    directory.mkdir(parents=True, exist_ok=True)
-    logger.info("Will use directory %s", directory)
-    sku_file = directory / FILE_TYPE_TO_FILENAME["skus"]
-    sku_file.touch(exist_ok=True)
-    sku_data = sku_file.open("r+")
-    _export_objs(sku_data, "skus", skus)
-    logger.info("Exported %d SKU records", len(skus))
-    exported_files = [sku_file]
+    exported_files = [(FILE_TYPE_TO_FILENAME["skus"], _export_objs("skus", skus))]
     if include_formulas:
-        formulas = [sku.formula for sku in skus]
-        formulas = FormulaIngredient.objects.filter(formula__in=formulas).order_by(
-            "formula__number"
+        formulas = FormulaIngredient.objects.filter(
+            formula__in=Formula.objects.filter(sku__in=skus)
+        ).order_by("formula__number")
+        exported_files.append(
+            (FILE_TYPE_TO_FILENAME["formulas"], _export_objs("formulas", formulas))
         )
-        formula_file = directory / FILE_TYPE_TO_FILENAME["formulas"]
-        formula_file.touch(exist_ok=True)
-        formula_data = formula_file.open("r+")
-        _export_objs(formula_data, "formulas", formulas)
-        exported_files.append(formula_file)
-        logger.info("Exported %d Formula records", len(formulas))
 
     if include_product_lines:
         product_lines = ProductLine.objects.filter(sku__in=skus).distinct()
-        product_line_file = directory / FILE_TYPE_TO_FILENAME["product_lines"]
-        product_line_file.touch(exist_ok=True)
-        product_line_data = product_line_file.open("r+")
-        _export_objs(product_line_data, "product_lines", product_lines)
-        exported_files.append(product_line_file)
-        logger.info("Exported %d Product Line records", len(product_lines))
-
-    logger.info("exported_files is %s", exported_files)
-    if len(exported_files) > 1:
-        byte_data = BytesIO()
-        with zipfile.ZipFile(byte_data, "w") as zip_file:
-            for file in exported_files:
-                zip_file.write(file, arcname=file.name)
-
-        response = HttpResponse(byte_data.getvalue(), content_type="application/zip")
-        response["Content-Disposition"] = "attachment; filename=archive.zip"
-    else:
-        response = HttpResponse(
-            exported_files[0].open("r").read(), content_type="text/csv"
+        exported_files.append(
+            (
+                FILE_TYPE_TO_FILENAME["product_lines"],
+                _export_objs("product_lines", product_lines),
+            )
         )
-        response["Content-Disposition"] = "attachment; filename=skus.csv"
 
-    return response
+    logger.info("Exporting files %s", [name for name, _ in exported_files])
+    if len(exported_files) > 1:
+        return zip_response(exported_files, "archive.zip")
+    return csv_response(exported_files[0][1], "skus.csv")
 
 
 def export_ingredients(ingredients):
     """
-    Exports a list of ingredients as a temporary CSV file
+    Exports a list of ingredients as a CSV file
     :param ingredients: the list of ingredients to be exported
-    :return: an HttpResponse containing the exported CSV file
+    :return: a streaming response containing the exported CSV file
     """
-    directory = TEMPDIR / utils.make_token_with_timestamp("ingredients")
-    directory.mkdir(parents=True, exist_ok=True)
-    logger.info("Will use directory %s", directory)
-    file = directory / FILE_TYPE_TO_FILENAME["ingredients"]
-    file.touch(exist_ok=True)
-    logger.info("Will export ingredients to %s", file)
-    data = _export_objs(file.open("r+"), "ingredients", ingredients)
-    response = HttpResponse(data.read(), content_type="text/csv")
-    response["Content-Disposition"] = "attachment; filename=ingredients.csv"
-    return response
+    return csv_response(_export_objs("ingredients", ingredients), "ingredients.csv")
 
 
 def export_drilldown(sales):
     """
-    Exports a list of sales as a temporary CSV file
+    Exports a list of sales as a CSV file
     :param sales: the list of sales to be exported
-    :return: an HttpResponse containing the exported CSV file
+    :return: a streaming response containing the exported CSV file
     """
-    directory = TEMPDIR / utils.make_token_with_timestamp("sales")
-    directory.mkdir(parents=True, exist_ok=True)
-    logger.info("Will use directory %s", directory)
-    file = directory / FILE_TYPE_TO_FILENAME["sales"]
-    file.touch(exist_ok=True)
-    logger.info("Will export sales to %s", file)
-    data = _export_objs(file.open("r+"), "sales", sales)
-    response = HttpResponse(data.read(), content_type="text/csv")
-    response["Content-Disposition"] = "attachment; filename=sales.csv"
-    return response
+    return csv_response(_export_objs("sales", sales), "sales.csv")
 
 
-def generate_ingredient_dependency_report(ingredients):
-    directory = TEMPDIR / utils.make_token_with_timestamp("report")
-    directory.mkdir(parents=True, exist_ok=True)
-    logger.info("Will use directory %s", directory)
-    file = directory / "report.csv"
-    file.touch(exist_ok=True)
-    logger.info("Will write to file %s", file)
-    stream = file.open("r+", newline="")
-    writer = csv.writer(stream)
-    writer.writerow(["Ingr#", "Ingredient Name", "SKU#", "SKU Name"])
-    for ingredient in ingredients:
-        formulas = FormulaIngredient.objects.filter(ingredient_id=ingredient)
-        for formula in formulas:
-            skus = Sku.objects.filter(formula=formula.formula)
-            for sku in skus:
-                writer.writerow(
-                    [ingredient.number, ingredient.name, sku.number, sku.name]
-                )
+def _ingredient_dependency_rows(ingredients):
+    yield ["Ingr#", "Ingredient Name", "SKU#", "SKU Name"]
+    if not isinstance(ingredients, QuerySet):
+        ingredients = [ingredient.pk for ingredient in ingredients]
+    dependencies = (
+        FormulaIngredient.objects.filter(
+            ingredient__in=ingredients, formula__sku__isnull=False
+        )
+        .order_by("ingredient__number", "formula__sku__number")
+        .values_list(
+            "ingredient__number",
+            "ingredient__name",
+            "formula__sku__number",
+            "formula__sku__name",
+        )
+    )
+    yield from dependencies.iterator()
 
-    stream.seek(0)
-    response = HttpResponse(stream.read())
-    response["content_type"] = "text/csv"
-    response["Content-Disposition"] = "attachment;filename=report.csv"
-    return response
+
+def generate_ingredient_dependency_report(ingredients):
+    """
+    Reports the SKUs which depend on each of some ingredients, through their
+    formulas. The report is built by a single query joining ingredients to SKUs, and
+    streamed to the client as it is read.
+    :param ingredients: the ingredients to report on
+    :return: a streaming response containing the report as a CSV file
+    """
+    return csv_response(
+        stream_csv(_ingredient_dependency_rows(ingredients)), "report.csv"
+    )
 
 
 def export_formulas(formulas):
     """
-    Exports a list of ingredients as a temporary CSV file
-    :param formulas: the list of ingredients to be exported
-    :return: an HttpResponse containing the exported CSV file
+    Exports a list of formulas as a CSV file
+    :param formulas: the list of formulas to be exported
+    :return: a streaming response containing the exported CSV file
     """
-    directory = TEMPDIR / utils.make_token_with_timestamp("formulas")
-    directory.mkdir(parents=True, exist_ok=True)
-    logger.info("Will use directory %s", directory)
     formulas = FormulaIngredient.objects.filter(formula__in=formulas).order_by(
         "formula__number"
     )
-    formula_file = directory / FILE_TYPE_TO_FILENAME["formulas"]
-    formula_file.touch(exist_ok=True)
-    formula_data = formula_file.open("r+")
-    data = _export_objs(formula_data, "formulas", formulas)
-    response = HttpResponse(data.read(), content_type="text/csv")
-    response["Content-Disposition"] = "attachment; filename=formulas.csv"
-    return response
+    return csv_response(_export_objs("formulas", formulas), "formulas.csv")
 
 
 def export_sales_summary(sales_summary_report):
-    directory = TEMPDIR / utils.make_token_with_timestamp("sales_summary")
-    directory.mkdir(parents=True, exist_ok=True)
-    logger.info("Will use directory %s", directory)
-    sales_summary_file = directory / "sales-summary.csv"
-    sales_summary_file.touch(exist_ok=True)
-    sales_summary_data = sales_summary_file.open("r+")
-
-    directory = TEMPDIR / utils.make_token_with_timestamp("sales_yearly")
-    directory.mkdir(parents=True, exist_ok=True)
-    logger.info("Will use directory %s", directory)
-    sales_yearly_file = directory / "sales-yearly.csv"
-    sales_yearly_file.touch(exist_ok=True)
-    sales_yearly_data = sales_yearly_file.open("r+")
-
-    export_sales(sales_summary_data, sales_yearly_data, sales_summary_report)
-    exported_files = [sales_summary_file, sales_yearly_file]
-    byte_data = BytesIO()
-    with zipfile.ZipFile(byte_data, "w") as zip_file:
-        for file in exported_files:
-            zip_file.write(file, arcname=file.name)
-
-    response = HttpResponse(byte_data.getvalue(), content_type="application/zip")
-    response["Content-Disposition"] = "attachment; filename=sales_summary.zip"
-    return response
+    summary, yearly = export_sales(sales_summary_report)
+    return zip_response(
+        [("sales-summary.csv", summary), ("sales-yearly.csv", yearly)],
+        "sales_summary.zip",
+    )
+
+
+class AsyncExport(NamedTuple):
+    # Produces the response of an export from its parameters
+    export: Callable[[Dict[str, Any]], StreamingHttpResponse]
+    # Permissions required to download the exported file
+    perms: Tuple[str, ...]
+
+
+def _export_skus_async(params):
+    # Keep the order in which SKUs were shown to the user
+    position = Func(
+        Value(params["skus"], output_field=ArrayField(IntegerField())),
+        F("number"),
+        function="array_position",
+    )
+    skus = Sku.objects.filter(number__in=params["skus"]).order_by(position)
+    return export_skus(skus, params["formulas"], params["product_lines"])
+
+
+def _export_sales_summary_async(params):
+    from meals.views.sales import sales_summary_report
+
+    # Keep the order in which product lines were shown to the user
+    order = {pk: i for i, pk in enumerate(params["product_lines"])}
+    pls = sorted(ProductLine.objects.filter(pk__in=order), key=lambda pl: order[pl.pk])
+    customers = params["customers"]
+    if customers is not None:
+        customers = Customer.objects.filter(pk__in=customers)
+    return export_sales_summary(sales_summary_report(pls, customers))
+
+
+ASYNC_EXPORTS = {
+    "skus": AsyncExport(_export_skus_async, ("meals.view_sku",)),
+    "sales_summary": AsyncExport(
+        _export_sales_summary_async,
+        (
+            "meals.view_sku",
+            "meals.view_sale",
+            "meals.view_customer",
+            "meals.view_productline",
+        ),
+    ),
+}
+
+
+def run_export_async(kind: str, params: Dict[str, Any], user=None) -> ExportJob:
+    """
+    Schedules an export to run in the background. If an identical export was
+    requested in the last `EXPORT_CACHE_TTL` seconds, it is reused instead.
+    :param kind: the kind of export, one of `ASYNC_EXPORTS`
+    :param params: a JSON-serializable dict of the parameters of the export
+    :param user: the user requesting the export
+    :return: an `ExportJob`, which may already be finished
+    """
+    if kind not in ASYNC_EXPORTS:
+        logger.error("Unknown export '%s'", kind)
+        raise RuntimeError(f"Unknown export '{kind}'")
+    fingerprint = ExportJob.make_fingerprint(kind, params)
+    job = ExportJob.cached(fingerprint)
+    if job is not None:
+        logger.info("Reusing %s for fingerprint %s", job, fingerprint)
+        return job
+
+    from meals.tasks import run_export
+
+    job = ExportJob.objects.create(
+        fingerprint=fingerprint, kind=kind, params=json.dumps(params), user=user
+    )
+    transaction.on_commit(lambda: run_export.delay(job.pk))
+    logger.info("Scheduled %s", job)
+    return job
+
+
+def run_export_job(job: ExportJob) -> None:
+    """
+    Runs an export, and saves the exported file in the default storage
+    :param job: the `ExportJob` to run
+    """
+    job.status = ExportJob.RUNNING
+    job.save(update_fields=["status"])
+    try:
+        response = ASYNC_EXPORTS[job.kind].export(json.loads(job.params))
+        filename = response["Content-Disposition"].rpartition("filename=")[2]
+        with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as file:
+            for chunk in response:
+                file.write(chunk)
+            file.seek(0)
+            path = default_storage.save(
+                f"{settings.EXPORT_STORAGE_DIR}{job.pk}/{filename}", File(file)
+            )
+    except Exception as e:
+        logger.exception("Failed to run %s", job)
+        job.status = ExportJob.FAILURE
+        job.error = str(e)
+    else:
+        job.status = ExportJob.SUCCESS
+        job.filename = filename
+        job.content_type = response["Content-Type"]
+        job.path = path
+    job.complete_time = timezone.now()
+    job.save()
+
+
+def export_job_status(job: ExportJob) -> Dict[str, Any]:
+    """
+    Describes the status of an export, for the client to poll
+    :param job: an `ExportJob`
+    :return: a JSON-serializable dict
+    """
+    return {
+        "id": job.pk,
+        "status": job.status,
+        "finished": job.finished,
+        "error": job.error or None,
+        "status_url": reverse("export_status", args=(job.pk,)),
+        "download_url": (
+            reverse("export_download", args=(job.pk,))
+            if job.status == ExportJob.SUCCESS
+            else None
+        ),
+    }
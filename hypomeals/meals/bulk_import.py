@@ -1,16 +1,44 @@
 # pylint: disable-msg=protected-access
 
+import gzip
+import io
+import itertools
+import json
 import logging
+import multiprocessing
 import time
-from collections import defaultdict
-from typing import Dict, Tuple
+import zlib
+from collections import defaultdict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Tuple, List, Type, Optional, Any, IO, Iterable, Iterator
 
-from cachetools import TTLCache
+import django
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Model, Field
+from django.db.models.fields.related import RelatedField
 
 from meals import utils
-from meals.importers import IMPORTERS, Importer, CollisionOccurredException
-from .models import Sku, FormulaIngredient, ProductLine, Ingredient
+from meals.importers import (
+    IMPORTERS,
+    Importer,
+    CollisionOccurredException,
+    CollisionException,
+    ImportReport,
+    ParsedRow,
+    Resolver,
+    parse_rows,
+)
+from meals.exceptions import UserFacingException
+from .models import (
+    Sku,
+    FormulaIngredient,
+    ProductLine,
+    Ingredient,
+    ImportTransaction,
+    ImportTransactionFile,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -22,44 +50,365 @@ FILE_TYPES = {
     "formulas": FormulaIngredient,
 }
 TOPOLOGICAL_ORDER = ["product_lines", "ingredients", "formulas", "skus"]
-# A self expiring cache for 30 minutes
-TRANSACTION_CACHE = TTLCache(maxsize=10, ttl=1800)
+COMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+class ParallelParser:
+    """
+    Parses the rows of large CSV files in chunks on a process pool. Parsing is
+    CPU-bound, and does not access the database, which is left to the importers in
+    the request's process.
+
+    Rows are read as chunks are submitted, and only a few chunks are in flight at a
+    time, so that the file is never read into memory all at once.
+    """
+
+    def __init__(
+        self, executor: Optional[Executor], chunk_rows: int, max_pending: int = 1
+    ):
+        """
+        :param executor: the process pool to parse rows on. If None, rows are parsed
+            in this process.
+        :param chunk_rows: the number of rows parsed by a process at a time
+        :param max_pending: the maximum number of chunks in flight at a time,
+            usually a small multiple of the number of processes
+        """
+        self.executor = executor
+        self.chunk_rows = chunk_rows
+        self.max_pending = max(max_pending, 1)
+
+    def __call__(
+        self,
+        importer_class: Type[Importer],
+        rows: Iterable[Tuple[int, Dict[str, str]]],
+    ) -> List[ParsedRow]:
+        if self.executor is None:
+            return parse_rows(importer_class, rows)
+        chunks = utils.chunked(rows, self.chunk_rows)
+        first = next(chunks, [])
+        second = next(chunks, None)
+        if second is None:
+            # Small files are not worth sending to another process
+            return parse_rows(importer_class, first)
+
+        start = time.time()
+        num_chunks = 0
+        pending = deque()
+        parsed_rows = []
+        for chunk in itertools.chain([first, second], chunks):
+            pending.append(self.executor.submit(parse_rows, importer_class, chunk))
+            num_chunks += 1
+            if len(pending) >= self.max_pending:
+                parsed_rows.extend(pending.popleft().result())
+                if parsed_rows[-1].error is not None:
+                    break
+        while pending and (not parsed_rows or parsed_rows[-1].error is None):
+            parsed_rows.extend(pending.popleft().result())
+        # The import fails at the first row with an error anyway
+        for future in pending:
+            future.cancel()
+        logger.info(
+            "Parsed %d rows in %d chunks in %6.3f seconds",
+            len(parsed_rows),
+            num_chunks,
+            time.time() - start,
+        )
+        return parsed_rows
+
+
+@contextmanager
+def _parse_executor():
+    if settings.IMPORT_PARSE_WORKERS <= 1:
+        yield None
+        return
+    # Processes are only started once there is a large file to parse. They are
+    # spawned rather than forked, so that they inherit neither the threads nor the
+    # open database connections of the server process. They set up Django on their
+    # own (DJANGO_SETTINGS_MODULE is inherited), but never access the database.
+    executor = ProcessPoolExecutor(
+        max_workers=settings.IMPORT_PARSE_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=django.setup,
+    )
+    try:
+        yield executor
+    finally:
+        executor.shutdown(wait=False)
+
+
+@contextmanager
+def _parser() -> Iterator[ParallelParser]:
+    with _parse_executor() as executor:
+        yield ParallelParser(
+            executor,
+            settings.IMPORT_PARSE_CHUNK_ROWS,
+            max_pending=2 * settings.IMPORT_PARSE_WORKERS,
+        )
+
+
+def _binary_stream(file) -> IO[bytes]:
+    # Uploaded files and ZIP members are wrapped in Django's File
+    return getattr(file, "file", file)
+
+
+def _ordered_files(files) -> List[Tuple[str, str, IO[bytes]]]:
+    """
+    Orders uploaded files in the order they should be imported in.
+    :param files: a dict mapping from file types to uploaded files
+    :return: a list of (file type, filename, binary stream) tuples
+    """
+    return [
+        (file_type, files[file_type].name, _binary_stream(files[file_type]))
+        for file_type in TOPOLOGICAL_ORDER
+        if files.get(file_type)
+    ]
+
+
+@contextmanager
+def _open_text(stream: IO[bytes]) -> Iterator[IO[str]]:
+    """
+    Decodes a binary stream incrementally as it is read, e.g., by a CSV reader.
+    The stream is left open.
+    """
+    text = io.TextIOWrapper(stream, encoding="UTF-8", newline="")
+    try:
+        yield text
+    finally:
+        text.detach()
+
+
+def _import_files(
+    files: List[Tuple[str, str, IO[bytes]]], importers: Dict[str, Importer]
+) -> Dict[str, Tuple[int, int, int]]:
+    """
+    Imports files in order, in the current transaction, including any collisions,
+    which replace the existing records they collided with. Each file is classified
+    against the database as left by the files before it, before its records are
+    written, so the caller may inspect the collisions of every file afterwards, and
+    roll back if there are any.
+    :param files: a list of (file type, filename, binary stream) tuples
+    :param importers: a dict to which the importer used for each file is added, by
+        filename, so that it is available even if an exception is raised
+    :return: a dict mapping from filenames to their (inserted, updated, ignored)
+        numbers of records
+    """
+    results = {}
+    resolver = Resolver()
+    with _parser() as parse:
+        for file_type, filename, stream in files:
+            importer = importers[filename] = IMPORTERS[file_type](filename, resolver)
+            logger.info("Processing %s: %s", file_type, filename)
+            with _open_text(stream) as lines:
+                importer.dry_run(lines, parse)
+            results[filename] = importer.commit()
+    logger.info("Resolved references: %s", resolver)
+    return results
+
+
+def _summarize_collisions(
+    importers: Dict[str, Importer],
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Summarizes the collisions of every file for review
+    :param importers: a dict mapping from filenames to the importers used
+    :return: a dict mapping from the filenames with collisions to the summaries of
+        their collisions, as returned by summarize_collision(), in JSON form
+    """
+    return json.loads(
+        json.dumps(
+            {
+                filename: [
+                    summarize_collision(collision) for collision in importer.collisions
+                ]
+                for filename, importer in importers.items()
+                if importer.collisions
+            }
+        )
+    )
 
 
-@transaction.atomic
 @utils.log_exceptions(logger=logger)
 def process_csv_files(files, session_key: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+    files = _ordered_files(files)
+    clear_transaction(session_key)
+    importers = {}
+    with transaction.atomic():
+        results = _import_files(files, importers)
+        collisions = _summarize_collisions(importers)
+        if collisions:
+            # Nothing is kept until the collisions of every file have been reviewed
+            transaction.set_rollback(True)
+    if collisions:
+        _stage_transaction(session_key, files, collisions)
+        raise CollisionOccurredException
     inserted = defaultdict(lambda: 0)
     ignored = defaultdict(lambda: 0)
-    for file_type in TOPOLOGICAL_ORDER:
-        if file_type in files:
-            stream = files[file_type]
-            if not stream:
-                continue
-            importer = IMPORTERS[file_type](stream.name)
-            logger.info("Processing %s: %s", file_type, stream)
-            lines = stream.read().decode("UTF-8").splitlines()
-            try:
-                num_inserted, _, num_ignored = importer.do_import(lines)
-            except CollisionOccurredException:
-                if session_key not in TRANSACTION_CACHE:
-                    TRANSACTION_CACHE[session_key] = {}
-                TRANSACTION_CACHE[session_key][stream.name] = importer
-                raise
-            inserted[importer.model_name] = num_inserted
-            ignored[importer.model_name] = num_ignored
+    for filename, (num_inserted, _, num_ignored) in results.items():
+        model_name = importers[filename].model_name
+        inserted[model_name] = num_inserted
+        ignored[model_name] = num_ignored
 
     return inserted, ignored
 
 
+def preview_csv_files(files, resolver: Resolver = None) -> List[ImportReport]:
+    """
+    Computes what importing files would do, and how long each phase takes, without
+    keeping anything in the database.
+
+    Each file is dry run to compute its diff. Its records are then written, so that
+    the files after it may refer to them, and so that writing is timed too. All of
+    it is rolled back at the end.
+    :param files: a dict mapping from file types to uploaded files, or binary streams
+    :param resolver: the `Resolver` to look up references with, e.g., to inspect
+        its hits and misses afterwards
+    :return: a list of `ImportReport`s, one for each file, in the order they would
+        be imported in
+    """
+    reports = []
+    resolver = resolver or Resolver()
+    with transaction.atomic():
+        with _parser() as parse:
+            for file_type, filename, stream in _ordered_files(files):
+                importer = IMPORTERS[file_type](filename, resolver)
+                with _open_text(stream) as lines:
+                    importer.dry_run(lines, parse)
+                importer.commit()
+                reports.append(importer.report())
+                logger.info("Previewed %s", reports[-1])
+        transaction.set_rollback(True)
+    return reports
+
+
+def _field_value(instance: Model, field: Field) -> Any:
+    value = getattr(instance, field.name, None)
+    # Related instances may not be saved yet, so they are compared as displayed
+    if isinstance(field, RelatedField) and value is not None:
+        return str(value)
+    return value
+
+
+def summarize_collision(collision: CollisionException) -> Dict[str, Any]:
+    """
+    Summarizes a collision for review, as a JSON-serializable dict
+    :param collision: a collision
+    :return: a dict with the primary key of the existing record, and a list of
+        [field name, old value, new value] of the fields which differ, with the values
+        formatted for display
+    """
+    old, new = collision.old_instance, collision.new_instance
+    differences = []
+    for field in old._meta.fields:
+        if field.primary_key or not field.editable:
+            continue
+        old_value = _field_value(old, field)
+        new_value = _field_value(new, field)
+        if old_value != new_value:
+            differences.append(
+                [
+                    field.verbose_name,
+                    str(old_value) if old_value else None,
+                    str(new_value) if new_value else None,
+                ]
+            )
+    return {"pk": str(old.pk), "differences": differences}
+
+
+def _compress(data: str) -> bytes:
+    return zlib.compress(data.encode("UTF-8"))
+
+
+def _compress_stream(stream: IO[bytes]) -> bytes:
+    """Compresses a binary stream from its start, a chunk at a time"""
+    stream.seek(0)
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as compressed:
+        for chunk in utils.chunked_read(stream, COMPRESS_CHUNK_SIZE):
+            compressed.write(chunk)
+    return buffer.getvalue()
+
+
+def _decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode("UTF-8")
+
+
+def _stage_transaction(
+    session_key: str,
+    files: List[Tuple[str, str, IO[bytes]]],
+    collisions: Dict[str, List[Dict[str, Any]]],
+) -> ImportTransaction:
+    """
+    Stages an import with collisions in the database until it is confirmed or
+    aborted.
+    :param session_key: the session key of the user importing
+    :param files: a list of (file type, filename, binary stream) tuples
+    :param collisions: the summaries of the collisions of every file, as returned by
+        _summarize_collisions()
+    :return: the staged `ImportTransaction`
+    :raise: `UserFacingException` if the import is too large to be staged
+    """
+    collisions = _compress(json.dumps(collisions))
+    files = [
+        ImportTransactionFile(
+            file_type=file_type, filename=filename, content=_compress_stream(stream)
+        )
+        for file_type, filename, stream in files
+    ]
+    size = len(collisions) + sum(len(file.content) for file in files)
+    if size > settings.IMPORT_TRANSACTION_MAX_SIZE:
+        raise UserFacingException(
+            f"Collisions were detected, but the import is too large to be reviewed "
+            f"({size} bytes compressed). Please import fewer records at a time."
+        )
+    ImportTransaction.purge_expired()
+    with transaction.atomic():
+        tx = ImportTransaction.objects.create(
+            session_key=session_key, collisions=collisions, size=size
+        )
+        for file in files:
+            file.transaction = tx
+        ImportTransactionFile.objects.bulk_create(files)
+    logger.info(
+        "Staged transaction with key=%s: %d bytes (%d bytes in total)",
+        session_key,
+        size,
+        ImportTransaction.total_size(),
+    )
+    return tx
+
+
 @transaction.atomic
-def _force_save(tx: Dict[str, Importer]):
+def _force_save(tx: ImportTransaction):
+    """
+    Imports the staged files, replacing the records they collide with, provided that
+    the collisions are still those which were reviewed
+    :param tx: the staged `ImportTransaction`
+    :return: a 3-tuple of dicts mapping from filenames to the numbers of records
+        inserted, updated and ignored
+    :raise: `UserFacingException` if the collisions have changed since, in which case
+        nothing is imported
+    """
     start = time.time()
-    inserted = {}
-    updated = {}
-    ignored = {}
-    for filename, importer in tx.items():
-        inserted[filename], updated[filename], ignored[filename] = importer.commit()
+    files = [
+        (
+            file.file_type,
+            file.filename,
+            gzip.GzipFile(fileobj=io.BytesIO(file.content), mode="rb"),
+        )
+        for file in tx.files.order_by("pk")
+    ]
+    importers = {}
+    results = _import_files(files, importers)
+    if _summarize_collisions(importers) != json.loads(_decompress(tx.collisions)):
+        logger.warning("Collisions of transaction %s changed since review", tx)
+        raise UserFacingException(
+            "The records which the import collides with have changed since the "
+            "collisions were reviewed. Nothing was imported. Please import the files "
+            "again to review the new collisions."
+        )
+    inserted = {filename: result[0] for filename, result in results.items()}
+    updated = {filename: result[1] for filename, result in results.items()}
+    ignored = {filename: result[2] for filename, result in results.items()}
     end = time.time()
     logger.info(
         "Inserted %d, updated %d, ignored %d records in %6.3f seconds",
@@ -73,26 +422,34 @@ def _force_save(tx: Dict[str, Importer]):
 
 def force_save(session_key, force=False):
     result = {}, {}, {}
-    if session_key in TRANSACTION_CACHE:
+    tx = ImportTransaction.active().filter(session_key=session_key).first()
+    if tx is not None:
         logger.info("Found ongoing transaction.")
-        if force:
-            logger.info("Loading from transaction cache. session_key=%s", session_key)
-            cached_transaction = TRANSACTION_CACHE[session_key]
-            logger.info("Successfully loaded transaction")
-            result = _force_save(cached_transaction)
-        del TRANSACTION_CACHE[session_key]
-        logger.info("Deleted transaction with key=%s", session_key)
+        try:
+            if force:
+                logger.info("Loading staged transaction. session_key=%s", session_key)
+                result = _force_save(tx)
+        finally:
+            tx.delete()
+            logger.info("Deleted transaction with key=%s", session_key)
     return result
 
 
 def has_ongoing_transaction(session_key):
-    return session_key in TRANSACTION_CACHE
+    return ImportTransaction.active().filter(session_key=session_key).exists()
 
 
-def get_transaction(session_key):
-    return TRANSACTION_CACHE[session_key]
+def get_transaction(session_key) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Retrieves the collisions of a staged import
+    :param session_key: the session key of the user importing
+    :return: a dict mapping from filenames to the summaries of their collisions, as
+        returned by summarize_collision()
+    :raise: `ImportTransaction.DoesNotExist` if there is no staged import
+    """
+    tx = ImportTransaction.active().get(session_key=session_key)
+    return json.loads(_decompress(tx.collisions))
 
 
 def clear_transaction(session_key):
-    if session_key in TRANSACTION_CACHE:
-        del TRANSACTION_CACHE[session_key]
+    ImportTransaction.objects.filter(session_key=session_key).delete()
@@ -6,6 +6,7 @@ from collections import OrderedDict, defaultdict
 from datetime import timedelta
 from decimal import Decimal
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from django import forms
 from django.contrib.auth.models import Group
@@ -39,6 +40,7 @@ from meals.models import (
     User,
     Sku,
     Sale,
+    SalesRollup,
     Ingredient,
     ProductLine,
     Upc,
@@ -46,6 +48,8 @@ from meals.models import (
     Unit,
     Customer,
 )
+from meals.pagination import KeysetPage, KeysetPaginator
+from meals.projections import Projection, project_sales
 from meals.utils import BootstrapFormControlMixin, FilenameRegexValidator
 
 logger = logging.getLogger(__name__)
@@ -231,13 +235,12 @@ def get_sku_choices():
 
 
 def get_unit_choices(unit_type=None):
+    units = Unit.registry()
     if unit_type is None:
-        return [
-            (un.symbol, f"{un.symbol} ({un.verbose_name})") for un in Unit.objects.all()
-        ]
+        return [(un.symbol, f"{un.symbol} ({un.verbose_name})") for un in units.units]
     return [
         (un.symbol, f"{un.symbol} ({un.verbose_name})")
-        for un in Unit.objects.filter(unit_type=unit_type)
+        for un in units.of_type(unit_type)
     ]
 
 
@@ -540,10 +543,11 @@ class EditIngredientForm(forms.ModelForm):
                 data["vendor"] = data["custom_vendor"]
             qs = Vendor.objects.filter(info=data["vendor"])
             data["vendor"] = qs[0] if qs.exists() else Vendor(info=data["vendor"])
-        if "unit" not in data or not Unit.objects.filter(symbol=data["unit"]).exists():
+        unit = Unit.registry().get(data["unit"]) if "unit" in data else None
+        if unit is None:
             raise ValidationError("You must specify a Unit")
         else:
-            data["unit"] = Unit.objects.filter(symbol=data["unit"])[0]
+            data["unit"] = unit
 
         return data
 
@@ -562,10 +566,17 @@ class EditIngredientForm(forms.ModelForm):
 
 class SaleFilterForm(forms.Form, utils.BootstrapFormControlMixin):
     NUM_PER_PAGE_CHOICES = [(i, str(i)) for i in range(50, 501, 50)] + [(-1, "All")]
+    # A unique ordering, matched by an index when filtering by SKU
+    ORDERING = ("year", "week", "customer_id", "id")
+    # Counting more sales than this would take longer than showing them
+    APPROXIMATE_COUNT_THRESHOLD = 10000
 
     page_num = forms.IntegerField(
         widget=forms.HiddenInput(), initial=1, min_value=1, required=False
     )
+    # Cursors of the page to show, see `KeysetPaginator.page`
+    after = forms.CharField(widget=forms.HiddenInput(), required=False)
+    before = forms.CharField(widget=forms.HiddenInput(), required=False)
     num_per_page = forms.ChoiceField(choices=NUM_PER_PAGE_CHOICES, required=True)
 
     sku = forms.IntegerField(required=False)
@@ -594,17 +605,15 @@ class SaleFilterForm(forms.Form, utils.BootstrapFormControlMixin):
 
         return self.cleaned_data
 
-    def query(self) -> Paginator:
+    def _date_filter(self) -> Q:
+        """Selects the weeks between the start and end dates, inclusive"""
         params = self.cleaned_data
-        num_per_page = int(params.get("num_per_page", 50))
         query_filter = Q()
-        if params["sku"]:
-            query_filter &= Q(sku__number=params["sku"])
-        if params["customer"]:
-            query_filter &= Q(customer__name__in=params["customer"])
         if params["start"] and params["end"]:
             start_year, start_week, _ = params["start"].isocalendar()
             end_year, end_week, _ = params["end"].isocalendar()
+            # Implied by the conditions below, but lets indexes bound the year range
+            query_filter &= Q(year__range=(start_year, end_year))
             # year < end_year || (year == end_year && week <= end_week)
             query_filter &= Q(year__lt=end_year) | (
                 Q(year=end_year) & Q(week__lte=end_week)
@@ -613,12 +622,72 @@ class SaleFilterForm(forms.Form, utils.BootstrapFormControlMixin):
             query_filter &= Q(year__gt=start_year) | (
                 Q(year=start_year) & Q(week__gte=start_week)
             )
-        query = Sale.objects.filter(query_filter).annotate(
-            revenue=F("sales") * F("price")
+        return query_filter
+
+    def query(self) -> KeysetPaginator:
+        params = self.cleaned_data
+        num_per_page = int(params.get("num_per_page", 50))
+        query_filter = self._date_filter()
+        if params["sku"]:
+            query_filter &= Q(sku__number=params["sku"])
+        if params["customer"]:
+            query_filter &= Q(customer__name__in=params["customer"])
+        query = (
+            Sale.objects.filter(query_filter)
+            .select_related("customer")
+            .annotate(revenue=F("sales") * F("price"))
         )
-        if num_per_page == -1:
-            num_per_page = query.count()
-        return Paginator(query.distinct(), num_per_page)
+        # Sales are only joined with single-valued relations, so no duplicate rows
+        # can arise: DISTINCT would only add a sort over every column
+        return KeysetPaginator(
+            query,
+            num_per_page if num_per_page != -1 else None,
+            ordering=self.ORDERING,
+            approximate_count_threshold=self.APPROXIMATE_COUNT_THRESHOLD,
+        )
+
+    def page(self, paginator: KeysetPaginator) -> KeysetPage:
+        """
+        Retrieves the page of sales selected by the page number and cursor fields.
+        Falls back to the first page if the cursors are invalid.
+        """
+        params = self.cleaned_data
+        try:
+            return paginator.page(
+                params.get("page_num") or 1,
+                after=params.get("after"),
+                before=params.get("before"),
+            )
+        except ValueError:
+            logger.warning("Ignoring invalid sales cursors in %s", params)
+            return paginator.page()
+
+    def weekly_revenues(self) -> List[Tuple[int, int, Decimal]]:
+        """
+        Computes the total revenue of the matching sales in each week, aggregated
+        by the database. Without a customer filter, the weekly totals are read from
+        the sales rollup instead of the sales records.
+        :return: a list of (year, week, revenue) tuples, ordered by year and week
+        """
+        params = self.cleaned_data
+        query_filter = self._date_filter()
+        if params["sku"]:
+            query_filter &= Q(sku=params["sku"])
+        if params["customer"]:
+            query = (
+                Sale.objects.filter(query_filter, customer__name__in=params["customer"])
+                .values("year", "week")
+                .annotate(total=Sum(F("sales") * F("price")))
+            )
+        else:
+            query = (
+                SalesRollup.objects.filter(
+                    query_filter, customer__isnull=True, week__isnull=False
+                )
+                .values("year", "week")
+                .annotate(total=Sum("revenue"))
+            )
+        return list(query.order_by("year", "week").values_list("year", "week", "total"))
 
 
 class SkuFilterForm(forms.Form, utils.BootstrapFormControlMixin):
@@ -731,9 +800,10 @@ class ProductLineFilterForm(forms.Form, utils.BootstrapFormControlMixin):
             )
         if params["product_lines"]:
             query_filter &= Q(name__in=params["product_lines"])
-        customers_filtered = Customer.objects.all()
+        # None means "all customers", for which the sales rollup keeps separate totals
+        customers_filtered = None
         if params["customers"]:
-            customers_filtered = customers_filtered.filter(name__in=params["customers"])
+            customers_filtered = Customer.objects.filter(name__in=params["customers"])
 
         query = ProductLine.objects.filter(query_filter)
         if sort_by:
@@ -1041,7 +1111,7 @@ class FormulaForm(forms.Form, utils.BootstrapFormControlMixin):
             formula=formula,
             ingredient=self.cleaned_data["ingredient"],
             quantity=self.cleaned_data["quantity"],
-            unit=Unit.objects.filter(symbol=self.cleaned_data["unit"])[0],
+            unit=Unit.registry().get_or_raise(self.cleaned_data["unit"]),
         )
         if commit:
             instance.save()
@@ -1075,7 +1145,7 @@ class FormulaFormsetBase(forms.BaseFormSet):
                 )
             else:
                 ingredients[ingr_number] = index
-            user_input_unit = Unit.objects.filter(symbol=form.cleaned_data["unit"])[0]
+            user_input_unit = Unit.registry().get_or_raise(form.cleaned_data["unit"])
             user_input_type = user_input_unit.unit_type
             if ingr_unit.unit_type != user_input_type:
                 errors.append(
@@ -1511,30 +1581,36 @@ class ProjectionsFilterForm(forms.Form, utils.BootstrapFormControlMixin):
 
         return self.cleaned_data
 
-    def query(self, sku_number):
+    def window(self) -> Tuple[int, int, int, int]:
+        """
+        Determines the history to base projections on: the selected window of weeks,
+        in each of the last few years for which the window has passed.
+        :return: a 4-tuple (start year, end year, start week, end week)
+        """
         params = self.cleaned_data
-        data = {}
-        sku_filter = Q(sku__pk=sku_number)
-        if params["start"] and params["end"]:
-            cur_year, cur_week, _ = datetime.today().isocalendar()
-            _, start_week, _ = params["start"].isocalendar()
-            _, end_week, _ = params["end"].isocalendar()
-            if end_week > cur_week:
-                # If this year's data for the time span user selected is not
-                # available, we will start with the previous year's data
-                end_year = cur_year - 1
-            else:
-                end_year = cur_year
-
-            year_span = 4
-            start_year = end_year - year_span + 1
-            for year in range(start_year, end_year + 1):
-                query_filter = (
-                    sku_filter
-                    & Q(year=year)
-                    & Q(week__gte=start_week)
-                    & Q(week__lte=end_week)
-                )
-                query = Sale.objects.filter(query_filter).aggregate(Sum("sales"))
-                data[year] = query["sales__sum"] or Decimal("0")
-        return data
+        cur_year, cur_week, _ = datetime.today().isocalendar()
+        _, start_week, _ = params["start"].isocalendar()
+        _, end_week, _ = params["end"].isocalendar()
+        if end_week > cur_week:
+            # If this year's data for the time span user selected is not
+            # available, we will start with the previous year's data
+            end_year = cur_year - 1
+        else:
+            end_year = cur_year
+
+        year_span = 4
+        start_year = end_year - year_span + 1
+        return start_year, end_year, start_week, end_week
+
+    def query_many(self, sku_numbers: Iterable[int]) -> Dict[int, Projection]:
+        """
+        Projects the sales of many SKUs at once.
+        :param sku_numbers: numbers of the SKUs to project
+        :return: a dict mapping SKU numbers to their projections
+        """
+        if not (self.cleaned_data["start"] and self.cleaned_data["end"]):
+            return {}
+        return project_sales(sku_numbers, *self.window())
+
+    def query(self, sku_number) -> Optional[Projection]:
+        return self.query_many([sku_number]).get(int(sku_number))
@@ -9,9 +9,11 @@ import itertools
 import logging
 import operator
 import re
+import time
 import traceback
 from abc import ABC
 from collections import defaultdict
+from contextlib import contextmanager
 from dataclasses import dataclass
 from decimal import Decimal, InvalidOperation
 from typing import (
@@ -25,12 +27,15 @@ from typing import (
     Sequence,
     Union,
     Generic,
-    Iterable)
+    Iterable,
+    Iterator,
+    Callable,
+)
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.db import transaction
-from django.db.models import Model, AutoField, Field
+from django.db.models import Model, AutoField, Field, QuerySet
 from django.db.models.fields.related import RelatedField
 from django.db.models.options import Options
 
@@ -189,6 +194,7 @@ class CollisionException(Exception, Generic[T]):
 class Record(Generic[T]):
     instance: Union[T, CollisionException[T]]
     m2m: M2MType
+    line_num: Optional[int] = None
 
 
 class IdenticalRecord(Exception, Generic[T]):
@@ -234,6 +240,188 @@ class ImportException(Exception):
     pass
 
 
+@dataclass
+class ParsedRow:
+    line_num: int
+    raw: Dict[str, str]
+    row: Optional[Dict[str, Any]] = None
+    # The exception raised while parsing the row, if any
+    error: Optional[Exception] = None
+
+
+@dataclass
+class ImportReport:
+    """
+    What an import did, or would do in a dry run, and the time spent in each phase
+    """
+
+    filename: str
+    model_name: str
+    num_rows: int
+    inserted: List[Model]
+    updated: List[CollisionException]
+    ignored: List[Model]
+    # Seconds spent in each phase, i.e., parse, resolve, classify and write
+    timings: Dict[str, float]
+
+    def throughput(self) -> Dict[str, float]:
+        """
+        :return: a dict mapping from each phase, and "total", to the number of rows
+            processed per second
+        """
+        timings = dict(self.timings, total=sum(self.timings.values()))
+        return {
+            phase: self.num_rows / seconds
+            for phase, seconds in timings.items()
+            if seconds > 0
+        }
+
+    def __str__(self) -> str:
+        throughput = self.throughput()
+        result = (
+            f"{self.filename} ({self.model_name}): {self.num_rows} rows, "
+            f"{len(self.inserted)} inserted, {len(self.updated)} updated, "
+            f"{len(self.ignored)} ignored"
+        )
+        for phase, seconds in dict(
+            self.timings, total=sum(self.timings.values())
+        ).items():
+            result += (
+                f"\n\t{phase:<10}{seconds:8.3f} s"
+                f"{throughput.get(phase, 0):12.0f} rows/s"
+            )
+        return result
+
+
+class Lookup(Generic[T]):
+    """
+    Instances of a model keyed by one of its fields, loaded with a single query, so
+    that rows referring to them can be resolved without querying the database.
+    Instances created during an import can be added, so that later rows find them.
+    """
+
+    def __init__(
+        self,
+        model: Type[T],
+        field_name: str,
+        values: Iterable[Any] = (),
+        queryset: QuerySet = None,
+    ):
+        """
+        :param model: the model to look up
+        :param field_name: the field by which instances are looked up
+        :param values: all values that may be looked up. Values which are not valid
+            for the field are ignored.
+        :param queryset: the queryset to load instances from, e.g., to select related
+            objects. Defaults to all instances of the model.
+        """
+        self.model = model
+        self.field = model._meta.get_field(field_name)
+        self.queryset = model.objects.all() if queryset is None else queryset
+        self._instances: Dict[Any, T] = {}
+        # Keys which are either loaded or known not to exist
+        self._known = set()
+        self.hits = 0
+        self.misses = 0
+        self.load(values)
+
+    def _key(self, value: Any) -> Any:
+        try:
+            return self.field.to_python(value)
+        except ValidationError:
+            return None
+
+    def load(self, values: Iterable[Any]) -> None:
+        """
+        Loads the instances for values which haven't been loaded yet, with a single
+        query.
+        :param values: values that may be looked up
+        """
+        keys = {self._key(value) for value in values} - {None}
+        missing = keys - self._known
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if not missing:
+            return
+        for instance in self.queryset.filter(**{f"{self.field.name}__in": missing}):
+            self._instances[getattr(instance, self.field.attname)] = instance
+        self._known |= missing
+
+    def get(self, value: Any) -> Optional[T]:
+        key = self._key(value)
+        return None if key is None else self._instances.get(key)
+
+    def add(self, instance: T) -> T:
+        key = getattr(instance, self.field.attname)
+        self._instances[key] = instance
+        self._known.add(key)
+        return instance
+
+
+class Resolver:
+    """
+    The lookups of an import, shared by the importers of all its files, so that
+    each referenced instance is loaded at most once. Instances written by earlier
+    files (see bulk_import.TOPOLOGICAL_ORDER) are added, so that later files find
+    them without querying the database.
+    """
+
+    def __init__(self):
+        self._lookups: Dict[Tuple[Type[Model], str], Lookup] = {}
+        self._created: Dict[Type[Model], List[Model]] = defaultdict(list)
+
+    def lookup(
+        self,
+        model: Type[T],
+        field_name: str,
+        values: Iterable[Any],
+        queryset: QuerySet = None,
+    ) -> Lookup[T]:
+        """
+        Finds the lookup of a model by a field, loading any values which haven't
+        been loaded yet. The arguments are the same as Lookup's.
+        :return: the `Lookup`
+        """
+        lookup = self._lookups.get((model, field_name))
+        if lookup is None:
+            lookup = self._lookups[model, field_name] = Lookup(
+                model, field_name, queryset=queryset
+            )
+            for instance in self._created[model]:
+                lookup.add(instance)
+        lookup.load(values)
+        return lookup
+
+    def add(self, instances: Iterable[Model]) -> None:
+        """
+        Adds instances which were just written to the database to the lookups of
+        their models, replacing any existing instances with the same keys.
+        :param instances: saved instances
+        """
+        for instance in instances:
+            model = type(instance)
+            self._created[model].append(instance)
+            for (lookup_model, _), lookup in self._lookups.items():
+                if lookup_model is model:
+                    lookup.add(instance)
+
+    def stats(self) -> Dict[str, Tuple[int, int]]:
+        """
+        :return: a dict mapping from each lookup, e.g., "Formula.number", to its
+            numbers of hits and misses, i.e., values found without and with a query
+        """
+        return {
+            f"{model.__name__}.{field_name}": (lookup.hits, lookup.misses)
+            for (model, field_name), lookup in self._lookups.items()
+        }
+
+    def __str__(self) -> str:
+        return ", ".join(
+            f"{name}: {hits} hits, {misses} misses"
+            for name, (hits, misses) in self.stats().items()
+        )
+
+
 class Importer(ABC, Generic[T]):
 
     file_type: str  # the type of CSV file
@@ -245,6 +433,9 @@ class Importer(ABC, Generic[T]):
     fields: Dict[str, Field]  # mapping of all fields in the model
     field_dict: Dict[str, str] = {}
     unique_fields: List[KeyType] = []
+    # Generates primary keys of new instances without one, as in the model's save()
+    next_key: Callable[[Any], Any] = staticmethod(lambda key: key + 1)
+    default_key: Any = 0
 
     def __new__(cls, *args, **kwargs):
         if cls.model is None:
@@ -255,19 +446,24 @@ class Importer(ABC, Generic[T]):
         if cls.model_name is None:
             cls.model_name = cls.model_opts.model_name
         cls.primary_key = cls.model_opts.pk
-        return super().__new__(cls, *args, **kwargs)
+        return super().__new__(cls)
 
-    def __init__(self, filename: str = None):
+    def __init__(self, filename: str = None, resolver: Resolver = None):
         self._instances: List[Record[T]] = []
         self._collisions: List[Record[T]] = []
         self._ignored: List[Record[T]] = []
         self.unique_dict: Dict[KeyType, Dict[ValueType, int]] = defaultdict(dict)
         self.filename = filename or "<unknown file>"
+        # Shared with the importers of the other files in the same import
+        self.resolver = resolver or Resolver()
         self._is_bound = False
+        self.num_rows = 0
+        self.timings: Dict[str, float] = {}
         self.fields = {
             field.name: field
             for field in self.model_opts.fields
-            if not isinstance(field, AutoField)
+            # Fields which aren't editable are derived from other data
+            if not isinstance(field, AutoField) and field.editable
         }
         self.unique_fields = [
             (field_name,) for field_name, field in self.fields.items() if field.unique
@@ -294,74 +490,71 @@ class Importer(ABC, Generic[T]):
         return f"<{self.__class__.__name__}: {self.filename} is_bound:{self.is_bound}>"
 
     @transaction.atomic
-    def do_import(self, lines: List[str]) -> Tuple[int, int, int]:
+    def do_import(
+        self, lines: Iterable[str], parse: "ParseFunc" = None
+    ) -> Tuple[int, int, int]:
         """
         This is the core of every importer, and performs the bulk of all functionality.
 
-        It does a few things, all of which are delegated to private methods so they can
-        be overriden for different object models, in this order:
-        * Apply _process_row to the raw row data
-        * Call _check_duplicates on the row to check for duplicates in the same file
-        * Call _construct_instance to create a new instance of the record
-        * Call _save to detect duplicates / ambiguous records / collisions in the
-            database
+        Rows are processed in bulk, in a few phases, all of which are delegated to
+        private methods so they can be overriden for different object models:
+        * Apply _parse_row to each row to convert it without accessing the database.
+            This is CPU-bound, and may be done on many processes (see parse_rows).
+        * Call _prefetch with all rows to load every instance they refer to, using
+            one query per referenced model
+        * Apply _process_row to each row to resolve the instances it refers to, and
+            call _check_duplicates on it to check for duplicates in the same file
+        * Call _construct_record to create a new instance of each record
+        * Call _classify to detect duplicates / ambiguous records / collisions in the
+            database, by looking up all existing instances at once
+        * Call _write to save all new instances with bulk_create
         * Call _save_m2m to save any ManyToManyRelationship, for example, the
-            ingredients to a formula.
+            manufacturing lines of SKUs.
         * Call _post_process to handle any data that requires special handling, for
             example, saving FormulaIngredients.
 
+        The time spent in each phase (parse, resolve, classify and write) is recorded in
+        `timings`. dry_run performs all but the last phase, without writing anything.
+
         In these circumstances, import fails with all operations rolled back:
         * When any of the processing returns any exception
         * When a duplicate is detected within the file
         * When an ambiguous record is detected with existing database records
         * When at least one collision is detected
-        :param lines: a list of lines from the CSV file, usually as a result of a call
-            to splitlines().
+        :param lines: the lines of the CSV file, including the header. This may be a
+            text stream, so that the file is never read into memory all at once.
+        :param parse: a function to parse rows with, in place of parse_rows(), e.g.,
+            to parse them in parallel
         :return: a 3-tuple of (inserted, updated, ignored) numbers of instances
         """
-        reader = csv.DictReader(lines[1:], fieldnames=self.header, dialect="unix")
-        num_processed = 0
-        for line_num, row in enumerate(reader, start=2):
-            try:
-                converted_row = self._process_row(
-                    copy.copy(row), self.filename, line_num
-                )
-                self._check_duplicates(row, converted_row, self.filename, line_num)
-                record = self._construct_record(converted_row)
-                try:
-                    record = self._save(record, self.filename, line_num)
-                except CollisionException as e:
-                    self._collisions.append(Record(e, record.m2m))
-                except IdenticalRecord as e:
-                    self._ignored.append(e.record)
-                else:
-                    self._instances.append(record)
-                self._save_m2m(record)
-            except Skip:
-                continue
-            except UserFacingException as e:
-                e.message = f"{self.filename}:{line_num}: " + e.message
-                raise e
-            finally:
-                num_processed += 1
-
-        self._is_bound = True
-        logger.info(
-            "Processed %d records of model %s (%d collisions)",
-            num_processed,
-            self.model_name,
-            len(self._collisions),
-        )
-        if not self._collisions:
-            self._post_process()
-        else:
+        self._prepare(lines, parse)
+        if self._collisions:
+            # Nothing is written, as the transaction is rolled back anyway
             raise CollisionOccurredException
+        with self._timed("write"):
+            self._write(self._instances)
+            self._save_m2m(self._instances + self._ignored)
+            self._post_process()
+        self.resolver.add(self.instances)
         return len(self.instances), len(self.collisions), len(self.ignored)
 
+    def dry_run(self, lines: Iterable[str], parse: "ParseFunc" = None) -> ImportReport:
+        """
+        Computes what do_import would do, without writing anything to the database.
+        The importer is bound afterwards, so its records may still be committed.
+        :param lines: the lines of the CSV file, including the header
+        :param parse: a function to parse rows with, as in do_import
+        :return: an `ImportReport` of the records which would be inserted, updated
+            and ignored, and the time spent parsing, resolving and classifying them
+        """
+        self._prepare(lines, parse)
+        return self.report()
+
     @transaction.atomic
     def commit(self) -> Tuple[int, int, int]:
         """
-        Force commits all instances, including collisions.
+        Force commits all instances, including collisions, which replace the existing
+        instances they collided with.
         :return: a 3-tuple (inserted, updated, ignored) of integers representing the
             numbers of instances in each category.
         """
@@ -370,32 +563,149 @@ class Importer(ABC, Generic[T]):
                 "Data corruption detected. Please try importing "
                 "again. Error code: ENOTBOUND"
             )
-        for instance in self._instances:
-            self.__save(instance.instance)
-            self._save_m2m(instance)
-
-        for record in self._collisions:
-            ex = record.instance
-            ex.old_instance.delete()
-            self.__save(ex.new_instance)
-            self._save_m2m(record)
-
-        for record in self._ignored:
-            # Even though the instance itself is ignored, it doesn't mean that
-            # its M2M fields haven't changed. We save those here.
-            self._save_m2m(record)
-
-        self._post_process()
+        with self._timed("write"):
+            self._write(self._instances)
+            self._update(self._collisions)
+            # Even though ignored instances themselves are not saved, it doesn't mean
+            # that their M2M fields haven't changed. We save those here.
+            self._save_m2m(self._instances + self._collisions + self._ignored)
+            self._post_process()
+        self.resolver.add(
+            self.instances + [collision.new_instance for collision in self.collisions]
+        )
         return len(self.instances), len(self.collisions), len(self.ignored)
 
+    def report(self) -> ImportReport:
+        """
+        :return: an `ImportReport` of the records processed so far, and the time
+            spent in each phase
+        """
+        return ImportReport(
+            filename=self.filename,
+            model_name=self.model_name,
+            num_rows=self.num_rows,
+            inserted=self.instances,
+            updated=self.collisions,
+            ignored=self.ignored,
+            timings=dict(self.timings),
+        )
+
+    @contextmanager
+    def _timed(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] = (
+                self.timings.get(phase, 0) + time.perf_counter() - start
+            )
+
+    def _prepare(self, lines: Iterable[str], parse: "ParseFunc" = None) -> None:
+        """
+        Parses all rows, resolves the instances they refer to, and classifies them as
+        new, identical or colliding records, without writing anything. Only
+        existing instances are looked up in the database, in bulk.
+        :param lines: the lines of the CSV file, including the header
+        :param parse: a function to parse rows with, in place of parse_rows()
+        """
+        with self._timed("parse"):
+            parsed_rows = (parse or parse_rows)(type(self), self.read_rows(lines))
+        with self._timed("resolve"):
+            self._prefetch(
+                [parsed.row for parsed in parsed_rows if parsed.error is None]
+            )
+            records = []
+            for parsed in parsed_rows:
+                line_num, row = parsed.line_num, parsed.raw
+                try:
+                    if parsed.error is not None:
+                        raise parsed.error
+                    converted_row = self._process_row(
+                        parsed.row, self.filename, line_num
+                    )
+                    self._check_duplicates(row, converted_row, self.filename, line_num)
+                    record = self._construct_record(converted_row, line_num)
+                    record.line_num = line_num
+                    records.append(record)
+                except Skip:
+                    continue
+                except UserFacingException as e:
+                    e.message = f"{self.filename}:{line_num}: " + e.message
+                    raise e
+        with self._timed("classify"):
+            self._classify(records)
+
+        self._is_bound = True
+        self.num_rows = len(parsed_rows)
+        logger.info(
+            "Processed %d records of model %s (%d collisions)",
+            len(parsed_rows),
+            self.model_name,
+            len(self._collisions),
+        )
+
+    @classmethod
+    def read_rows(cls, lines: Iterable[str]) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """
+        Reads the raw rows in a CSV file, one at a time.
+        :param lines: the lines of the CSV file, including the header
+        :return: an iterator of (line number, raw row) pairs
+        """
+        lines = iter(lines)
+        next(lines, None)  # the header
+        reader = csv.DictReader(lines, fieldnames=cls.header, dialect="unix")
+        return enumerate(reader, start=2)
+
+    @classmethod
+    def parse_rows(
+        cls, rows: Iterable[Tuple[int, Dict[str, str]]]
+    ) -> List["ParsedRow"]:
+        """
+        Applies _parse_row to raw rows. Since the import fails at the first error, no
+        row is parsed, or read, after a row that failed.
+        :param rows: an iterable of (line number, raw row) pairs
+        :return: a list of `ParsedRow`s, the last of which may have an error
+        """
+        parsed_rows = []
+        for line_num, raw in rows:
+            try:
+                parsed_rows.append(
+                    ParsedRow(line_num, raw, cls._parse_row(copy.copy(raw)))
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                # Raised later on, in the order of rows
+                parsed_rows.append(ParsedRow(line_num, raw, error=e))
+                break
+        return parsed_rows
+
+    @classmethod
+    def _parse_row(cls, row: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        This method takes the raw CSV row, and converts its values without accessing
+        the database, e.g., parsing numbers and USD or unit expressions. It may be
+        called in another process, so it must not depend on the state of the importer.
+        :param row: a copy of the raw CSV row
+        :return: a parsed row. This will be passed to _process_row().
+        """
+        return row
+
+    def _prefetch(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Loads every instance referred to by the parsed rows before any row is
+        processed, typically into `Lookup`s, so that _process_row does not need to
+        query the database.
+        :param rows: all parsed rows in the CSV file
+        """
+        pass
+
     def _process_row(
         self, row: Dict[str, Any], filename: str = None, line_num: int = None
     ) -> Dict[str, Any]:
         """
-        This method takes the raw CSV row, and returns a converted row. This can be
-        used to implement conversions such as from datetime string to a datetime
-        instance, etc.
-        :param row: a copy of the raw CSV row
+        This method takes the parsed CSV row, and returns a converted row. This can be
+        used to resolve the instances the row refers to, using the `Lookup`s loaded
+        in _prefetch.
+        :param row: a parsed CSV row, as returned by _parse_row()
         :return: a converted row. This will be passed to _construct_instance().
         """
         return row
@@ -417,7 +727,8 @@ class Importer(ABC, Generic[T]):
         """
         for unique_keys in self.unique_fields:
             values = tuple(
-                converted[self.field_dict[unique_key]] for unique_key in unique_keys
+                self._unique_value(converted[self.field_dict[unique_key]])
+                for unique_key in unique_keys
             )
             if values in self.unique_dict[unique_keys]:
                 key_name = tuple(
@@ -437,6 +748,14 @@ class Importer(ABC, Generic[T]):
 
             self.unique_dict[unique_keys][values] = line_num
 
+    @staticmethod
+    def _unique_value(value: Any) -> Any:
+        # Instances not yet saved (e.g., new UPCs) are shared among rows referring to
+        # them, and are only unhashable for lack of a primary key.
+        if isinstance(value, Model) and value.pk is None:
+            return type(value), id(value)
+        return value
+
     @staticmethod
     def _to_decimal(row: Dict[str, Any], fields: Iterable[str]) -> None:
         for field in fields:
@@ -471,58 +790,107 @@ class Importer(ABC, Generic[T]):
         for field_name in self.fields:
             setattr(instance, field_name, row[self.field_dict[field_name]])
 
-        return Record(instance, {})
+        return Record(instance, {}, line_num)
+
+    @staticmethod
+    def _field_key(field: Field, value: Any) -> Any:
+        try:
+            return field.to_python(value)
+        except ValidationError:
+            return None
 
-    def __save(self, instance: T) -> None:
+    def _find_existing(self, records: List[Record[T]]) -> Dict[str, Dict[Any, T]]:
         """
-        Saves an instance with ForeignKey objects that are potentially not committed to
-        DB.
-        :param instance: an instance to save
+        Finds the existing instances which records may match, on their primary key or
+        any other unique field, using one query per field.
+        :param records: the records to be matched
+        :return: a dict mapping from the name of each field to a dict mapping from
+            values of the field to the existing instances
         """
-        for field in self.model_opts.fields:
-            if isinstance(field, RelatedField):
-                fk = getattr(instance, field.name)
-                fk.save()
-                setattr(instance, field.name, fk)
-                logger.info("Saved fk %s (#%d) %s", field.name, fk.pk, str(fk))
-        instance.save()
+        fields = [
+            field
+            for field in self.fields.values()
+            if field.unique and not field.primary_key
+        ]
+        if self.primary_key not in fields:
+            fields.append(self.primary_key)
+        queryset = self.model.objects.select_related(
+            *(
+                field.name
+                for field in self.model_opts.fields
+                if isinstance(field, RelatedField)
+            )
+        )
+        existing = {}
+        for field in fields:
+            values = {
+                self._field_key(field, getattr(record.instance, field.attname))
+                for record in records
+            } - {None}
+            existing[field.name] = {
+                self._field_key(field, getattr(instance, field.attname)): instance
+                for instance in queryset.filter(**{f"{field.attname}__in": values})
+            }
+        return existing
+
+    def _match(
+        self, existing: Dict[str, Dict[Any, T]], field: Field, instance: T
+    ) -> Optional[T]:
+        key = self._field_key(field, getattr(instance, field.attname))
+        return None if key is None else existing[field.name].get(key)
+
+    def _classify(self, records: List[Record[T]]) -> None:
+        """
+        Classifies each record as new, identical to an existing instance, or colliding
+        with an existing instance, by matching them against all existing instances at
+        once.
+        :param records: the records to classify
+        :raise: `AmbiguousRecord` if any record is ambiguous
+        """
+        existing = self._find_existing(records)
+        for record in records:
+            try:
+                record = self._classify_record(record, existing)
+            except CollisionException as e:
+                self._collisions.append(Record(e, record.m2m, record.line_num))
+            except IdenticalRecord as e:
+                self._ignored.append(e.record)
+            except UserFacingException as e:
+                e.message = f"{self.filename}:{record.line_num}: " + e.message
+                raise e
+            else:
+                self._instances.append(record)
 
-    def _save(self, record: Record[T], filename: str, line_num: int) -> Record[T]:
+    def _classify_record(
+        self, record: Record[T], existing: Dict[str, Dict[Any, T]]
+    ) -> Record[T]:
         """
-        Tries to save a model. If duplicate occurs, check and see if two instances are
-        identical: if so, a IdenticalRecord is raised. Otherwise, a
+        Checks whether a record matches existing instances. If so, check and see if
+        two instances are identical: if so, a IdenticalRecord is raised. Otherwise, a
         CollisionException is raised to be handled later. If the record is ambiguous,
         raise a AmbiguousRecord.
-        :param record: an instance of the model to be saved
-        :return: the saved instance.
+        :param record: a record to be classified
+        :param existing: existing instances, as returned by _find_existing
+        :return: the record, if it is new
         :raise: `AmbiguousRecord` if the record is ambiguous
         :raise: `IdenticalRecord` if the record is identical
         :raise: `CollisionException` if the record is a collision
         """
         instance = record.instance
-        primary_key_value = getattr(instance, self.primary_key.name)
+        primary_key_value = getattr(instance, self.primary_key.attname)
         matches = {}
-        for field_name, field in self.fields.items():
-            if field.primary_key:
-                continue
-            if not field.unique:
+        for field in self.fields.values():
+            if field.primary_key or not field.unique:
                 continue
-            if isinstance(field, AutoField):
-                continue
-            db_match = self.model.objects.filter(
-                **{field_name: getattr(instance, field_name)}
-            )
-            if db_match.exists() and db_match[0] not in matches.values():
-                matches[field.verbose_name] = db_match[0]
+            match = self._match(existing, field, instance)
+            if match is not None and match not in matches.values():
+                matches[field.verbose_name] = match
             if len(matches) > 1:
                 break
         if len(matches) > 1:
             raise AmbiguousRecord(f"Ambiguous record detected.", record, matches)
         if primary_key_value:
-            primary_match = self.model.objects.filter(
-                **{self.primary_key.name: primary_key_value}
-            )
-            actual_match = primary_match[0] if primary_match.exists() else None
+            actual_match = self._match(existing, self.primary_key, instance)
         else:
             actual_match = None
         if len(matches) == 1:
@@ -540,36 +908,134 @@ class Importer(ABC, Generic[T]):
                 # Identical instances should be ignored
                 raise IdenticalRecord(record)
             raise CollisionException(actual_match, instance)
-        self.__save(instance)
-
-        record.instance = instance
         return record
 
-    def _default_save_m2m(self, record: Record[T]) -> None:
+    @staticmethod
+    def _save_related(instances: Sequence[Model]) -> None:
+        """
+        Saves, in bulk, the ForeignKey objects of instances which are not committed to
+        DB, e.g., UPCs created by this import, or objects whose insertion was rolled
+        back when a collision occurred.
+        :param instances: instances of the same model
+        """
+        if not instances:
+            return
+        for field in instances[0]._meta.fields:
+            if not isinstance(field, RelatedField):
+                continue
+            related = {}
+            for instance in instances:
+                if field.is_cached(instance):
+                    fk = getattr(instance, field.name)
+                    if fk is not None:
+                        related[id(fk)] = fk
+            related_model = field.related_model
+            # Primary keys may still be raw values from the CSV file, e.g., "5"
+            keys = {
+                id(fk): related_model._meta.pk.to_python(fk.pk)
+                for fk in related.values()
+            }
+            saved = set(
+                related_model.objects.filter(
+                    pk__in={key for key in keys.values() if key is not None}
+                ).values_list("pk", flat=True)
+            )
+            unsaved = [fk for fk in related.values() if keys[id(fk)] not in saved]
+            if unsaved:
+                related_model.objects.bulk_create(unsaved)
+                logger.info("Saved %d fk %s", len(unsaved), field.name)
+            for instance in instances:
+                if field.is_cached(instance):
+                    # Picks up primary keys assigned by bulk_create
+                    setattr(instance, field.name, getattr(instance, field.name))
+
+    def _assign_keys(self, instances: List[T]) -> None:
+        """
+        Fills in the primary key of new instances which do not have one, like the
+        save() method of models with generated primary keys does.
+        :param instances: new instances to be saved
+        """
+        if isinstance(self.model_opts.pk, AutoField):
+            return
+        missing = [instance for instance in instances if not instance.pk]
+        if not missing:
+            return
+        taken = {instance.pk for instance in instances if instance.pk}
+        key = utils.next_id(self.model, self.next_key, self.default_key)
+        for instance in missing:
+            while key in taken:
+                key = self.next_key(key)
+            instance.pk = key
+            key = self.next_key(key)
+
+    def _write(self, records: List[Record[T]]) -> None:
+        """
+        Saves new instances with ForeignKey objects that are potentially not committed
+        to DB, in bulk.
+        :param records: records of new instances
+        """
+        instances = [record.instance for record in records]
+        if not instances:
+            return
+        self._save_related(instances)
+        self._assign_keys(instances)
+        self.model.objects.bulk_create(instances)
+        logger.info("Inserted %d %s records", len(instances), self.model_name)
+
+    def _update(self, records: List[Record[T]]) -> None:
+        """
+        Replaces the existing instances collided with by the new instances, in bulk.
+        :param records: records of collisions
+        """
+        instances = []
+        for record in records:
+            collision = record.instance
+            collision.new_instance.pk = collision.old_instance.pk
+            instances.append(collision.new_instance)
+        if not instances:
+            return
+        self._save_related(instances)
+        self.model.objects.bulk_update(
+            instances,
+            [
+                field.name
+                for field in self.model_opts.concrete_fields
+                if not field.primary_key and field.editable
+            ],
+        )
+        logger.info("Updated %d %s records", len(instances), self.model_name)
+
+    def _default_save_m2m(self, records: List[Record[T]]) -> None:
         """
         Actually saves the M2M relationships using the "replacement" semantics. I.e.,
-        all previous M2M instances related to this record is purged, and the new
+        all previous M2M instances related to these records are purged, and the new
         M2M instances are all there will be in the DB once this operation completes.
-        :param record:
-        :return:
+        :param records: records that are already saved to the database
         """
+        instances = [
+            record.instance.new_instance
+            if isinstance(record.instance, CollisionException)
+            else record.instance
+            for record in records
+        ]
         for field in self.model_opts.many_to_many:
-            if field.attname not in record.m2m:
-                raise ImportException(f"m2m relationship not found: {field.attname}")
-            related = record.m2m[field.attname]
-            if isinstance(record.instance, CollisionException):
-                instance = record.instance.new_instance
-            else:
-                instance = record.instance
-            manager = getattr(instance, field.attname)
-            if hasattr(manager, "through"):
-                manager = manager.through.objects
-            manager.filter(**{self.model_opts.model_name: instance}).delete()
-            manager.bulk_create(related)
-
-    def _save_m2m(self, record: Record[T]) -> None:
+            related = []
+            for record in records:
+                if field.attname not in record.m2m:
+                    raise ImportException(
+                        f"m2m relationship not found: {field.attname}"
+                    )
+                related.extend(record.m2m[field.attname])
+            through = field.remote_field.through
+            through.objects.filter(
+                **{f"{self.model_opts.model_name}__in": instances}
+            ).delete()
+            self._save_related(related)
+            through.objects.bulk_create(related)
+
+    def _save_m2m(self, records: List[Record[T]]) -> None:
         """
-        Saves ManyToManyRelationship attached to an instance. This is needed because
+        Saves ManyToManyRelationship attached to instances. This is needed because
         of a "cycle": to save an instance of a model, one needs the m2m
         relationships. To construct m2m relationship instances, one needs the instance
         to be saved. This solves the problem by separating the creation and saving
@@ -581,8 +1047,8 @@ class Importer(ABC, Generic[T]):
 
         If an importer subclass needs to use the built-in functionality, simply
         override this method to call _default_save_m2m() with the same parameters.
-        :param instance: record that is already saved to the database.
-        :param m2m: a M2MType instance with all M2M objects
+        :param records: records that are already saved to the database, each with a
+            M2MType instance with all M2M objects
         """
         pass
 
@@ -630,19 +1096,51 @@ class SkuImporter(Importer):
         "comment": "Comment",
     }
 
+    def __init__(self, filename: str = None, resolver: Resolver = None):
+        super().__init__(filename, resolver)
+        self.formulas: Lookup[Formula] = None
+        self.product_lines: Lookup[ProductLine] = None
+        self.manufacturing_lines: Lookup[ManufacturingLine] = None
+        self.upcs: Lookup[Upc] = None
+
+    @staticmethod
+    def _split_shortnames(raw: str) -> List[str]:
+        # Duplicated shortnames are ignored
+        return list(
+            dict.fromkeys(
+                shortname.strip()
+                for shortname in re.split(r",\s*", raw or "")
+                if shortname.strip()
+            )
+        )
+
+    def _prefetch(self, rows: List[Dict[str, Any]]) -> None:
+        self.formulas = self.resolver.lookup(
+            Formula, "number", (row["Formula#"] for row in rows)
+        )
+        self.product_lines = self.resolver.lookup(
+            ProductLine, "name", (row["PL Name"] for row in rows)
+        )
+        self.manufacturing_lines = self.resolver.lookup(
+            ManufacturingLine,
+            "shortname",
+            itertools.chain.from_iterable(row["ML Shortnames"] for row in rows),
+        )
+        self.upcs = self.resolver.lookup(
+            Upc,
+            "upc_number",
+            itertools.chain.from_iterable(
+                (row["Case UPC"], row["Unit UPC"]) for row in rows
+            ),
+        )
+
     def _check_manufacturing_line(
         self, row: Dict[str, Any], line_num: int = None
     ) -> List[ManufacturingLine]:
-        # Duplicated shortnames are ignored
-        raw_ml = {
-            shortname.strip()
-            for shortname in re.split(r",\s*", row["ML Shortnames"])
-            if shortname.strip()
-        }
+        raw_ml = row["ML Shortnames"]
         logger.info("Raw ML: %s", raw_ml)
-        ml_objs = ManufacturingLine.objects.filter(shortname__in=raw_ml)
-        found = set(ml_objs.values_list("shortname", flat=True))
-        missing = raw_ml - found
+        ml_objs = [self.manufacturing_lines.get(shortname) for shortname in raw_ml]
+        missing = [shortname for shortname, ml in zip(raw_ml, ml_objs) if ml is None]
         if missing:
             raise IntegrityException(
                 message=f"Cannot import SKU #{row['SKU#']}: "
@@ -653,11 +1151,10 @@ class SkuImporter(Importer):
                 fk_name="ML Shortnames",
                 fk_value=", ".join(missing),
             )
-        return ml_objs.all()
+        return ml_objs
 
-    def _process_row(
-        self, row: Dict[str, Any], filename: str = None, line_num: int = None
-    ) -> Dict[str, Any]:
+    @classmethod
+    def _parse_row(cls, row: Dict[str, Any]) -> Dict[str, Any]:
         try:
             row["SKU#"] = int(row["SKU#"])
         except ValueError:
@@ -665,25 +1162,9 @@ class SkuImporter(Importer):
                 f"SKU number must be numeric; '{row['SKU#']}' is not a valid integer."
             )
         row["Count per case"] = int(row["Count per case"])
-        raw_formula = row["Formula#"]
-
-        formula_qs = Formula.objects.filter(number=raw_formula)
-        if formula_qs.exists():
-            row["Formula#"] = formula_qs[0]
-        else:
-            raise IntegrityException(
-                message=f"Cannot import SKU #{row['SKU#']}",
-                line_num=line_num,
-                referring_name="SKU",
-                referred_name="Formula",
-                fk_name="Formula",
-                fk_value=row["Formula#"],
-            )
         for field in ["Case UPC", "Unit UPC"]:
             if utils.is_valid_upc(row[field]):
-                if str(row[field])[0] not in ["2", "3", "4", "5"]:
-                    row[field] = Upc.objects.get_or_create(upc_number=row[field])[0]
-                else:
+                if str(row[field])[0] in ["2", "3", "4", "5"]:
                     raise ValidationError(
                         "%(field)s must be a valid consumer UPC; '%(upc)s' is not a "
                         "valid consumer UPC number.",
@@ -693,9 +1174,35 @@ class SkuImporter(Importer):
                 raise UserFacingException(f"{row[field]} is not a valid UPC.")
         if row["Comment"] is None:
             row["Comment"] = ""
-        product_line = ProductLine.objects.filter(name=row["PL Name"])
-        if product_line.exists():
-            row["PL Name"] = product_line[0]
+        row["ML Shortnames"] = cls._split_shortnames(row["ML Shortnames"])
+        cls._to_decimal(row, ["Rate", "Formula factor"])
+        cls._parse_usd(row, ["Mfg setup cost", "Mfg run cost"])
+        return row
+
+    def _process_row(
+        self, row: Dict[str, Any], filename: str = None, line_num: int = None
+    ) -> Dict[str, Any]:
+        formula = self.formulas.get(row["Formula#"])
+        if formula is not None:
+            row["Formula#"] = formula
+        else:
+            raise IntegrityException(
+                message=f"Cannot import SKU #{row['SKU#']}",
+                line_num=line_num,
+                referring_name="SKU",
+                referred_name="Formula",
+                fk_name="Formula",
+                fk_value=row["Formula#"],
+            )
+        for field in ["Case UPC", "Unit UPC"]:
+            upc = self.upcs.get(row[field])
+            if upc is None:
+                # Saved along with the SKUs
+                upc = self.upcs.add(Upc(upc_number=row[field]))
+            row[field] = upc
+        product_line = self.product_lines.get(row["PL Name"])
+        if product_line is not None:
+            row["PL Name"] = product_line
         else:
             raise IntegrityException(
                 message=f"Cannot import SKU #{row['SKU#']}",
@@ -708,9 +1215,6 @@ class SkuImporter(Importer):
 
         row["ML Shortnames"] = self._check_manufacturing_line(row, line_num)
 
-        self._to_decimal(row, ["Rate", "Formula factor"])
-        self._parse_usd(row, ["Mfg setup cost", "Mfg run cost"])
-
         return row
 
     def _construct_record(self, row: Dict[str, Any], line_num: int = None) -> Record:
@@ -721,8 +1225,22 @@ class SkuImporter(Importer):
         ]
         return instance
 
-    def _save_m2m(self, record: Record[T]) -> None:
-        self._default_save_m2m(record)
+    def _save_m2m(self, records: List[Record[T]]) -> None:
+        self._default_save_m2m(records)
+
+    def _write(self, records: List[Record[T]]) -> None:
+        super()._write(records)
+        self._get_sales(record.instance for record in records)
+
+    def _update(self, records: List[Record[T]]) -> None:
+        super()._update(records)
+        self._get_sales(record.instance.new_instance for record in records)
+
+    @staticmethod
+    def _get_sales(skus: Iterable[Sku]) -> None:
+        numbers = [sku.number for sku in skus]
+        if numbers:
+            transaction.on_commit(lambda: Sku.get_sales_for(numbers))
 
 
 class IngredientImporter(Importer):
@@ -731,6 +1249,8 @@ class IngredientImporter(Importer):
     header = ["Ingr#", "Name", "Vendor Info", "Size", "Cost", "Comment"]
     model = Ingredient
     model_name = "Ingredient"
+    next_key = staticmethod(utils.next_alphanumeric_str)
+    default_key = "0"
     field_dict = {
         "number": "Ingr#",
         "name": "Name",
@@ -741,12 +1261,20 @@ class IngredientImporter(Importer):
         "comment": "Comment",
     }
 
-    def _process_row(
-        self, row: Dict[str, Any], filename: str = None, line_num: int = None
-    ) -> Dict[str, Any]:
+    def __init__(self, filename: str = None, resolver: Resolver = None):
+        super().__init__(filename, resolver)
+        self.vendors: Lookup[Vendor] = None
+
+    def _prefetch(self, rows: List[Dict[str, Any]]) -> None:
+        self.vendors = self.resolver.lookup(
+            Vendor, "info", (row["Vendor Info"] for row in rows)
+        )
+
+    @classmethod
+    def _parse_row(cls, row: Dict[str, Any]) -> Dict[str, Any]:
         raw_size = row["Size"]
         try:
-            row["Size"], row["Unit"] = Unit.from_exp(raw_size)
+            row["Size"], row["Unit"] = Unit.parse_exp(raw_size)
         except RuntimeError as e:
             raise UserFacingException(str(e))
         try:
@@ -758,16 +1286,32 @@ class IngredientImporter(Importer):
             row["Cost"] = Decimal(utils.parse_usd(row["Cost"]))
         except ValueError as e:
             raise UserFacingException(str(e))
-
-        vendor = Vendor.objects.filter(info=row["Vendor Info"])
-        if vendor.exists():
-            row["Vendor Info"] = vendor[0]
-        else:
-            row["Vendor Info"] = Vendor.objects.create(info=row["Vendor Info"])
         if row["Comment"] is None:
             row["Comment"] = ""
         return row
 
+    def _process_row(
+        self, row: Dict[str, Any], filename: str = None, line_num: int = None
+    ) -> Dict[str, Any]:
+        row["Unit"] = _resolve_unit(row["Unit"])
+        vendor = self.vendors.get(row["Vendor Info"])
+        if vendor is None:
+            # Saved along with the ingredients
+            vendor = self.vendors.add(Vendor(info=row["Vendor Info"]))
+        row["Vendor Info"] = vendor
+        return row
+
+    def _update(self, records: List[Record[T]]) -> None:
+        changed = [
+            record.instance.old_instance.pk
+            for record in records
+            if record.instance.old_instance.cost_inputs()
+            != record.instance.new_instance.cost_inputs()
+        ]
+        super()._update(records)
+        if changed:
+            Formula.update_costs(Formula.using_ingredients(changed))
+
 
 class FormulaIngredientImporter(Importer):
 
@@ -783,22 +1327,37 @@ class FormulaIngredientImporter(Importer):
     model_name = "Formula"
     primary_key = FormulaIngredient._meta.get_field("formula")
 
-    def __init__(self, formulas: Dict[str, Formula], filename: str = None):
-        super().__init__(filename)
+    def __init__(
+        self,
+        formulas: Dict[str, Formula],
+        filename: str = None,
+        resolver: Resolver = None,
+    ):
+        super().__init__(filename, resolver)
         self.formulas = formulas
+        self.ingredients: Lookup[Ingredient] = None
 
-    def _process_row(
-        self, row: Dict[str, Any], filename: str = None, line_num: int = None
-    ) -> Dict[str, Any]:
+    def _prefetch(self, rows: List[Dict[str, Any]]) -> None:
+        self.ingredients = self.resolver.lookup(
+            Ingredient, "number", (row["Ingr#"] for row in rows)
+        )
+
+    @classmethod
+    def _parse_row(cls, row: Dict[str, Any]) -> Dict[str, Any]:
         raw_size = row["Quantity"]
         try:
-            row["Quantity"], row["Unit"] = Unit.from_exp(raw_size)
+            row["Quantity"], row["Unit"] = Unit.parse_exp(raw_size)
         except RuntimeError as e:
             raise UserFacingException(str(e))
+        return row
 
+    def _process_row(
+        self, row: Dict[str, Any], filename: str = None, line_num: int = None
+    ) -> Dict[str, Any]:
+        row["Unit"] = _resolve_unit(row["Unit"])
         row["Formula#"] = self.formulas[row["Name"]]
-        ingr = Ingredient.objects.filter(number=row["Ingr#"])
-        if not ingr.exists():
+        ingr = self.ingredients.get(row["Ingr#"])
+        if ingr is None:
             raise IntegrityException(
                 message="Cannot import Formula",
                 line_num=line_num,
@@ -807,23 +1366,31 @@ class FormulaIngredientImporter(Importer):
                 fk_name="Ingr#",
                 fk_value=row["Ingr#"],
             )
-        ingr = ingr[0]
-        if row["Unit"].unit_type != ingr.unit.unit_type:
+        ingr_unit = Unit.registry().by_id(ingr.unit_id)
+        if row["Unit"].unit_type != ingr_unit.unit_type:
             raise UserFacingException(
                 f"Cannot import Formula.\nUnit '{row['Unit'].symbol}' is incompatible "
-                f"with unit '{ingr.unit.symbol}' used in ingredient '{ingr.name}'."
+                f"with unit '{ingr_unit.symbol}' used in ingredient '{ingr.name}'."
             )
         row["Ingr#"] = ingr
         return row
 
-    def _save(self, record: Record[T], filename: str, line_num: int) -> Record[T]:
+    def _classify(self, records: List[Record[T]]) -> None:
+        # FormulaIngredients of the imported formulas are replaced altogether, so
+        # there is nothing to match against.
+        self._instances.extend(records)
+
+    def _write(self, records: List[Record[T]]) -> None:
         # We can't save this here because of the special semantics associated with
         # FormulaIngredients. We process all instances together in _post_process.
-        return record
+        pass
 
     def _post_process(self):
         FormulaIngredient.objects.filter(formula__in=self.formulas.values()).delete()
+        # Formulas may have been assigned their numbers after these were constructed
+        self._save_related(self.instances)
         FormulaIngredient.objects.bulk_create(self.instances)
+        Formula.update_costs([formula.pk for formula in self.formulas.values()])
 
 
 class FormulaImporter(Importer):
@@ -838,23 +1405,61 @@ class FormulaImporter(Importer):
         super().__init__(*args, **kwargs)
         self.fi_importer: Optional[FormulaIngredientImporter] = None
 
-    def do_import(self, lines: List[str]) -> Tuple[int, int, int]:
-        lines_copy = copy.copy(lines)
-        super_result = super().do_import(lines)
-        self.fi_importer = FormulaIngredientImporter(
-            filename=self.filename,
-            formulas={
-                instance.name: instance
-                for instance in itertools.chain(self.instances, self.ignored)
-            },
+    def do_import(
+        self, lines: Iterable[str], parse: "ParseFunc" = None
+    ) -> Tuple[int, int, int]:
+        lines_copy = copy.copy(lines) if isinstance(lines, list) else lines
+        super_result = super().do_import(lines, parse)
+        fi_result = self._make_fi_importer(lines, lines_copy).do_import(
+            lines_copy, parse
         )
-        fi_result = self.fi_importer.do_import(lines_copy)
+        return self._merge_results(super_result, fi_result)
+
+    @staticmethod
+    def _merge_results(
+        super_result: Tuple[int, int, int], fi_result: Tuple[int, int, int]
+    ) -> Tuple[int, int, int]:
         return (
             max(super_result[0], fi_result[0]),
             max(super_result[1], fi_result[1]),
             max(super_result[2], fi_result[2]),
         )
 
+    def dry_run(self, lines: Iterable[str], parse: "ParseFunc" = None) -> ImportReport:
+        lines_copy = copy.copy(lines) if isinstance(lines, list) else lines
+        super().dry_run(lines, parse)
+        self._make_fi_importer(lines, lines_copy).dry_run(lines_copy, parse)
+        return self.report()
+
+    def report(self) -> ImportReport:
+        report = super().report()
+        if self.fi_importer is not None:
+            # The file is processed twice: once for formulas, and once for their
+            # ingredients
+            for phase, seconds in self.fi_importer.timings.items():
+                report.timings[phase] = report.timings.get(phase, 0) + seconds
+        return report
+
+    def _make_fi_importer(
+        self, lines: Iterable[str], lines_copy: Iterable[str]
+    ) -> "FormulaIngredientImporter":
+        if lines_copy is lines:
+            # The file is read again from the start for the formula ingredients
+            lines.seek(0)
+        self.fi_importer = FormulaIngredientImporter(
+            filename=self.filename,
+            resolver=self.resolver,
+            formulas={
+                instance.name: instance
+                for instance in itertools.chain(
+                    self.instances,
+                    self.ignored,
+                    (collision.new_instance for collision in self.collisions),
+                )
+            },
+        )
+        return self.fi_importer
+
     def _check_duplicates(
         self,
         raw: Dict[str, str],
@@ -885,8 +1490,7 @@ class FormulaImporter(Importer):
 
     def commit(self):
         super_commit = super().commit()
-        self.fi_importer.commit()
-        return super_commit
+        return self._merge_results(super_commit, self.fi_importer.commit())
 
 
 class ProductLineImporter(Importer):
@@ -898,16 +1502,40 @@ class ProductLineImporter(Importer):
     model_name = "Product Line"
     primary_key = ProductLine._meta.get_field("name")
 
-    def _save(self, record: Record[T], filename: str, line_num: int) -> Record[T]:
-        instance = record.instance
-        existing = self.model.objects.filter(name=instance.name)
-        if existing.exists():
-            record.instance = existing[0]
+    def _classify_record(
+        self, record: Record[T], existing: Dict[str, Dict[Any, T]]
+    ) -> Record[T]:
+        match = self._match(existing, self.fields["name"], record.instance)
+        if match is not None:
+            record.instance = match
             raise IdenticalRecord(record)
-        instance.save()
         return record
 
 
+def _resolve_unit(symbol: str) -> Unit:
+    unit = Unit.registry().get(symbol)
+    if unit is None:
+        raise UserFacingException(f"Unit '{symbol}' does not exist.")
+    return unit
+
+
+def parse_rows(
+    importer_class: Type[Importer], rows: Iterable[Tuple[int, Dict[str, str]]]
+) -> List[ParsedRow]:
+    """
+    Parses raw rows with an importer. This is a module-level function, so that it can
+    be called on a process pool.
+    :param importer_class: the class of the importer
+    :param rows: an iterable of (line number, raw row) pairs
+    :return: a list of `ParsedRow`s
+    """
+    return importer_class.parse_rows(rows)
+
+
+ParseFunc = Callable[
+    [Type[Importer], Iterable[Tuple[int, Dict[str, str]]]], List[ParsedRow]
+]
+
 IMPORTERS = {
     "skus": SkuImporter,
     "ingredients": IngredientImporter,
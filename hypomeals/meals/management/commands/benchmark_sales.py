@@ -0,0 +1,98 @@
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from meals.sales import SalesFetcher, RateLimiter
+from meals.sales_stub import make_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks retrieval from the sales interface: one request and connection "
+        "per SKU-year, against the pooled, concurrent SalesFetcher. Nothing is saved "
+        "to the database. Unless --url is given, a local stub server is used."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default=None, help="URL of the sales interface")
+        parser.add_argument("--skus", type=int, default=20, help="Number of SKUs")
+        parser.add_argument("--years", type=int, default=5, help="Years per SKU")
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.SALES_FETCH_CONCURRENCY
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="Requests per second (default: unlimited)",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.05,
+            help="Seconds the stub server waits before each response",
+        )
+
+    def handle(self, *args, **options):
+        server = None
+        url = options["url"]
+        if url is None:
+            server = make_server(latency=options["latency"])
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{server.server_address[1]}/"
+        pairs = [
+            (sku_number, year)
+            for sku_number in range(1, options["skus"] + 1)
+            for year in range(
+                settings.SALES_YEAR_START, settings.SALES_YEAR_START + options["years"]
+            )
+        ]
+        try:
+            self._report("requests.get", len(pairs), *self._sequential(url, pairs))
+            fetcher = SalesFetcher(
+                url=url,
+                max_workers=options["concurrency"],
+                session=requests.Session(),
+                rate_limiter=RateLimiter(options["rate"]),
+            )
+            self._report("SalesFetcher", len(pairs), *self._pooled(fetcher, pairs))
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+    @staticmethod
+    def _sequential(url, pairs):
+        start = time.perf_counter()
+        total_rows = 0
+        for sku_number, year in pairs:
+            resp = requests.get(
+                url,
+                params={"sku": sku_number, "year": year},
+                timeout=(
+                    settings.SALES_REQUEST_CONNECT_TIMEOUT,
+                    settings.SALES_REQUEST_READ_TIMEOUT,
+                ),
+            )
+            resp.raise_for_status()
+            total_rows += resp.text.count("<tr>") - 1
+        return time.perf_counter() - start, total_rows
+
+    @staticmethod
+    def _pooled(fetcher, pairs):
+        start = time.perf_counter()
+        total_rows = 0
+        for _, data, error in fetcher.fetch_many(pairs):
+            if error is not None:
+                raise error
+            total_rows += len(data.rows)
+        return time.perf_counter() - start, total_rows
+
+    def _report(self, name, num_requests, seconds, total_rows):
+        self.stdout.write(
+            f"{name:>14}: {num_requests} requests, {total_rows} rows in "
+            f"{seconds:.3f}s ({num_requests / seconds:.1f} requests/s)"
+        )
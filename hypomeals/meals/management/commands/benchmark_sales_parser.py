@@ -0,0 +1,68 @@
+import math
+import multiprocessing
+import resource
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from lxml import etree
+
+from meals.sales import HtmlTableIterator, parse_sales_rows
+from meals.sales_stub import generate_sales_html
+
+WEEKS_PER_YEAR = 52
+
+
+def _parse_dom(html: bytes, _chunk_size: int) -> int:
+    """Parses like the original implementation: a full DOM, then a dict per row"""
+    table = etree.HTML(html.decode()).find("body/table")
+    return len(list(HtmlTableIterator(table)))
+
+
+def _parse_stream(html: bytes, chunk_size: int) -> int:
+    stream = BytesIO(html)
+    chunks = iter(lambda: stream.read(chunk_size), b"")
+    return len(list(parse_sales_rows(chunks)))
+
+
+def _measure(parse, html, chunk_size, queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    num_rows = parse(html, chunk_size)
+    seconds = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((num_rows, seconds, after - before))
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks parsing of a synthetic legacy sales table: a full DOM with "
+        "HtmlTableIterator, against the streaming parse_sales_rows. Each parser runs "
+        "in a fresh process so that the growth of its peak memory can be reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000, help="Rows in table")
+        parser.add_argument("--chunk-size", type=int, default=16 * 1024)
+
+    def handle(self, *args, **options):
+        num_customers = math.ceil(options["rows"] / WEEKS_PER_YEAR)
+        html = generate_sales_html(1, 2019, num_customers=num_customers).encode()
+        self.stdout.write(f"Synthetic table: {len(html) / 1e6:.1f} MB")
+        context = multiprocessing.get_context("fork")
+        for name, parse in [
+            ("HtmlTableIterator", _parse_dom),
+            ("parse_sales_rows", _parse_stream),
+        ]:
+            queue = context.Queue()
+            process = context.Process(
+                target=_measure, args=(parse, html, options["chunk_size"], queue)
+            )
+            process.start()
+            num_rows, seconds, peak_kb = queue.get()
+            process.join()
+            self.stdout.write(
+                f"{name:>17}: {num_rows} rows in {seconds:.3f}s "
+                f"({num_rows / seconds:.0f} rows/s), "
+                f"peak memory +{peak_kb / 1024:.1f} MB"
+            )
@@ -0,0 +1,49 @@
+from contextlib import ExitStack
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from meals import bulk_import
+from meals.exceptions import UserFacingException
+from meals.importers import Resolver
+
+
+class Command(BaseCommand):
+    help = (
+        "Previews an import of CSV files: the numbers of records which would be "
+        "inserted, updated and ignored, and the time spent parsing, resolving, "
+        "classifying and writing them, and how often references were resolved "
+        "without a query. Nothing is saved to the database."
+    )
+
+    def add_arguments(self, parser):
+        for file_type in bulk_import.TOPOLOGICAL_ORDER:
+            parser.add_argument(
+                f"--{file_type.replace('_', '-')}",
+                dest=file_type,
+                default=None,
+                help=f"Path to a CSV file of {file_type.replace('_', ' ')}",
+            )
+
+    def handle(self, *args, **options):
+        paths = {
+            file_type: options[file_type]
+            for file_type in bulk_import.TOPOLOGICAL_ORDER
+            if options[file_type]
+        }
+        if not paths:
+            raise CommandError("At least one CSV file is required.")
+        resolver = Resolver()
+        with ExitStack() as stack:
+            files = {
+                file_type: File(stack.enter_context(open(path, "rb")))
+                for file_type, path in paths.items()
+            }
+            try:
+                reports = bulk_import.preview_csv_files(files, resolver)
+            except UserFacingException as e:
+                raise CommandError(str(e))
+        for report in reports:
+            self.stdout.write(str(report))
+        for name, (hits, misses) in resolver.stats().items():
+            self.stdout.write(f"{name}: {hits} hits, {misses} misses")
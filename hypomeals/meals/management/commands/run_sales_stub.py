@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from meals.sales_stub import make_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves a local stub of the legacy sales interface. Point "
+        "SALES_INTERFACE_URL to it to retrieve sales records offline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8080)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Seconds to wait before each response",
+        )
+        parser.add_argument(
+            "--customers",
+            type=int,
+            default=10,
+            help="Number of customers per week in generated records",
+        )
+
+    def handle(self, *args, **options):
+        server = make_server(
+            (options["host"], options["port"]),
+            latency=options["latency"],
+            num_customers=options["customers"],
+        )
+        host, port = server.server_address[:2]
+        self.stdout.write(f"Serving stub sales interface at http://{host}:{port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0013_auto_20190327_0459'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('week', models.IntegerField(blank=True, null=True)),
+                ('sales', models.DecimalField(decimal_places=6, default=0, max_digits=20)),
+                ('revenue', models.DecimalField(decimal_places=8, default=0, max_digits=26)),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', related_query_name='sales_rollup', to='meals.Customer')),
+                ('sku', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', related_query_name='sales_rollup', to='meals.Sku')),
+            ],
+            options={
+                'ordering': ['year', 'week'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['sku', 'year', 'week', 'customer'], name='meals_sales_sku_id_2c4f57_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:05
+
+from django.db import migrations
+from django.db.models import Sum, F
+
+
+def backfill_sales_rollup(apps, schema_editor):
+    Sale = apps.get_model("meals", "Sale")
+    SalesRollup = apps.get_model("meals", "SalesRollup")
+    totals = {
+        "total_sales": Sum("sales"),
+        "total_revenue": Sum(F("sales") * F("price")),
+    }
+    sales = Sale.objects.order_by()
+    rollups = []
+    for grain in [("week",), ("customer_id",), ()]:
+        rows = sales.values("sku_id", "year", *grain).annotate(**totals)
+        rollups.extend(
+            SalesRollup(
+                sales=row.pop("total_sales"), revenue=row.pop("total_revenue"), **row
+            )
+            for row in rows.iterator()
+        )
+    SalesRollup.objects.bulk_create(rollups, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("meals", "0014_salesrollup")]
+
+    operations = [
+        migrations.RunPython(backfill_sales_rollup, migrations.RunPython.noop)
+    ]
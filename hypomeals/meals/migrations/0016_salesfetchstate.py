@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("meals", "0015_backfill_salesrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SalesFetchState",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.IntegerField()),
+                ("digest", models.CharField(blank=True, max_length=64)),
+                ("last_week", models.IntegerField(blank=True, null=True)),
+                ("fetch_time", models.DateTimeField(auto_now=True)),
+                (
+                    "sku",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sales_fetch_states",
+                        related_query_name="sales_fetch_state",
+                        to="meals.Sku",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["sku", "year"],
+                "unique_together": {("sku", "year")},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0016_salesfetchstate'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='sale',
+            options={'ordering': ['year', 'week', 'sku_id', 'customer_id']},
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['sku', 'year', 'week', 'customer', 'sales', 'price'], name='sale_sku_year_week_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['sku', 'customer', 'year'], name='sale_sku_customer_year_idx'),
+        ),
+    ]
@@ -0,0 +1,96 @@
+"""
+Optionally converts the sales table into a PostgreSQL table partitioned by year, so
+that queries restricted to a few years only scan those years' partitions, and old
+years can be vacuumed (or detached) independently. This requires PostgreSQL 11 or
+later, and is only done when `settings.SALES_PARTITION_BY_YEAR` is set. To change
+the setting later, migrate back to 0017 and forward again.
+
+A partitioned table's primary key must include the partition key, so the primary
+key of a partitioned sales table is (id, year). `id` is still unique, since it is
+generated from the same sequence.
+"""
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+TABLE = "meals_sale"
+OLD_TABLE = "meals_sale_old"
+
+
+def _is_partitioned(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = %s::regclass)",
+        [TABLE],
+    )
+    return cursor.fetchone()[0]
+
+
+def _replace_table(cursor, partitioned):
+    """
+    Renames the sales table out of the way, creates a new one with the same
+    columns, copies all sales records, and recreates the indexes and foreign keys
+    under their original names (which Django refers to in later migrations).
+    """
+    cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}")
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE tablename = %s AND indexname NOT LIKE '%%_pkey'",
+        [OLD_TABLE],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [OLD_TABLE],
+    )
+    foreign_keys = cursor.fetchall()
+
+    columns = f"LIKE {OLD_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS"
+    if partitioned:
+        cursor.execute(f"CREATE TABLE {TABLE} ({columns}) PARTITION BY RANGE (year)")
+        for year in range(settings.SALES_YEAR_START, timezone.now().year + 2):
+            cursor.execute(
+                f"CREATE TABLE {TABLE}_{year} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ({year}) TO ({year + 1})"
+            )
+        cursor.execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+    else:
+        cursor.execute(f"CREATE TABLE {TABLE} ({columns})")
+    cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {OLD_TABLE}")
+    cursor.execute(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id")
+    # Dropping the old table frees the names of its constraints and indexes
+    cursor.execute(f"DROP TABLE {OLD_TABLE}")
+
+    primary_key = "id, year" if partitioned else "id"
+    cursor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY ({primary_key})")
+    for _, definition in indexes:
+        cursor.execute(definition.replace(f"{OLD_TABLE} USING", f"{TABLE} USING"))
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}")
+
+
+def partition_sales(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    if not settings.SALES_PARTITION_BY_YEAR:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if not _is_partitioned(cursor):
+            _replace_table(cursor, partitioned=True)
+
+
+def unpartition_sales(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if _is_partitioned(cursor):
+            _replace_table(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("meals", "0017_sale_indexes")]
+
+    operations = [migrations.RunPython(partition_sales, unpartition_sales)]
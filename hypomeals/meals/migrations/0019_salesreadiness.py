@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0018_partition_sale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesReadiness',
+            fields=[
+                ('sku', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_readiness', serialize=False, to='meals.Sku')),
+                ('years_fetched', models.IntegerField(db_index=True, default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def backfill_sales_readiness(apps, schema_editor):
+    """
+    Sales retrieved before fetch states were recorded only left sales records behind,
+    so record a fetch state for every (SKU, year) that has any, then count the fetch
+    states of each SKU.
+    """
+    Sale = apps.get_model("meals", "Sale")
+    SalesFetchState = apps.get_model("meals", "SalesFetchState")
+    SalesReadiness = apps.get_model("meals", "SalesReadiness")
+    fetched = set(SalesFetchState.objects.values_list("sku_id", "year"))
+    years = (
+        Sale.objects.order_by().values("sku_id", "year").annotate(last_week=Max("week"))
+    )
+    SalesFetchState.objects.bulk_create(
+        (
+            SalesFetchState(**row)
+            for row in years.iterator()
+            if (row["sku_id"], row["year"]) not in fetched
+        ),
+        batch_size=5000,
+    )
+    counts = (
+        SalesFetchState.objects.order_by()
+        .values("sku_id")
+        .annotate(years_fetched=Count("year"))
+    )
+    SalesReadiness.objects.bulk_create(
+        (SalesReadiness(**row) for row in counts.iterator()), batch_size=5000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("meals", "0019_salesreadiness")]
+
+    operations = [
+        migrations.RunPython(backfill_sales_readiness, migrations.RunPython.noop)
+    ]
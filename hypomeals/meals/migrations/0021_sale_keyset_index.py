@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0020_backfill_salesreadiness'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='sale',
+            name='sale_sku_year_week_idx',
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['sku', 'year', 'week', 'customer', 'id', 'sales', 'price'], name='sale_sku_year_week_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0021_sale_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(db_index=True, max_length=64)),
+                ('kind', models.CharField(max_length=32)),
+                ('params', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('success', 'Success'), ('failure', 'Failure')], default='pending', max_length=16)),
+                ('filename', models.CharField(blank=True, max_length=100)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('path', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('complete_time', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', related_query_name='export_job', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
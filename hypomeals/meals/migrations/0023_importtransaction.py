@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0022_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40, unique=True)),
+                ('collisions', models.BinaryField()),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportTransactionFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_type', models.CharField(max_length=32)),
+                ('filename', models.CharField(max_length=255)),
+                ('content', models.BinaryField()),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', related_query_name='file', to='meals.ImportTransaction')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-17 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meals', '0023_importtransaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formula',
+            name='cost',
+            field=models.DecimalField(decimal_places=6, editable=False, max_digits=20, null=True, verbose_name='Ingredient cost'),
+        ),
+    ]
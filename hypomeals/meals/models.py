@@ -1,17 +1,25 @@
 # pylint: disable-msg=arguments-differ
+import hashlib
+import json
 import logging
 import re
+from collections import defaultdict
 from datetime import timedelta
 from decimal import Decimal
+from types import MappingProxyType
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, Permission, Group
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import BLANK_CHOICE_DASH, F
-from django.db.models.functions import Substr
+from django.db.models import BLANK_CHOICE_DASH, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Substr
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.text import Truncator
@@ -131,6 +139,12 @@ class Vendor(models.Model, utils.ModelFieldsCompareMixin):
         ordering = ["pk"]
 
 
+# Every accepted form of every unit, mapped to the symbol of the unit
+_UNIT_FORMS = {
+    form: symbol for symbol, forms in UNIT_ACCEPTED_FORMS.items() for form in forms
+}
+
+
 class Unit(models.Model):
     """
     This model is not user-facing: it is only used internally to represent
@@ -174,15 +188,14 @@ class Unit(models.Model):
 
     __str__ = __repr__
 
-    @classmethod
-    def from_exp(cls, exp):
+    @staticmethod
+    def parse_exp(exp):
         """
-        Parses a mixed-unit expression and return the unit, as a Unit instance. If the
-        user cannot be found, a RuntimeError is raised.
+        Parses a mixed-unit expression without looking up the unit, so that it can be
+        done, e.g., in a process without database access.
         :param exp: a mixed-unit expression
-        :return: a pair of (number, unit) where number is the number part, converted to
-            a Python float, and unit is an instance of this class corresponding to the
-            unit part.
+        :return: a pair of (number, symbol) where number is the number part, converted
+            to a Python float, and symbol is the symbol of the unit part.
         """
         match = MIX_UNIT_EXP_REGEX.fullmatch(exp)
         if not match:
@@ -204,15 +217,109 @@ class Unit(models.Model):
             .casefold()
             .rstrip("s")
         )
-        for symbol, accepted_forms in UNIT_ACCEPTED_FORMS.items():
-            if unit_part in accepted_forms:
-                return number_part, cls.objects.get(symbol=symbol)
-
-        accepted_units = cls.objects.values_list("symbol", flat=True)
-        raise RuntimeError(
-            f"Unrecognized unit '{unit_part}'. "
-            f"Accepted units are {', '.join(accepted_units)}."
-        )
+        symbol = _UNIT_FORMS.get(unit_part)
+        if symbol is None:
+            raise RuntimeError(
+                f"Unrecognized unit '{unit_part}'. "
+                f"Accepted units are {', '.join(UNIT_ACCEPTED_FORMS)}."
+            )
+        return number_part, symbol
+
+    @classmethod
+    def from_exp(cls, exp):
+        """
+        Parses a mixed-unit expression and return the unit, as a Unit instance. If the
+        user cannot be found, a RuntimeError is raised.
+        :param exp: a mixed-unit expression
+        :return: a pair of (number, unit) where number is the number part, converted to
+            a Python float, and unit is an instance of this class corresponding to the
+            unit part.
+        """
+        number_part, symbol = cls.parse_exp(exp)
+        return number_part, cls.registry().get_or_raise(symbol)
+
+    @classmethod
+    def registry(cls):
+        """
+        Returns the `UnitRegistry` of this process. It is loaded once per process, and
+        dropped when a unit is saved or deleted in this process.
+        :return: the `UnitRegistry`
+        """
+        global _UNIT_REGISTRY
+        registry = _UNIT_REGISTRY
+        if registry is None:
+            registry = _UNIT_REGISTRY = UnitRegistry(cls.objects.order_by("pk"))
+            logger.info("Loaded %d units", len(registry.units))
+        return registry
+
+
+class UnitRegistry:
+    """
+    An immutable snapshot of all units, loaded with a single query and shared by the
+    whole process, so that units can be found by symbol and quantities converted
+    without querying the database. Use Unit.registry() to get the current one.
+
+    The snapshot is dropped whenever a unit is saved or deleted in this process.
+    Units are only ever created by migrations, so other processes are not notified.
+    """
+
+    __slots__ = ("units", "_by_symbol", "_by_id")
+
+    def __init__(self, units):
+        """
+        :param units: all units
+        """
+        self.units = tuple(units)
+        self._by_symbol = MappingProxyType({unit.symbol: unit for unit in self.units})
+        self._by_id = MappingProxyType({unit.pk: unit for unit in self.units})
+
+    def get(self, symbol):
+        """
+        :param symbol: the symbol of a unit, as returned by Unit.parse_exp()
+        :return: the unit, or None if there is no such unit
+        """
+        return self._by_symbol.get(symbol)
+
+    def get_or_raise(self, symbol):
+        """
+        :param symbol: the symbol of a unit, as returned by Unit.parse_exp()
+        :return: the unit
+        :raise: `Unit.DoesNotExist` if there is no such unit
+        """
+        unit = self._by_symbol.get(symbol)
+        if unit is None:
+            raise Unit.DoesNotExist(f"Unit '{symbol}' does not exist.")
+        return unit
+
+    def by_id(self, unit_id):
+        """
+        :param unit_id: the primary key of a unit, e.g., `ingredient.unit_id`
+        :return: the unit
+        """
+        return self._by_id[unit_id]
+
+    def scale_factor(self, unit_id):
+        """
+        :param unit_id: the primary key of a unit, e.g., `ingredient.unit_id`
+        :return: the scale factor of the unit w.r.t. the base unit of its type
+        """
+        return self._by_id[unit_id].scale_factor
+
+    def of_type(self, unit_type):
+        """
+        :param unit_type: a unit type, e.g., "mass"
+        :return: a tuple of all units of the type
+        """
+        return tuple(unit for unit in self.units if unit.unit_type == unit_type)
+
+
+_UNIT_REGISTRY = None
+
+
+@receiver([post_save, post_delete], sender=Unit)
+def _invalidate_unit_registry(**kwargs):
+    global _UNIT_REGISTRY
+    _UNIT_REGISTRY = None
 
 
 class Ingredient(
@@ -286,10 +393,35 @@ class Ingredient(
             ("cost", "Cost"),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_cost_inputs = instance.cost_inputs()
+        return instance
+
+    def cost_inputs(self):
+        """
+        :return: the values of the fields which the ingredient costs of formulas
+            depend on, i.e., cost, size and unit
+        """
+        return tuple(self.__dict__.get(name) for name in ("cost", "size", "unit_id"))
+
     def save(self, *args, **kwargs):
         if not self.number:
             self.number = utils.next_id(Ingredient, utils.next_alphanumeric_str, "0")
-        return super().save(*args, **kwargs)
+        adding = self._state.adding
+        result = super().save(*args, **kwargs)
+        cost_inputs = self.cost_inputs()
+        if not adding and getattr(self, "_loaded_cost_inputs", None) != cost_inputs:
+            Formula.update_costs(Formula.using_ingredients([self.pk]))
+        self._loaded_cost_inputs = cost_inputs
+        return result
+
+    def delete(self, *args, **kwargs):
+        formula_numbers = list(Formula.using_ingredients([self.pk]))
+        result = super().delete(*args, **kwargs)
+        Formula.update_costs(formula_numbers)
+        return result
 
 
 class Sku(models.Model, utils.ModelFieldsCompareMixin, utils.AttributeResolutionMixin):
@@ -434,9 +566,10 @@ class Sku(models.Model, utils.ModelFieldsCompareMixin, utils.AttributeResolution
 
     @property
     def sales_ready(self):
-        now = timezone.now()
-        num_years = now.year - settings.SALES_YEAR_START + 1
-        return self.sales.distinct("year").values("year").count() == num_years
+        try:
+            return self.sales_readiness.ready
+        except SalesReadiness.DoesNotExist:
+            return False
 
     @cached_property
     def ingredient_cost(self):
@@ -444,27 +577,35 @@ class Sku(models.Model, utils.ModelFieldsCompareMixin, utils.AttributeResolution
 
     def get_sales(self):
         """
-        Schedules to retrieve all sales record from the sales system, in a sequential
-        manner, for the years 1999 to 2019. Note that due to requirements, this cannot
-        be parallelized.
+        Schedules to retrieve all sales record from the sales system, for the years
+        from SALES_YEAR_START to the current year. The years are fetched concurrently
+        by a single worker, subject to the rate limit of the sales system.
 
         Note: if Sales data already exists for a SKU and a particular year, they will be
         deleted.
-        :param sku_number: the sku to retrieve sales records
-        :return: a dict mapping from year number an `AsyncResult` instance which, upon a
-            `.get()` call, returns the number of records retrieved.
+        :return: a list of `AsyncResult` instances which, upon a `.get()` call, return
+            the number of records retrieved.
         """
-        now = timezone.now()
-        from meals.tasks import get_sku_sales_for_year as task
-
-        results = {
-            year: task.apply_async(
-                args=(self.number, year), countdown=settings.SALES_TIMEOUT
-            )
-            for year in range(1999, now.year + 1)
-        }
+        return self.get_sales_for([self.number])
 
-        return results
+    @classmethod
+    def get_sales_for(cls, numbers):
+        """
+        Same as get_sales(), but for many SKUs at once, e.g., those saved in bulk.
+        :param numbers: an iterable of SKU numbers
+        :return: a list of `AsyncResult` instances
+        """
+        now = timezone.now()
+        from meals.tasks import schedule_sales_batches
+
+        return schedule_sales_batches(
+            (
+                (number, year)
+                for number in numbers
+                for year in range(settings.SALES_YEAR_START, now.year + 1)
+            ),
+            countdown=settings.SALES_TIMEOUT,
+        )
 
     def __repr__(self):
         return f"<SKU #{self.number}: {self.name}>"
@@ -510,7 +651,7 @@ class Sku(models.Model, utils.ModelFieldsCompareMixin, utils.AttributeResolution
 class Formula(
     models.Model, utils.ModelFieldsCompareMixin, utils.AttributeResolutionMixin
 ):
-    compare_excluded_fields = ("number",)
+    compare_excluded_fields = ("number", "cost")
 
     name = models.CharField(max_length=32, verbose_name="Name", unique=True)
     number = models.IntegerField(
@@ -520,6 +661,17 @@ class Formula(
         Ingredient, verbose_name="Ingredients", through="FormulaIngredient"
     )
     comment = models.CharField(max_length=4000, verbose_name="Comment")
+    # The ingredient cost, denormalized from the formula's lines and their
+    # ingredients, or null if it hasn't been computed yet. Whatever changes the lines
+    # of a formula, or the cost, size or unit of an ingredient, without going through
+    # save() or delete() of a single instance, must call update_costs().
+    cost = models.DecimalField(
+        max_digits=20,
+        decimal_places=6,
+        null=True,
+        editable=False,
+        verbose_name="Ingredient cost",
+    )
 
     def __repr__(self):
         return f"<Formula #{self.number}: {self.name}>"
@@ -529,17 +681,68 @@ class Formula(
 
     @property
     def ingredient_cost(self):
-        formula_ingredients = FormulaIngredient.objects.filter(formula=self)
-        cost = Decimal(0)
-        for formula_ingredient in formula_ingredients:
-            factor = (
-                formula_ingredient.quantity * formula_ingredient.unit.scale_factor
-            ) / (
-                formula_ingredient.ingredient.size
-                * formula_ingredient.ingredient.unit.scale_factor
+        if self.cost is None:
+            self.cost = self.ingredient_costs([self.pk]).get(self.pk, Decimal(0))
+        return self.cost
+
+    @classmethod
+    def ingredient_costs(cls, formula_numbers):
+        """
+        Looks up the ingredient cost of many formulas using a single query. Costs
+        which haven't been computed yet are computed first.
+        :param formula_numbers: an iterable of formula numbers
+        :return: a dict mapping from formula number to its ingredient cost
+        """
+        formulas = cls.objects.filter(pk__in=formula_numbers)
+        costs = dict(formulas.values_list("number", "cost"))
+        missing = [number for number, cost in costs.items() if cost is None]
+        if missing:
+            cls.update_costs(missing)
+            costs.update(formulas.filter(pk__in=missing).values_list("number", "cost"))
+        return costs
+
+    @classmethod
+    def update_costs(cls, formula_numbers):
+        """
+        Recomputes the ingredient cost of many formulas using a single query.
+        :param formula_numbers: an iterable of formula numbers, or a queryset of them
+        :return: the number of formulas updated
+        """
+        cost_field = cls._meta.get_field("cost")
+        costs = (
+            FormulaIngredient.objects.filter(formula=OuterRef("pk"))
+            .order_by()
+            .values("formula")
+            .annotate(
+                total=Sum(
+                    F("quantity")
+                    * F("unit__scale_factor")
+                    * F("ingredient__cost")
+                    / (F("ingredient__size") * F("ingredient__unit__scale_factor")),
+                    output_field=cost_field,
+                )
             )
-            cost += factor * formula_ingredient.ingredient.cost
-        return cost
+            .values("total")
+        )
+        return cls.objects.filter(pk__in=formula_numbers).update(
+            cost=Coalesce(
+                Subquery(costs, output_field=cost_field),
+                Value(Decimal(0)),
+                output_field=cost_field,
+            )
+        )
+
+    @classmethod
+    def using_ingredients(cls, ingredient_ids):
+        """
+        :param ingredient_ids: an iterable of ingredient IDs
+        :return: a queryset of the numbers of formulas using any of the ingredients
+        """
+        return (
+            FormulaIngredient.objects.filter(ingredient_id__in=ingredient_ids)
+            .order_by()
+            .values_list("formula_id", flat=True)
+        )
 
     @classmethod
     def get_sortable_fields(cls):
@@ -576,6 +779,16 @@ class FormulaIngredient(
 
     __str__ = __repr__
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        Formula.update_costs([self.formula_id])
+        return result
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        Formula.update_costs([self.formula_id])
+        return result
+
     class Meta:
         unique_together = (("formula", "ingredient"),)
 
@@ -690,6 +903,40 @@ class Goal(models.Model, utils.ModelFieldsCompareMixin, utils.AttributeResolutio
         """A goal is scheduled if all of its items have been scheduled."""
         return all(item.scheduled for item in self.details.all())
 
+    @classmethod
+    def ingredient_quantities(cls, goal_ids):
+        """
+        Computes the quantities of ingredients required by many goals using a single
+        query. The quantities of the goals' items are summed up by the database, once
+        for each distinct formula line, so only those are converted here.
+        :param goal_ids: an iterable of goal IDs
+        :return: a dict mapping from ingredient ID to its required quantity, in the
+            ingredient's unit. Ingredients which are not required are not included.
+        """
+        prefix = "sku__formula__formulaingredient__"
+        rows = (
+            GoalItem.objects.filter(goal_id__in=goal_ids, sku__formula__isnull=False)
+            .order_by()
+            .values_list(
+                f"{prefix}ingredient",
+                f"{prefix}quantity",
+                f"{prefix}unit",
+                f"{prefix}ingredient__unit",
+            )
+            .annotate(demand=Sum(F("quantity") * F("sku__formula_scale")))
+        )
+        units = Unit.registry()
+        quantities = defaultdict(lambda: Decimal(0))
+        for ingredient_id, quantity, unit_id, ingredient_unit_id, demand in rows:
+            if ingredient_id is None:
+                # The formula has no ingredients
+                continue
+            unit_scale = units.scale_factor(unit_id) / units.scale_factor(
+                ingredient_unit_id
+            )
+            quantities[ingredient_id] += quantity * unit_scale * demand
+        return dict(quantities)
+
     @classmethod
     def get_sortable_fields(cls):
         return [
@@ -892,4 +1139,394 @@ class Sale(models.Model):
     __repr__ = __str__
 
     class Meta:
-        ordering = ["year", "week", "sku__number", "customer__pk"]
+        # Order by the sale's own columns, so that no join is needed to sort, and
+        # an index scan on a single SKU already yields rows in order
+        ordering = ["year", "week", "sku_id", "customer_id"]
+        indexes = [
+            # Covers filtering a SKU by date, paginating its sales by (year, week,
+            # customer, id), and aggregating them, so that rebuilding a rollup never
+            # has to visit the table itself
+            models.Index(
+                fields=["sku", "year", "week", "customer", "id", "sales", "price"],
+                name="sale_sku_year_week_idx",
+            ),
+            models.Index(
+                fields=["sku", "customer", "year"], name="sale_sku_customer_year_idx"
+            ),
+        ]
+
+
+class SalesRollup(models.Model):
+    """
+    Precomputed totals over the `Sale` table, so that reports never have to aggregate
+    raw weekly, per-customer records. Rows are kept at three grains (similar to
+    GROUPING SETS in SQL) for each (SKU, year):
+    * week=None, customer=None: the yearly total across all customers;
+    * week=None, customer=<c>: the yearly total for a single customer;
+    * week=<w>, customer=None: the weekly total across all customers.
+
+    The rollup of a (SKU, year) is rebuilt by `rebuild()` whenever the sales records
+    of that year are replaced.
+    """
+
+    sku = models.ForeignKey(
+        Sku,
+        on_delete=models.CASCADE,
+        related_name="sales_rollups",
+        related_query_name="sales_rollup",
+        blank=False,
+    )
+    year = models.IntegerField(blank=False)
+    week = models.IntegerField(blank=True, null=True)
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name="sales_rollups",
+        related_query_name="sales_rollup",
+        blank=True,
+        null=True,
+    )
+    sales = models.DecimalField(max_digits=20, decimal_places=6, default=0)
+    revenue = models.DecimalField(max_digits=26, decimal_places=8, default=0)
+
+    @classmethod
+    def rebuild(cls, sku, year):
+        """
+        Recomputes all rollup rows of a SKU for a particular year from the `Sale`
+        table. Should be called in the same transaction as the one modifying sales.
+        :param sku: a Sku instance or SKU number
+        :param year: the year to recompute
+        :return: the number of rollup rows written
+        """
+        sku_number = getattr(sku, "pk", sku)
+        sales = Sale.objects.filter(sku_id=sku_number, year=year).order_by()
+        # Annotations cannot shadow the "sales" field used by the revenue expression
+        totals = {
+            "total_sales": models.Sum("sales"),
+            "total_revenue": models.Sum(F("sales") * F("price")),
+        }
+        rows = list(sales.values("week").annotate(**totals))
+        rows.extend(sales.values("customer_id").annotate(**totals))
+        yearly = sales.aggregate(**totals)
+        if yearly["total_sales"] is not None:
+            rows.append(yearly)
+        rollups = [
+            cls(
+                sku_id=sku_number,
+                year=year,
+                sales=row.pop("total_sales"),
+                revenue=row.pop("total_revenue"),
+                **row,
+            )
+            for row in rows
+        ]
+        cls.objects.filter(sku_id=sku_number, year=year).delete()
+        cls.objects.bulk_create(rollups)
+        return len(rollups)
+
+    def __str__(self):
+        return (
+            f"<SalesRollup #{self.pk}: {self.sku_id} -> {self.customer_id} "
+            f"({self.year}/{self.week}) {self.sales}@{self.revenue}>"
+        )
+
+    __repr__ = __str__
+
+    class Meta:
+        ordering = ["year", "week"]
+        indexes = [models.Index(fields=["sku", "year", "week", "customer"])]
+
+
+class SalesFetchState(models.Model):
+    """
+    Records what was last retrieved from the sales system for a SKU in a particular
+    year, so that a refresh can skip unchanged responses and only replace the weeks
+    that changed.
+    """
+
+    sku = models.ForeignKey(
+        Sku,
+        on_delete=models.CASCADE,
+        related_name="sales_fetch_states",
+        related_query_name="sales_fetch_state",
+        blank=False,
+    )
+    year = models.IntegerField(blank=False)
+    # SHA-256 hex digest of the raw response last retrieved
+    digest = models.CharField(max_length=64, blank=True)
+    # The latest week for which sales records were retrieved, if any
+    last_week = models.IntegerField(blank=True, null=True)
+    fetch_time = models.DateTimeField(auto_now=True)
+
+    @property
+    def high_water_mark(self):
+        """The latest (year, week) retrieved, or None if nothing was retrieved"""
+        if self.last_week is None:
+            return None
+        return self.year, self.last_week
+
+    def __str__(self):
+        return (
+            f"<SalesFetchState #{self.pk}: {self.sku_id} ({self.year}/"
+            f"{self.last_week}) @ {self.fetch_time}>"
+        )
+
+    __repr__ = __str__
+
+    class Meta:
+        unique_together = (("sku", "year"),)
+        ordering = ["sku", "year"]
+
+
+class SalesReadiness(models.Model):
+    """
+    Tracks, for each SKU, the number of years for which sales records have been
+    retrieved, so that whether all SKUs are ready can be answered without looking
+    at every SKU's sales. Updated by sales retrieval whenever a `SalesFetchState` is
+    created for a new year.
+    """
+
+    sku = models.OneToOneField(
+        Sku,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="sales_readiness",
+    )
+    years_fetched = models.IntegerField(default=0, db_index=True)
+
+    @staticmethod
+    def num_years():
+        """The number of years for which sales records must be retrieved"""
+        return timezone.now().year - settings.SALES_YEAR_START + 1
+
+    @property
+    def ready(self):
+        return self.years_fetched >= self.num_years()
+
+    @classmethod
+    def record_year(cls, sku_number):
+        """
+        Records that sales records of one more year were retrieved for a SKU. Safe to
+        call concurrently for different years of the same SKU.
+        :param sku_number: the SKU number
+        """
+        num_years = cls.num_years()
+        cls.objects.bulk_create([cls(sku_id=sku_number)], ignore_conflicts=True)
+        readiness = cls.objects.filter(sku_id=sku_number)
+        increment = {"years_fetched": F("years_fetched") + 1}
+        if readiness.filter(years_fetched=num_years - 1).update(**increment):
+            cls._adjust_pending_count(num_years, -1)
+        else:
+            readiness.update(**increment)
+
+    @classmethod
+    def pending(cls):
+        """SKUs whose sales records have not been retrieved for every year yet"""
+        return Sku.objects.exclude(sales_readiness__years_fetched__gte=cls.num_years())
+
+    @classmethod
+    def all_ready(cls):
+        return not cls.pending().exists()
+
+    @staticmethod
+    def _pending_count_key(num_years):
+        return f"meals:sales-pending-count:{num_years}"
+
+    @classmethod
+    def pending_count(cls):
+        """
+        The number of SKUs in pending(). The count is kept in the cache, and is
+        adjusted as SKUs are created and become ready, so that it is only counted
+        again once it expires after SALES_PENDING_COUNT_TTL seconds. This corrects
+        any drift, e.g., from SKUs created in bulk or deleted, or from rollbacks.
+        """
+        key = cls._pending_count_key(cls.num_years())
+        count = cache.get(key)
+        if count is None:
+            count = cls.pending().count()
+            cache.set(key, count, settings.SALES_PENDING_COUNT_TTL)
+        return count
+
+    @classmethod
+    def sku_created(cls):
+        """
+        Counts a newly created SKU as pending, if the pending count is cached.
+        """
+        cls._adjust_pending_count(cls.num_years(), 1)
+
+    @classmethod
+    def _adjust_pending_count(cls, num_years, delta):
+        try:
+            cache.incr(cls._pending_count_key(num_years), delta)
+        except ValueError:
+            # Not counted yet: nothing to adjust
+            pass
+
+    def __str__(self):
+        return f"<SalesReadiness: {self.sku_id} {self.years_fetched} years>"
+
+    __repr__ = __str__
+
+
+@receiver(post_save, sender=Sku)
+def _count_pending_sku(created, **kwargs):
+    if created:
+        SalesReadiness.sku_created()
+
+
+class ExportJob(models.Model):
+    """
+    An export run in the background by a Celery task, so that large exports do not
+    tie up a web worker. The exported file is kept in the default storage, and is
+    reused by identical exports (i.e., with the same fingerprint) for
+    `EXPORT_CACHE_TTL` seconds.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCESS = "success"
+    FAILURE = "failure"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (SUCCESS, "Success"),
+        (FAILURE, "Failure"),
+    ]
+
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    kind = models.CharField(max_length=32)
+    # Parameters of the export, as JSON
+    params = models.TextField(blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    filename = models.CharField(max_length=100, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    path = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="export_jobs",
+        related_query_name="export_job",
+    )
+    create_time = models.DateTimeField(auto_now_add=True)
+    complete_time = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def make_fingerprint(kind, params):
+        """
+        Computes a fingerprint of an export, such that identical exports have the
+        same fingerprint
+        :param kind: the kind of export
+        :param params: a JSON-serializable dict of the parameters of the export
+        :return: a hex digest
+        """
+        data = json.dumps([kind, params], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    @classmethod
+    def cached(cls, fingerprint):
+        """
+        Finds a recent export with the given fingerprint which either succeeded or is
+        still in progress
+        :param fingerprint: the fingerprint of the export
+        :return: the most recent `ExportJob`, or None
+        """
+        since = timezone.now() - timedelta(seconds=settings.EXPORT_CACHE_TTL)
+        return (
+            cls.objects.filter(fingerprint=fingerprint, create_time__gte=since)
+            .exclude(status=cls.FAILURE)
+            .order_by("-create_time")
+            .first()
+        )
+
+    @classmethod
+    def purge_expired(cls):
+        """
+        Deletes finished exports which can no longer be reused, i.e., older than
+        `EXPORT_CACHE_TTL` seconds, along with their files. An export is kept if its
+        file cannot be deleted, so that it is tried again later.
+        :return: the number of exports deleted
+        """
+        since = timezone.now() - timedelta(seconds=settings.EXPORT_CACHE_TTL)
+        expired = cls.objects.filter(
+            create_time__lt=since, status__in=(cls.SUCCESS, cls.FAILURE)
+        ).values_list("pk", "path")
+        deleted = []
+        for pk, path in expired:
+            if path:
+                try:
+                    default_storage.delete(path)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Unable to delete exported file %s", path)
+                    continue
+            deleted.append(pk)
+        cls.objects.filter(pk__in=deleted).delete()
+        return len(deleted)
+
+    @property
+    def finished(self):
+        return self.status in (self.SUCCESS, self.FAILURE)
+
+    def __str__(self):
+        return f"<ExportJob #{self.pk}: {self.kind} {self.status}>"
+
+    __repr__ = __str__
+
+
+class ImportTransaction(models.Model):
+    """
+    An import which collided with existing records, staged until the user confirms
+    or aborts it. It is kept in the database, so that any web worker can pick it up.
+
+    The uploaded files are kept as compressed CSV, and replayed when the import is
+    confirmed; only a summary of the collisions is kept for review. Imports expire
+    after `IMPORT_TRANSACTION_TTL` seconds.
+    """
+
+    session_key = models.CharField(max_length=40, unique=True)
+    # A summary of the collisions to review, as compressed JSON
+    collisions = models.BinaryField()
+    # Total number of bytes stored for this import, including its files
+    size = models.PositiveIntegerField(default=0)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def active(cls):
+        since = timezone.now() - timedelta(seconds=settings.IMPORT_TRANSACTION_TTL)
+        return cls.objects.filter(create_time__gte=since)
+
+    @classmethod
+    def purge_expired(cls):
+        since = timezone.now() - timedelta(seconds=settings.IMPORT_TRANSACTION_TTL)
+        return cls.objects.filter(create_time__lt=since).delete()
+
+    @classmethod
+    def total_size(cls):
+        return cls.objects.aggregate(total=models.Sum("size"))["total"] or 0
+
+    def __str__(self):
+        return f"<ImportTransaction #{self.pk}: {self.session_key} ({self.size} B)>"
+
+    __repr__ = __str__
+
+
+class ImportTransactionFile(models.Model):
+    """A file uploaded in an `ImportTransaction`"""
+
+    transaction = models.ForeignKey(
+        ImportTransaction,
+        on_delete=models.CASCADE,
+        related_name="files",
+        related_query_name="file",
+    )
+    file_type = models.CharField(max_length=32)
+    filename = models.CharField(max_length=255)
+    # The uploaded CSV file, gzip-compressed
+    content = models.BinaryField()
+
+    def __str__(self):
+        return f"<ImportTransactionFile #{self.pk}: {self.filename}>"
+
+    __repr__ = __str__
@@ -0,0 +1,212 @@
+"""
+Keyset (a.k.a. cursor) pagination. Instead of skipping rows with OFFSET, which gets
+slower the deeper a page is, each page starts right after the last row of the
+previous page, so any page can be retrieved with an index seek.
+"""
+import base64
+import json
+import logging
+import re
+from typing import Any, List, Optional, Sequence, Tuple
+
+from django.db import connections
+from django.db.models import QuerySet
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_ROWS_REGEX = re.compile(r"rows=(\d+)")
+
+
+def approximate_count(queryset: QuerySet) -> Optional[int]:
+    """
+    Estimates the number of rows in a queryset from the query planner's estimate,
+    without executing the query. Only supported on PostgreSQL.
+    :param queryset: a queryset to estimate
+    :return: the estimated number of rows, or None if no estimate is available
+    """
+    if connections[queryset.db].vendor != "postgresql":
+        return None
+    match = EXPLAIN_ROWS_REGEX.search(queryset.order_by().explain())
+    return int(match.group(1)) if match else None
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+    :raise: `ValueError` if the cursor is malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Malformed cursor '{cursor}'") from e
+    if not isinstance(values, list):
+        raise ValueError(f"Malformed cursor '{cursor}'")
+    return values
+
+
+class KeysetPage(Sequence):
+    """
+    A page of results. Quacks like Django's `Page` where it can: page numbers are
+    only counted relative to the first page, as pages are not addressed by number.
+    """
+
+    def __init__(
+        self,
+        object_list: List[Any],
+        number: int,
+        paginator: "KeysetPaginator",
+        has_next: bool,
+        has_previous: bool,
+    ):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return f"<KeysetPage {self.number}>"
+
+    def has_next(self) -> bool:
+        return self._has_next
+
+    def has_previous(self) -> bool:
+        return self._has_previous
+
+    def next_page_number(self) -> int:
+        return self.number + 1
+
+    def previous_page_number(self) -> int:
+        return max(self.number - 1, 1)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        """The cursor to pass as `after` to get the next page"""
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1])
+
+    @property
+    def previous_cursor(self) -> Optional[str]:
+        """The cursor to pass as `before` to get the previous page"""
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[0])
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by a unique, ascending ordering of its fields. The ordering
+    should match an index for pages to be retrieved efficiently.
+
+    Since rows are located by cursors rather than by offsets, pages stay equally
+    fast at any depth. The total count may be exact or, for large querysets, the
+    planner's estimate.
+    """
+
+    def __init__(
+        self,
+        object_list: QuerySet,
+        per_page: Optional[int],
+        ordering: Sequence[str],
+        approximate_count_threshold: Optional[int] = None,
+    ):
+        """
+        :param object_list: the queryset to paginate
+        :param per_page: the number of rows per page. If None, everything is on a
+            single page.
+        :param ordering: names of the fields to order by. The combination must be
+            unique, e.g., by ending with the primary key.
+        :param approximate_count_threshold: if set, `count` is estimated whenever the
+            estimate exceeds this number, instead of counting every row
+        """
+        self.object_list = object_list.order_by(*ordering)
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.approximate_count_threshold = approximate_count_threshold
+        self._count: Optional[Tuple[int, bool]] = None
+
+    def _count_rows(self) -> Tuple[int, bool]:
+        if self._count is None:
+            estimate = None
+            if self.approximate_count_threshold is not None:
+                estimate = approximate_count(self.object_list)
+            if estimate is not None and estimate > self.approximate_count_threshold:
+                self._count = (estimate, True)
+            else:
+                self._count = (self.object_list.count(), False)
+        return self._count
+
+    @property
+    def count(self) -> int:
+        return self._count_rows()[0]
+
+    @property
+    def count_is_approximate(self) -> bool:
+        return self._count_rows()[1]
+
+    def cursor_for(self, obj: Any) -> str:
+        return encode_cursor(
+            getattr(obj, self._attname(field)) for field in self.ordering
+        )
+
+    def _attname(self, field: str) -> str:
+        return self.object_list.model._meta.get_field(field).attname
+
+    def _seek(self, queryset: QuerySet, cursor: str, after: bool) -> QuerySet:
+        """
+        Restricts a queryset to rows after (or before) a cursor, by comparing row
+        values, which PostgreSQL can answer with a single index range scan.
+        """
+        values = decode_cursor(cursor)
+        if len(values) != len(self.ordering):
+            raise ValueError(f"Cursor '{cursor}' does not match the ordering")
+        opts = self.object_list.model._meta
+        columns = ", ".join(
+            f'"{opts.db_table}"."{opts.get_field(field).column}"'
+            for field in self.ordering
+        )
+        placeholders = ", ".join(["%s"] * len(values))
+        operator = ">" if after else "<"
+        return queryset.extra(
+            where=[f"({columns}) {operator} ({placeholders})"], params=values
+        )
+
+    def page(
+        self, number: int = 1, after: str = None, before: str = None
+    ) -> KeysetPage:
+        """
+        Retrieves a page of results.
+        :param number: the number of the page, only used for display
+        :param after: a cursor from `KeysetPage.next_cursor`, to get the page after it
+        :param before: a cursor from `KeysetPage.previous_cursor`, to get the page
+            before it
+        :return: a `KeysetPage`
+        :raise: `ValueError` if a cursor is malformed
+        """
+        if self.per_page is None:
+            return KeysetPage(list(self.object_list), 1, self, False, False)
+        if before:
+            reverse = [f"-{field}" for field in self.ordering]
+            queryset = self._seek(self.object_list, before, after=False)
+            rows = list(queryset.order_by(*reverse)[: self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[: self.per_page][::-1]
+            number = max(number, 2) if has_previous else 1
+            return KeysetPage(rows, number, self, True, has_previous)
+        queryset = self.object_list
+        if after:
+            queryset = self._seek(queryset, after, after=True)
+        rows = list(queryset[: self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        number = number if after else 1
+        return KeysetPage(rows[: self.per_page], number, self, has_next, bool(after))
@@ -0,0 +1,160 @@
+"""
+Projects future sales of SKUs from their weekly sales in previous years. Weekly
+sales of many SKUs are loaded at once into a dense array, so that projections for
+any number of SKUs take a single query and a few vectorized operations.
+"""
+
+import logging
+from decimal import Decimal
+from typing import Dict, Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from meals.models import SalesRollup
+
+logger = logging.getLogger(__name__)
+
+WEEKS_PER_YEAR = 53  # ISO years have either 52 or 53 weeks
+
+
+def _to_decimal(value: float) -> Decimal:
+    return Decimal(f"{value:.6f}")
+
+
+class Projection(NamedTuple):
+    """The projected sales of a SKU over a window of weeks"""
+
+    # Total sales within the window, for each year in the history
+    yearly: Dict[int, Decimal]
+    mean: Decimal
+    std: Decimal
+    # Change in the window's sales per year, from a least-squares linear fit
+    trend: Decimal
+    # Sales in the window of the year after the last one, extrapolated from trend
+    trend_projection: Decimal
+    # Average fraction of a year's sales that fall within the window, or None if
+    # there were no sales at all
+    seasonality: Optional[Decimal]
+
+
+class SalesHistory:
+    """
+    Weekly sales of many SKUs over a range of years, as an array indexed by
+    (SKU, year, week).
+    """
+
+    def __init__(self, sku_numbers: Iterable[int], start_year: int, end_year: int):
+        self.sku_numbers = list(dict.fromkeys(map(int, sku_numbers)))
+        self.index = {number: i for i, number in enumerate(self.sku_numbers)}
+        self.start_year = start_year
+        self.end_year = end_year
+        self.years = np.arange(start_year, end_year + 1)
+        self.sales = np.zeros(
+            (len(self.sku_numbers), len(self.years), WEEKS_PER_YEAR), dtype=np.float64
+        )
+
+    @classmethod
+    def load(
+        cls, sku_numbers: Iterable[int], start_year: int, end_year: int
+    ) -> "SalesHistory":
+        """
+        Loads the weekly sales of SKUs from the sales rollup, using a single query.
+        :param sku_numbers: numbers of the SKUs to load
+        :param start_year: the first year to load
+        :param end_year: the last year to load (inclusive)
+        :return: a `SalesHistory` instance
+        """
+        history = cls(sku_numbers, start_year, end_year)
+        rows = (
+            SalesRollup.objects.filter(
+                sku__in=history.sku_numbers,
+                customer__isnull=True,
+                week__isnull=False,
+                year__gte=start_year,
+                year__lte=end_year,
+            )
+            .order_by()
+            .values_list("sku", "year", "week", "sales")
+        )
+        rows = list(rows)
+        if rows:
+            skus, years, weeks, sales = zip(*rows)
+            history.sales[
+                [history.index[number] for number in skus],
+                np.array(years) - start_year,
+                np.array(weeks) - 1,
+            ] = np.array(sales, dtype=np.float64)
+        return history
+
+    def window_sums(self, start_week: int, end_week: int) -> np.ndarray:
+        """
+        Sums the sales within a window of weeks in each year.
+        :param start_week: the first week of the window
+        :param end_week: the last week of the window (inclusive)
+        :return: an array of shape (SKUs, years)
+        """
+        weeks = np.arange(1, WEEKS_PER_YEAR + 1)
+        mask = (weeks >= start_week) & (weeks <= end_week)
+        return self.sales[:, :, mask].sum(axis=2)
+
+    def project(self, start_week: int, end_week: int) -> Dict[int, Projection]:
+        """
+        Projects the sales of every SKU within a window of weeks.
+        :param start_week: the first week of the window
+        :param end_week: the last week of the window (inclusive)
+        :return: a dict mapping SKU numbers to their `Projection`s
+        """
+        sums = self.window_sums(start_week, end_week)
+        num_years = len(self.years)
+        mean = sums.mean(axis=1)
+        # Sample standard deviation, like statistics.stdev
+        std = sums.std(axis=1, ddof=1) if num_years > 1 else np.zeros_like(mean)
+        if num_years > 1:
+            centered = self.years - self.years.mean()
+            trend = (sums - mean[:, None]) @ centered / (centered @ centered)
+        else:
+            trend = np.zeros_like(mean)
+        next_year = self.end_year + 1 - self.years.mean()
+        trend_projection = np.maximum(mean + trend * next_year, 0)
+        totals = self.sales.sum(axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            shares = np.where(totals > 0, sums / totals, np.nan)
+        has_sales = ~np.isnan(shares).all(axis=1)
+        seasonality = np.zeros_like(mean)
+        seasonality[has_sales] = np.nanmean(shares[has_sales], axis=1)
+
+        result = {}
+        for i, number in enumerate(self.sku_numbers):
+            result[number] = Projection(
+                yearly={
+                    int(year): _to_decimal(total)
+                    for year, total in zip(self.years, sums[i])
+                },
+                mean=_to_decimal(mean[i]),
+                std=_to_decimal(std[i]),
+                trend=_to_decimal(trend[i]),
+                trend_projection=_to_decimal(trend_projection[i]),
+                seasonality=_to_decimal(seasonality[i]) if has_sales[i] else None,
+            )
+        return result
+
+
+def project_sales(
+    sku_numbers: Iterable[int],
+    start_year: int,
+    end_year: int,
+    start_week: int,
+    end_week: int,
+) -> Dict[int, Projection]:
+    """
+    Projects the sales of many SKUs within a window of weeks, based on their sales
+    within the same window in a range of years.
+    :param sku_numbers: numbers of the SKUs to project
+    :param start_year: the first year of history to use
+    :param end_year: the last year of history to use (inclusive)
+    :param start_week: the first week of the window
+    :param end_week: the last week of the window (inclusive)
+    :return: a dict mapping SKU numbers to their `Projection`s
+    """
+    history = SalesHistory.load(sku_numbers, start_year, end_year)
+    return history.project(start_week, end_week)
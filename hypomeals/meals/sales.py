@@ -1,15 +1,45 @@
+import hashlib
+import itertools
+import logging
 import operator
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from decimal import Decimal
 from logging import Logger
-from typing import List, Sequence, Iterator, Dict
+from typing import (
+    List,
+    Sequence,
+    Iterator,
+    Dict,
+    Iterable,
+    Tuple,
+    Optional,
+    NamedTuple,
+    Set,
+)
+from urllib.parse import urlsplit
 
+import redis
 import requests
 from django.conf import settings
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models import Q
 from lxml import etree
 from lxml.html import Element
+from requests.adapters import HTTPAdapter
 
-from meals.models import Customer, Sku, Sale
+from meals.models import (
+    Customer,
+    Sku,
+    Sale,
+    SalesRollup,
+    SalesFetchState,
+    SalesReadiness,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class SalesException(Exception):
@@ -58,52 +88,465 @@ class HtmlTableIterator:
         return self
 
 
-def query_sku_sales(sku_number: int, year: int, logger: Logger = None) -> int:
+class SalesRow(NamedTuple):
+    """A single sales record, as parsed from the legacy sales interface"""
+
+    year: int
+    week: int
+    customer_number: int
+    customer_name: str
+    sales: Decimal
+    price: Decimal
+
+
+# Maps each column of SalesRow to its header in the legacy sales table
+SALES_ROW_HEADERS = ("year", "week", "cust#", "cust_name", "sales", "price/case")
+SALES_ROW_CONVERTERS = (int, int, int, str, Decimal, Decimal)
+
+
+def _convert_sales_row(
+    cells: List[str], indices: List[int], row_number: int
+) -> SalesRow:
     """
-    Queries the Hypothetical Meals legacy sales interface and caches results.
-    :param sku_number: a SKU number to query
-    :param year: the year to query. Must be in range [1999, 2019]
+    Converts the cells of a row in the sales table into a SalesRow
+    :param cells: the text of every cell in the row
+    :param indices: the index of the cell of each column of SalesRow
+    :param row_number: the number of the row, counting from 1 after the headers
+    :return: the converted row
+    :raises: SalesException if a cell is missing or malformed
+    """
+    values = []
+    for header, index, convert in zip(SALES_ROW_HEADERS, indices, SALES_ROW_CONVERTERS):
+        cell = cells[index] if index < len(cells) else ""
+        try:
+            values.append(convert(cell))
+        except (ValueError, ArithmeticError):
+            raise SalesException(
+                f"Malformed value '{cell}' in column '{header}' of sales record "
+                f"#{row_number}"
+            )
+    return SalesRow(*values)
+
+
+def parse_sales_rows(
+    chunks: Iterable[bytes], encoding: str = None
+) -> Iterator[SalesRow]:
+    """
+    Incrementally parses the sales table returned by the legacy sales interface. The
+    HTML is fed to the parser chunk by chunk, and every table row is discarded as
+    soon as it has been converted, so memory use does not grow with the size of the
+    response (other than for the rows kept by the caller).
+    :param chunks: an iterable of chunks of the raw HTML, e.g., from
+        `Response.iter_content()`
+    :param encoding: the encoding of the HTML. If None, it is detected by lxml.
+    :return: an iterator of SalesRow, in the order they appear in the table
+    :raises: SalesException if no table with the expected headers can be found, or
+        if a record is malformed
+    """
+    parser = etree.HTMLPullParser(events=("end",), tag="tr", encoding=encoding)
+    indices = None
+    row_number = 0
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            parser.close()
+        else:
+            parser.feed(chunk)
+        for _, row in parser.read_events():
+            cells = [(td.text or "").strip() for td in row.iterchildren("td", "th")]
+            if indices is None:
+                try:
+                    indices = [cells.index(header) for header in SALES_ROW_HEADERS]
+                except ValueError:
+                    raise SalesException(
+                        f"Unexpected headers in sales records: {', '.join(cells)}"
+                    )
+            else:
+                row_number += 1
+                yield _convert_sales_row(cells, indices, row_number)
+            # Discard the row and anything before it, which has all been processed
+            row.clear()
+            parent = row.getparent()
+            while row.getprevious() is not None:
+                del parent[0]
+    if indices is None:
+        raise SalesException("Unable to find a table in sales records.")
+
+
+class RateLimiter:
+    """
+    A thread-safe limiter that spaces out calls so that at most `rate` calls are
+    made per second. A rate of 0 (or None) disables limiting.
+    """
+
+    def __init__(self, rate: float = None) -> None:
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            scheduled = max(self.next_time, now)
+            self.next_time = scheduled + self.interval
+        if scheduled > now:
+            time.sleep(scheduled - now)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A rate limiter shared by all processes using the same Redis server, e.g., every
+    Celery worker. Each call reserves the next free time slot in Redis, just as
+    `RateLimiter` does in memory, so the combined rate of all processes stays within
+    `rate`. Slots are computed from the wall clock, which is assumed to be in sync
+    across hosts. If Redis cannot be reached, only this process is limited.
+    """
+
+    # KEYS[1] holds the time of the next free slot. ARGV[1] is the current time and
+    # ARGV[2] the interval between slots, both in seconds.
+    RESERVE_SCRIPT = """
+        local now = tonumber(ARGV[1])
+        local scheduled = math.max(tonumber(redis.call('GET', KEYS[1]) or 0), now)
+        redis.call('SET', KEYS[1], tostring(scheduled + tonumber(ARGV[2])), 'EX', 60)
+        return tostring(scheduled)
+    """
+
+    def __init__(self, rate: float, url: str, key: str) -> None:
+        super().__init__(rate)
+        self.key = key
+        client = redis.Redis.from_url(url, socket_connect_timeout=1, socket_timeout=1)
+        self.reserve = client.register_script(self.RESERVE_SCRIPT)
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        try:
+            scheduled = float(
+                self.reserve(keys=[self.key], args=[time.time(), self.interval])
+            )
+        except redis.RedisError as e:
+            logger.warning("Unable to reserve a request slot in Redis: %s", e)
+            super().wait()
+            return
+        delay = scheduled - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+_SESSION_LOCK = threading.Lock()
+_SESSION: Optional[requests.Session] = None
+_RATE_LIMITERS: Dict[str, RateLimiter] = {}
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the HTTP session shared by this process. The session keeps connections
+    to the sales interface alive, with a pool large enough for a `SalesFetcher`
+    running at full concurrency.
+    """
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=settings.SALES_FETCH_CONCURRENCY
+            )
+            _SESSION = requests.Session()
+            _SESSION.mount("http://", adapter)
+            _SESSION.mount("https://", adapter)
+        return _SESSION
+
+
+def get_rate_limiter(url: str) -> RateLimiter:
+    """
+    Returns the rate limiter for the host serving url. If SALES_RATE_LIMIT_REDIS_URL
+    is set, the limiter is shared by all processes, and otherwise by this process.
+    """
+    host = urlsplit(url).netloc
+    with _SESSION_LOCK:
+        if host not in _RATE_LIMITERS:
+            if settings.SALES_RATE_LIMIT_REDIS_URL:
+                _RATE_LIMITERS[host] = SharedRateLimiter(
+                    settings.SALES_REQUEST_RATE_LIMIT,
+                    settings.SALES_RATE_LIMIT_REDIS_URL,
+                    f"meals:sales-rate-limit:{host}",
+                )
+            else:
+                _RATE_LIMITERS[host] = RateLimiter(settings.SALES_REQUEST_RATE_LIMIT)
+        return _RATE_LIMITERS[host]
+
+
+class SalesData(NamedTuple):
+    """The sales records of a SKU in a year, and a digest of the raw response"""
+
+    rows: List[SalesRow]
+    digest: str
+
+
+FetchResult = Tuple[Tuple[int, int], Optional[SalesData], Optional[Exception]]
+
+
+def _hashing(chunks: Iterable[bytes], digest) -> Iterator[bytes]:
+    """Feeds each chunk into digest as it is passed through"""
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+class SalesFetcher:
+    """
+    Fetches sales records from the legacy sales interface over a pooled session.
+    Many (SKU, year) pairs may be fetched concurrently, while requests to the same
+    host never exceed the configured rate limit.
+    """
+
+    def __init__(
+        self,
+        url: str = None,
+        max_workers: int = None,
+        session: requests.Session = None,
+        rate_limiter: RateLimiter = None,
+    ) -> None:
+        self.url = url or settings.SALES_INTERFACE_URL
+        self.max_workers = max_workers or settings.SALES_FETCH_CONCURRENCY
+        self.session = session or get_session()
+        self.rate_limiter = rate_limiter or get_rate_limiter(self.url)
+        self.timeout = (
+            settings.SALES_REQUEST_CONNECT_TIMEOUT,
+            settings.SALES_REQUEST_READ_TIMEOUT,
+        )
+
+    def fetch(self, sku_number: int, year: int) -> SalesData:
+        """
+        Fetches the sales records of a SKU in a particular year. The response is
+        parsed and hashed as it is streamed, without holding the whole document in
+        memory.
+        :return: the sales records, and a SHA-256 digest of the response
+        :raises: requests.RequestException if the request fails, or SalesException
+            if the response cannot be parsed
+        """
+        self.rate_limiter.wait()
+        with self.session.get(
+            self.url,
+            params={"sku": sku_number, "year": year},
+            timeout=self.timeout,
+            stream=True,
+        ) as resp:
+            resp.raise_for_status()
+            digest = hashlib.sha256()
+            chunks = _hashing(
+                resp.iter_content(chunk_size=settings.SALES_STREAM_CHUNK_SIZE), digest
+            )
+            rows = list(parse_sales_rows(chunks, resp.encoding))
+            return SalesData(rows, digest.hexdigest())
+
+    def _fetch_safe(self, sku_number: int, year: int) -> FetchResult:
+        try:
+            return (sku_number, year), self.fetch(sku_number, year), None
+        except (requests.RequestException, SalesException) as e:
+            return (sku_number, year), None, e
+
+    def fetch_many(self, pairs: Iterable[Tuple[int, int]]) -> Iterator[FetchResult]:
+        """
+        Fetches many (SKU, year) pairs concurrently. Results are yielded in the
+        calling thread as soon as they are available, so the caller may save them
+        to the database as they arrive.
+        :param pairs: an iterable of (SKU number, year) pairs
+        :return: an iterator of ((SKU number, year), data, error) tuples. Exactly one
+            of data and error is None.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(self._fetch_safe, sku_number, year)
+                for sku_number, year in pairs
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+
+# Numbers of customers known to exist in the database, shared by all ingestion tasks
+# in this process. Sales retrieval never deletes customers, and a customer deleted by
+# other means is caught by `save_sku_sales`, which then clears this cache.
+_KNOWN_CUSTOMERS: Set[int] = set()
+
+
+def ensure_customers(customers: Dict[int, str]) -> int:
+    """
+    Makes sure that all customers exist, creating any missing ones, using at most
+    one query and one bulk insert regardless of the number of customers. Must be
+    called within a transaction; customers are only remembered as known once it has
+    been committed.
+    :param customers: a dict mapping customer numbers to customer names
+    :return: the number of customers not already known to this process
+    :raises: SalesException if a missing customer has the name of another customer
+    """
+    missing = {
+        number: name
+        for number, name in customers.items()
+        if number not in _KNOWN_CUSTOMERS
+    }
+    if not missing:
+        return 0
+    matches = Customer.objects.filter(
+        Q(pk__in=missing.keys()) | Q(name__in=missing.values())
+    ).values_list("pk", "name")
+    existing = set()
+    owners: Dict[str, int] = {}
+    for number, name in matches:
+        existing.add(number)
+        owners[name] = number
+    new_customers = []
+    for number, name in missing.items():
+        if number in existing:
+            continue
+        owner = owners.setdefault(name, number)
+        if owner != number:
+            raise SalesException(
+                f"Customer #{number} has the same name as customer #{owner}: {name}"
+            )
+        new_customers.append(Customer(id=number, name=name))
+    # Conflicts are only ignored for customers inserted by another task since they
+    # were queried, which have the same numbers, or the sales records of a customer
+    # that was not inserted would fail to save
+    Customer.objects.bulk_create(new_customers, ignore_conflicts=True)
+    transaction.on_commit(lambda: _KNOWN_CUSTOMERS.update(missing.keys()))
+    return len(missing)
+
+
+def _changed_weeks(sku_number: int, year: int, rows: List[SalesRow]) -> Set[int]:
+    """
+    Compares the sales records of a SKU in a particular year in the database with
+    those retrieved, week by week, using one query.
+    :param sku_number: the SKU the records belong to
+    :param year: the year the records belong to
+    :param rows: the sales records retrieved
+    :return: the weeks whose records differ, including weeks missing on either side
+    """
+    retrieved = defaultdict(list)
+    for row in rows:
+        retrieved[row.week].append((row.customer_number, row.sales, row.price))
+    saved = defaultdict(list)
+    for week, *record in Sale.objects.filter(sku_id=sku_number, year=year).values_list(
+        "week", "customer_id", "sales", "price"
+    ):
+        saved[week].append(tuple(record))
+    return {
+        week
+        for week in retrieved.keys() | saved.keys()
+        if sorted(retrieved[week]) != sorted(saved[week])
+    }
+
+
+def save_sku_sales(
+    sku_number: int,
+    year: int,
+    rows: Iterable[SalesRow],
+    logger: Logger = None,
+    digest: str = "",
+    incremental: bool = False,
+) -> int:
+    """
+    Replaces the sales records of a SKU in a particular year with those retrieved
+    from the legacy sales interface, and records what was retrieved in a
+    `SalesFetchState`.
+
+    In incremental mode, nothing is written if the response is identical to the one
+    last retrieved. Otherwise, the records are compared with those in the database
+    week by week, and only the weeks that changed are replaced, so that corrections
+    to earlier weeks are picked up as well. The digest is stored in the same
+    transaction, once the database matches the response.
+    :param sku_number: the SKU the records belong to
+    :param year: the year the records belong to
+    :param rows: the sales records, as parsed by `parse_sales_rows`
     :param logger: a logger to use. If None, nothing will be logged
-    :return: number of sales records retrieved / saved
+    :param digest: a digest of the response the records were parsed from
+    :param incremental: whether to only write what changed since the last retrieval
+    :return: number of sales records saved
     """
-    sku = Sku.objects.filter(pk=sku_number)
-    if not sku.exists():
+    if not Sku.objects.filter(pk=sku_number).exists():
         # This really should not happen, but better safe than sorry
         raise SalesException("SKU number does not exist in database.")
-    sku = sku[0]
-    params = {"sku": sku_number, "year": year}
-    url = settings.SALES_INTERFACE_URL
-    connect_timeout = settings.SALES_REQUEST_CONNECT_TIMEOUT
-    read_timeout = settings.SALES_REQUEST_READ_TIMEOUT
-    resp = requests.get(url, params=params, timeout=(connect_timeout, read_timeout))
-    resp.raise_for_status()
-
-    if logger:
-        logger.debug("Raw HTML: %s", resp.text)
-    tree = etree.HTML(resp.text)
-    table = tree.find("body/table")
-    if table is None:
-        raise SalesException("Unable to find a table in sales records.")
+    rows = list(rows)
+    changed_weeks = None
+    if incremental:
+        state = SalesFetchState.objects.filter(sku_id=sku_number, year=year).first()
+        if state is not None:
+            if digest and state.digest == digest:
+                if logger:
+                    logger.debug(
+                        "Sales records for SKU #%d year %d are unchanged",
+                        sku_number,
+                        year,
+                    )
+                return 0
+            changed_weeks = _changed_weeks(sku_number, year, rows)
+    customers: Dict[int, str] = {}
     sales_records: List[Sale] = []
-    for row in HtmlTableIterator(table):
-        customer = Customer.objects.get_or_create(
-            id=int(row["cust#"]), defaults={"name": row["cust_name"]}
-        )[0]
-        year = int(row["year"])
-        week = int(row["week"])
-        sales = Decimal(row["sales"])
-        price = Decimal(row["price/case"])
+    for row in rows:
+        if changed_weeks is not None and row.week not in changed_weeks:
+            continue
+        customers.setdefault(row.customer_number, row.customer_name)
         sales_records.append(
             Sale(
-                sku=sku,
+                sku_id=sku_number,
+                year=row.year,
+                week=row.week,
+                customer_id=row.customer_number,
+                sales=row.sales,
+                price=row.price,
+            )
+        )
+    num_new = 0
+    try:
+        with transaction.atomic():
+            if changed_weeks is None or changed_weeks:
+                num_new = ensure_customers(customers)
+                stale = Sale.objects.filter(sku_id=sku_number, year=year)
+                if changed_weeks is not None:
+                    stale = stale.filter(week__in=changed_weeks)
+                stale.delete()
+                Sale.objects.bulk_create(sales_records)
+                SalesRollup.rebuild(sku_number, year)
+            _, created = SalesFetchState.objects.update_or_create(
+                sku_id=sku_number,
                 year=year,
-                week=week,
-                customer=customer,
-                sales=sales,
-                price=price,
+                defaults={
+                    "digest": digest,
+                    "last_week": max((row.week for row in rows), default=None),
+                },
             )
+            if created:
+                SalesReadiness.record_year(sku_number)
+    except IntegrityError as e:
+        # Most likely a customer was deleted or renamed since it was cached
+        _KNOWN_CUSTOMERS.clear()
+        raise SalesException(f"Unable to save sales records: {e}")
+    if logger:
+        logger.debug(
+            "Saved %d sales records (%d customers resolved) for SKU #%d year %d%s",
+            len(sales_records),
+            num_new,
+            sku_number,
+            year,
+            f" in weeks {sorted(changed_weeks)}" if changed_weeks is not None else "",
         )
-    with transaction.atomic():
-        Sale.objects.filter(sku=sku, year=year).delete()
-        Sale.objects.bulk_create(sales_records)
     return len(sales_records)
+
+
+def query_sku_sales(
+    sku_number: int, year: int, logger: Logger = None, incremental: bool = False
+) -> int:
+    """
+    Queries the Hypothetical Meals legacy sales interface and caches results.
+    :param sku_number: a SKU number to query
+    :param year: the year to query, from SALES_YEAR_START to the current year
+    :param logger: a logger to use. If None, nothing will be logged
+    :param incremental: whether to only save what changed since the last query. See
+        `save_sku_sales`.
+    :return: number of sales records retrieved / saved
+    """
+    if not Sku.objects.filter(pk=sku_number).exists():
+        # Fail before making a request to the sales interface
+        raise SalesException("SKU number does not exist in database.")
+    data = SalesFetcher().fetch(sku_number, year)
+    return save_sku_sales(
+        sku_number, year, data.rows, logger, data.digest, incremental=incremental
+    )
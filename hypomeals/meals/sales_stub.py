@@ -0,0 +1,100 @@
+"""
+A local stand-in for the Hypothetical Meals legacy sales interface. It serves the same
+HTML tables as the real interface, with deterministic, randomly generated records, so
+that sales retrieval can be tested and benchmarked offline.
+"""
+
+import logging
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+SALES_HEADERS = ["year", "sku", "week", "cust#", "cust_name", "sales", "price/case"]
+
+
+def generate_sales_html(
+    sku_number: int, year: int, num_customers: int = 10, num_weeks: int = 52
+) -> str:
+    """
+    Generates the sales records of a SKU in a year, as returned by the legacy sales
+    interface. The same arguments always generate the same records.
+    :param sku_number: the SKU number
+    :param year: the year
+    :param num_customers: number of customers buying the SKU each week
+    :param num_weeks: number of weeks in the year
+    :return: an HTML document containing a single table of sales records
+    """
+    rand = random.Random(f"{sku_number}-{year}")
+    rows = ["<tr>" + "".join(f"<td>{h}</td>" for h in SALES_HEADERS) + "</tr>"]
+    for week in range(1, num_weeks + 1):
+        for customer in range(1, num_customers + 1):
+            cells = [
+                year,
+                sku_number,
+                week,
+                customer,
+                f"Customer {customer}",
+                rand.randint(1, 1000),
+                f"{rand.uniform(1, 50):.2f}",
+            ]
+            rows.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>")
+    return (
+        "<html><head><title>Sales</title></head><body><table>\n"
+        + "\n".join(rows)
+        + "\n</table></body></html>"
+    )
+
+
+class SalesStubHandler(BaseHTTPRequestHandler):
+    """Handles `GET /?sku=<number>&year=<year>` like the legacy sales interface"""
+
+    # Overridden by `make_server`
+    latency = 0.0
+    num_customers = 10
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        params = parse_qs(urlsplit(self.path).query)
+        try:
+            sku_number = int(params["sku"][0])
+            year = int(params["year"][0])
+        except (KeyError, ValueError):
+            self.send_error(400, "Expected integer parameters 'sku' and 'year'")
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        body = generate_sales_html(sku_number, year, self.num_customers).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_server(
+    address: Tuple[str, int] = ("127.0.0.1", 0),
+    latency: float = 0.0,
+    num_customers: int = 10,
+) -> ThreadingHTTPServer:
+    """
+    Creates (but does not start) a stub sales server. Use port 0 to pick any free
+    port, which is then available as `server.server_address[1]`.
+    :param address: a (host, port) pair to listen on
+    :param latency: seconds to wait before responding, to simulate a remote server
+    :param num_customers: number of customers per week in generated records
+    :return: a server instance. Call `serve_forever()` to start serving.
+    """
+    handler = type(
+        "ConfiguredSalesStubHandler",
+        (SalesStubHandler,),
+        {"latency": latency, "num_customers": num_customers},
+    )
+    # Keep-alive connections require HTTP/1.1
+    handler.protocol_version = "HTTP/1.1"
+    return ThreadingHTTPServer(address, handler)
@@ -1,18 +1,19 @@
 """
 Contains algorithms for generic auto-scheduling
 """
+import bisect
 import functools
 import logging
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Mapping, Set, Tuple, Dict, Callable
+from typing import List, Mapping, Set, Tuple, Dict, Callable, Optional
 
-from django.db.models import Sum, F
+from django.db.models import Sum
 from django.utils import timezone
 
 from meals.constants import WORK_HOURS_END
 from meals.models import GoalItem
-from meals.utils import compute_end_time, compute_start_time
+from meals.utils import compute_end_time, compute_start_time, compute_work_hours
 
 logger = logging.getLogger(__name__)
 
@@ -57,9 +58,126 @@ class ScheduleException(Exception):
     pass
 
 
+class FreeBlocks:
+    """
+    The available time blocks of a group, e.g., a manufacturing line, in order.
+
+    Blocks are indexed by the number of work hours in them, in a segment tree of the
+    maximum in each range of blocks, so that the earliest or the latest block which
+    fits an item is found in logarithmic time. Blocks only ever shrink as items are
+    scheduled in them, so their starts stay sorted, and can be bisected.
+    """
+
+    # Work hours are floats: blocks which barely seem too short are checked anyway
+    EPSILON = 1e-6
+
+    def __init__(self, blocks: List[Tuple[datetime, datetime]]):
+        """
+        :param blocks: a list of (start, end) pairs of available time blocks, in order
+        """
+        self.starts = [st for st, _ in blocks]
+        self.ends = [et for _, et in blocks]
+        self._size = 1
+        while self._size < len(blocks):
+            self._size *= 2
+        self._tree = [float("-inf")] * (2 * self._size)
+        for i, (st, et) in enumerate(blocks):
+            self._tree[self._size + i] = compute_work_hours(st, et)
+        for node in reversed(range(1, self._size)):
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> Tuple[datetime, datetime]:
+        return self.starts[i], self.ends[i]
+
+    def update(self, i: int, start: datetime, end: datetime) -> None:
+        """
+        Shrinks a block, after an item is scheduled in it.
+        :param i: the index of the block
+        :param start: the new start of the block
+        :param end: the new end of the block
+        """
+        self.starts[i], self.ends[i] = start, end
+        node = self._size + i
+        self._tree[node] = compute_work_hours(start, end) if start < end else -1
+        node //= 2
+        while node:
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def _first(self, lo: int, hours: float, node=1, node_lo=0, node_hi=None):
+        # The first block at or after lo with at least the given work hours
+        if node_hi is None:
+            node_hi = self._size
+        if node_hi <= lo or self._tree[node] < hours:
+            return None
+        if node_hi - node_lo == 1:
+            return node_lo
+        mid = (node_lo + node_hi) // 2
+        found = self._first(lo, hours, 2 * node, node_lo, mid)
+        if found is None:
+            found = self._first(lo, hours, 2 * node + 1, mid, node_hi)
+        return found
+
+    def _last(self, hi: int, hours: float, node=1, node_lo=0, node_hi=None):
+        # The last block before hi with at least the given work hours
+        if node_hi is None:
+            node_hi = self._size
+        if node_lo >= hi or self._tree[node] < hours:
+            return None
+        if node_hi - node_lo == 1:
+            return node_lo
+        mid = (node_lo + node_hi) // 2
+        found = self._last(hi, hours, 2 * node + 1, mid, node_hi)
+        if found is None:
+            found = self._last(hi, hours, 2 * node, node_lo, mid)
+        return found
+
+    def earliest_fit(self, hours: float) -> Optional[int]:
+        """
+        Finds the earliest block in which an item can be scheduled to start.
+        :param hours: the number of work hours of the item
+        :return: the index of the block, or None if no block is long enough
+        """
+        i = self._first(0, hours - self.EPSILON)
+        while i is not None:
+            if compute_end_time(self.starts[i], hours) <= self.ends[i]:
+                return i
+            i = self._first(i + 1, hours - self.EPSILON)
+        return None
+
+    def latest_fit(
+        self, hours: float, deadline: datetime
+    ) -> Optional[Tuple[int, datetime]]:
+        """
+        Finds the latest block in which an item can be scheduled to finish by a
+        deadline.
+        :param hours: the number of work hours of the item
+        :param deadline: the time by which the item must finish
+        :return: a pair of (the index of the block, the latest start time of the item
+            in it), or None if no block before the deadline is long enough
+        """
+        hi = bisect.bisect_right(self.starts, deadline)
+        if hi and self.ends[hi - 1] > deadline:
+            # This block only fits the item in its part before the deadline
+            hi -= 1
+            start = compute_start_time(deadline, hours)
+            if start >= self.starts[hi]:
+                return hi, start
+        i = self._last(hi, hours - self.EPSILON)
+        while i is not None:
+            start = compute_start_time(self.ends[i], hours)
+            if start >= self.starts[i]:
+                return i, start
+            i = self._last(i, hours - self.EPSILON)
+        return None
+
+
 def _get_available_blocks(
     existing_items: Mapping[str, List[ExistingItem]], start: datetime, end: datetime
-) -> Dict[str, List[Tuple[datetime, datetime]]]:
+) -> Dict[str, FreeBlocks]:
     """
     Finds available time blocks in each group. A time block is a chunk of time in
     which an item can be scheduled.
@@ -68,12 +186,11 @@ def _get_available_blocks(
     :param end: end time
     :return: a dict mapping group to available time blocks
     """
-    schedules: Dict[str, List[Tuple[datetime, datetime]]] = {}
+    schedules: Dict[str, FreeBlocks] = {}
     for ml_sn, goals in existing_items.items():
-        relevant_goals = []
-        for item in goals:
-            if item.start <= end and item.end >= start:
-                relevant_goals.append(item)
+        relevant_goals = sorted(
+            item for item in goals if item.start <= end and item.end >= start
+        )
         time_block = []
         cur_start = start
         # Special check
@@ -87,7 +204,7 @@ def _get_available_blocks(
             cur_start = schedule.end
         if cur_start < end:
             time_block.append((cur_start, end))
-        schedules[ml_sn] = time_block
+        schedules[ml_sn] = FreeBlocks(time_block)
     return schedules
 
 
@@ -123,17 +240,14 @@ def schedule(
         min_ml = None
         min_block_id = None
         for ml in item.groups:
-            earliest_time = end
-            earliest_block_id = None
-            for i, (st, et) in enumerate(ml_schedules[ml]):
-                if compute_end_time(st, item.hours) <= et:
-                    earliest_time = st
-                    earliest_block_id = i
-                    break
+            block_id = ml_schedules[ml].earliest_fit(item.hours)
+            if block_id is None:
+                continue
+            earliest_time = ml_schedules[ml].starts[block_id]
             if earliest_time < min_earliest_time:
                 min_earliest_time = earliest_time
                 min_ml = ml
-                min_block_id = earliest_block_id
+                min_block_id = block_id
         if min_ml is None:
             raise ScheduleException("Unable to schedule: too many items.")
         else:
@@ -145,11 +259,8 @@ def schedule(
             schedules.append(
                 Schedule(item.item.id, min_earliest_time, item_end_time, min_ml)
             )
-            st, et = ml_schedules[min_ml][min_block_id]
-            if et == item_end_time:
-                del ml_schedules[min_ml][min_block_id]
-            else:
-                ml_schedules[min_ml][min_block_id] = (item_end_time, et)
+            _, et = ml_schedules[min_ml][min_block_id]
+            ml_schedules[min_ml].update(min_block_id, item_end_time, et)
     logger.info("Scheduled %d items: %s", len(schedules), schedules)
     return list(map(Schedule.to_dict, schedules))
 
@@ -180,9 +291,9 @@ def schedule_max_profit(
     # time first
     items.sort(
         key=lambda item: (
-            item.item.sku.sales.aggregate(revenue=Sum(F("price") * F("sales")))[
-                "revenue"
-            ],
+            item.item.sku.sales_rollups.filter(
+                week__isnull=True, customer__isnull=True
+            ).aggregate(revenue=Sum("revenue"))["revenue"],
             item.hours,
         )
     )
@@ -196,20 +307,14 @@ def schedule_max_profit(
             datetime.combine(item.item.goal.deadline, WORK_HOURS_END)
         )
         for ml in item.groups:
-            latest_time = end
-            latest_block_id = None
-            found = False
-            for i, (st, et) in reversed(list(enumerate(ml_schedules[ml]))):
-                deadline = et if et <= item_deadline else item_deadline
-                if compute_start_time(deadline, item.hours) >= st:
-                    latest_time = compute_start_time(deadline, item.hours)
-                    latest_block_id = i
-                    found = True
-                    break
-            if found:
+            fit = ml_schedules[ml].latest_fit(item.hours, item_deadline)
+            if fit is None:
+                continue
+            block_id, latest_time = fit
+            if opt_ml is None or latest_time > max_latest_time:
                 max_latest_time = latest_time
                 opt_ml = ml
-                opt_block_id = latest_block_id
+                opt_block_id = block_id
         if opt_ml is None:
             raise ScheduleException("Unable to schedule: too many items.")
         else:
@@ -217,11 +322,8 @@ def schedule_max_profit(
             schedules.append(
                 Schedule(item.item.id, max_latest_time, item_end_time, opt_ml)
             )
-            st, et = ml_schedules[opt_ml][opt_block_id]
-            if st == max_latest_time:
-                del ml_schedules[opt_ml][opt_block_id]
-            else:
-                ml_schedules[opt_ml][opt_block_id] = (st, max_latest_time)
+            st, _ = ml_schedules[opt_ml][opt_block_id]
+            ml_schedules[opt_ml].update(opt_block_id, st, max_latest_time)
     logger.info("Scheduled %d items: %s", len(schedules), schedules)
     return list(map(Schedule.to_dict, schedules))
 
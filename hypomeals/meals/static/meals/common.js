@@ -329,6 +329,45 @@ function postJson(url, data, suppressAlerts) {
     return ajaxJson(url, "post", data, suppressAlerts);
 }
 
+/**
+ * Requests an export to be run in the background, and downloads the exported
+ * file once it is ready by polling the status of the export.
+ * @param url the URL requesting the export, e.g., "/sku?export=1&async=1"
+ * @param data the data to post along with the request, e.g., a serialized
+ *      filter form
+ * @param interval the interval (in ms) between polls. Defaults to 2 seconds.
+ * @return a Deferred object that is resolved with the status of the export
+ *      when it has finished, or rejected with an error
+ */
+function runExportJob(url, data, interval) {
+    let deferred = $.Deferred();
+    if (interval === undefined) {
+        interval = 2000;
+    }
+    makeToast("Exporting", "Your export is being prepared. " +
+        "The download will start automatically when it is ready.", 5000);
+
+    function poll(job) {
+        if (!job.finished) {
+            setTimeout(function() {
+                getJson(job.status_url, {}).done(poll)
+                    .fail(deferred.reject);
+            }, interval);
+            return;
+        }
+        if (job.error) {
+            makeModalAlert("Export Failed", job.error);
+            deferred.reject(job.error);
+            return;
+        }
+        window.location.href = job.download_url;
+        deferred.resolve(job);
+    }
+
+    postJson(url, data).done(poll).fail(deferred.reject);
+    return deferred;
+}
+
 /**
  * Turns an <input> element into an input group, optionally appending/prepending
  * text/elements
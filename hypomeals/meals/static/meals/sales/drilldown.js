@@ -1,5 +1,7 @@
 $(function () {
     const pageNumInputId = $("#pageNumInputId").val();
+    const afterInputId = $("#afterInputId").val();
+    const beforeInputId = $("#beforeInputId").val();
     const salesUrl = $("#salesUrl").attr("href");
     let submitButton = $("#submitButton");
     let resetButton = $("#resetAllButton");
@@ -11,7 +13,15 @@ $(function () {
         window.location.href = salesUrl;
     }
 
+    function setPage(page, after, before) {
+        $(`#${pageNumInputId}`).val(page);
+        $(`#${afterInputId}`).val(after || "");
+        $(`#${beforeInputId}`).val(before || "");
+    }
+
     submitButton.click(function () {
+        // New filters start over from the first page
+        setPage(1);
         drilldownFilterForm.submit();
     });
 
@@ -38,9 +48,12 @@ $(function () {
     });
 
     /************** Pagination ****************/
-    $("#pageList").find("a").on("click", function () {
-        let page = $(this).attr("data-page");
-        $(`#${pageNumInputId}`).val(page);
+    $("#pageList").find("a[data-page]").on("click", function () {
+        setPage(
+            $(this).attr("data-page"),
+            $(this).attr("data-after"),
+            $(this).attr("data-before")
+        );
         drilldownFilterForm.submit();
     });
 
@@ -15,12 +15,8 @@ $(function () {
 
     exportButton.click(function () {
         const original = productLineFilterForm.attr("action");
-        let query = "?export=1";
-        productLineFilterForm.attr("action", original + query)
-            .submit()
-            // Reset the form action so the user can submit another filter
-            // request after downloading the exported file.
-            .attr("action", original);
+        let query = "?export=1&async=1";
+        runExportJob(original + query, productLineFilterForm.serialize());
         return false;
     });
 
@@ -56,18 +56,14 @@ $(function () {
 
     exportButton.click(function () {
         const original = skuFilterForm.attr("action");
-        let query = "?export=1";
+        let query = "?export=1&async=1";
         if (exportFormulaCheckbox.prop("checked")) {
             query += "&formulas=1";
         }
         if (exportProductLineCheckbox.prop("checked")) {
             query += "&pl=1"
         }
-        skuFilterForm.attr("action", original + query)
-            .submit()
-            // Reset the form action so the user can submit another filter
-            // request after downloading the exported file.
-            .attr("action", original);
+        runExportJob(original + query, skuFilterForm.serialize());
         return false;
     });
 
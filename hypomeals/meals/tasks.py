@@ -3,6 +3,7 @@ import subprocess
 import tempfile
 from collections import defaultdict
 from datetime import datetime, time
+from typing import List, Tuple, Iterable
 
 from celery.exceptions import Retry
 from celery.utils.log import get_task_logger
@@ -17,8 +18,9 @@ from requests import HTTPError, Timeout
 from HypoMeals.celery import app
 
 from meals import utils
-from meals.models import Sku
-from meals.sales import SalesException, query_sku_sales
+from meals.bulk_export import run_export_job
+from meals.models import ExportJob, Sku
+from meals.sales import SalesException, SalesFetcher, query_sku_sales, save_sku_sales
 
 logger = get_task_logger(__name__)
 
@@ -29,23 +31,87 @@ logger = get_task_logger(__name__)
     retry_kwargs={"max_retries": settings.SALES_REQUEST_MAX_RETRIES},
     retry_backoff=True,
 )
-def get_sku_sales_for_year(sku_number: int, year: int) -> int:
+def get_sku_sales_for_year(
+    sku_number: int, year: int, incremental: bool = False
+) -> int:
     logger.info("Getting sales data for SKU #%d year %d", sku_number, year)
-    result = query_sku_sales(sku_number, year, logger)
+    result = query_sku_sales(sku_number, year, logger, incremental=incremental)
     logger.info("Saved %d results for SKU #%d year %d", result, sku_number, year)
     return result
 
 
+@app.task
+def get_sales_batch(pairs: List[Tuple[int, int]], incremental: bool = False) -> int:
+    """
+    Fetches sales data for many (SKU, year) pairs concurrently in one worker. Pairs
+    that fail are rescheduled individually, so that they are retried with backoff.
+    In incremental mode, only sales data that changed since the last fetch is saved.
+    """
+    logger.info("Getting sales data for %d SKU-years", len(pairs))
+    total = 0
+    for (sku_number, year), data, error in SalesFetcher().fetch_many(pairs):
+        if error is None:
+            try:
+                total += save_sku_sales(
+                    sku_number,
+                    year,
+                    data.rows,
+                    logger,
+                    data.digest,
+                    incremental=incremental,
+                )
+                continue
+            except SalesException as e:
+                error = e
+        logger.warning(
+            "Unable to get sales data for SKU #%d year %d: %s", sku_number, year, error
+        )
+        get_sku_sales_for_year.apply_async(
+            args=(sku_number, year, incremental), countdown=settings.SALES_TIMEOUT
+        )
+    logger.info("Saved %d results for %d SKU-years", total, len(pairs))
+    return total
+
+
+def schedule_sales_batches(
+    pairs: Iterable[Tuple[int, int]], incremental: bool = False, **options
+) -> list:
+    """
+    Splits (SKU, year) pairs into batches, and schedules a task for each batch
+    :param pairs: an iterable of (SKU number, year) pairs
+    :param incremental: whether to only save sales data that changed
+    :param options: extra options to `apply_async`, e.g., countdown
+    :return: a list of `AsyncResult`s, one for each batch
+    """
+    return [
+        get_sales_batch.apply_async(args=(batch, incremental), **options)
+        for batch in utils.chunked(pairs, settings.SALES_FETCH_BATCH_SIZE)
+    ]
+
+
 @app.task
 def refresh_sales_for_current_year() -> int:
     now = timezone.now()
-    num_processed = 0
-    for number in Sku.objects.values_list("number", flat=True).distinct():
-        logger.info("Refreshing sales for SKU #%d", number)
-        get_sku_sales_for_year.apply_async(args=(number, now.year))
-        num_processed += 1
-    logger.info("Scheduled %d SKUs for refresh", num_processed)
-    return num_processed
+    numbers = list(Sku.objects.values_list("number", flat=True).distinct())
+    schedule_sales_batches(((number, now.year) for number in numbers), incremental=True)
+    logger.info("Scheduled %d SKUs for refresh", len(numbers))
+    return len(numbers)
+
+
+@app.task
+def run_export(job_id: int) -> str:
+    job = ExportJob.objects.get(pk=job_id)
+    logger.info("Running %s", job)
+    run_export_job(job)
+    logger.info("Finished %s", job)
+    return job.status
+
+
+@app.task
+def purge_expired_exports() -> int:
+    num_deleted = ExportJob.purge_expired()
+    logger.info("Deleted %d expired exports", num_deleted)
+    return num_deleted
 
 
 @app.task
@@ -122,7 +122,7 @@ class BaseTestCase(TestCase):
             else:
                 formula = self.create_formula(ingredients=self.create_ingredient())
 
-        instance = Sku.objects.create(
+        instance = Sku(
             name=name,
             number=number,
             case_upc=case_upc,
@@ -133,6 +133,8 @@ class BaseTestCase(TestCase):
             formula_scale=formula_scale or 1.0,
             comment=f"Test SKU #{number}",
         )
+        # Do not reach out to the sales interface in tests
+        instance.save(no_sales=True)
 
         if manufacturing_lines:
             if not isinstance(manufacturing_lines[0], ManufacturingLine):
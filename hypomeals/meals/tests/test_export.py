@@ -0,0 +1,228 @@
+import csv
+import io
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from django.utils import timezone
+
+from meals.bulk_export import (
+    ASYNC_EXPORTS,
+    AsyncExport,
+    HEADERS,
+    export_drilldown,
+    export_formulas,
+    export_ingredients,
+    export_job_status,
+    export_skus,
+    generate_ingredient_dependency_report,
+    run_export_async,
+    run_export_job,
+    stream_csv,
+    stream_zip,
+)
+from meals.models import (
+    Customer,
+    ExportJob,
+    Formula,
+    Ingredient,
+    ManufacturingLine,
+    Sale,
+    Sku,
+    SkuManufacturingLine,
+)
+from .test_base import BaseTestCase
+
+
+class StreamingExportTest(BaseTestCase):
+    def test_stream_csv(self):
+        rows = [["a", "b"]] + [[i, f"row, {i}"] for i in range(1200)]
+        chunks = list(stream_csv(rows))
+        # Rows are sent a few at a time rather than one by one, or all at once
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(
+            [[str(col) for col in row] for row in rows],
+            list(csv.reader(io.StringIO("".join(chunks)))),
+        )
+
+    def test_stream_zip(self):
+        files = [("a.csv", iter(["a,b\r\n", "1,2\r\n"])), ("b.csv", iter(["c\r\n"]))]
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(files))))
+        self.assertEqual(["a.csv", "b.csv"], archive.namelist())
+        self.assertEqual(b"a,b\r\n1,2\r\n", archive.read("a.csv"))
+        self.assertEqual(b"c\r\n", archive.read("b.csv"))
+
+    def test_export_ingredients(self):
+        self.create_ingredient("flour")
+        self.create_ingredient("sugar")
+        response = export_ingredients(Ingredient.objects.order_by("number"))
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b"".join(response).decode())))
+        self.assertEqual(HEADERS["ingredients"], rows[0])
+        self.assertEqual(["flour", "sugar"], [row[1] for row in rows[1:]])
+
+    def test_export_skus_with_formulas(self):
+        self.create_sku(ingredients=["flour", "sugar"])
+        response = export_skus(Sku.objects.all(), include_formulas=True)
+        self.assertEqual("application/zip", response["Content-Type"])
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response)))
+        self.assertEqual(["skus.csv", "formulas.csv"], archive.namelist())
+        formulas = list(csv.reader(io.StringIO(archive.read("formulas.csv").decode())))
+        self.assertEqual(3, len(formulas))
+
+    def test_export_queries(self):
+        # Bypass ManufacturingLine.save(), which sets up permissions
+        line, other = ManufacturingLine.objects.bulk_create(
+            ManufacturingLine(name=name, shortname=name) for name in ("LINE1", "LINE2")
+        )
+        for i in range(5):
+            sku = self.create_sku(ingredients=[f"ingr {i}", "flour"])
+            SkuManufacturingLine.objects.create(sku=sku, line=line)
+            SkuManufacturingLine.objects.create(sku=sku, line=other)
+        self.create_sku(ingredients=["flour"])
+
+        with self.assertNumQueries(1):
+            response = export_skus(Sku.objects.order_by("number"))
+            rows = list(csv.reader(io.StringIO(b"".join(response).decode())))
+        self.assertEqual(7, len(rows))
+        shortnames = [row[HEADERS["skus"].index("ML Shortnames")] for row in rows[1:]]
+        self.assertEqual(["LINE1,LINE2"] * 5 + [""], shortnames)
+
+        with self.assertNumQueries(1):
+            response = export_formulas(Formula.objects.all())
+            rows = list(csv.reader(io.StringIO(b"".join(response).decode())))
+        self.assertEqual(12, len(rows))
+        self.assertEqual("1.000000 kg", rows[1][HEADERS["formulas"].index("Quantity")])
+
+    def test_export_ordered_skus(self):
+        line, other = ManufacturingLine.objects.bulk_create(
+            ManufacturingLine(name=name, shortname=name) for name in ("LINE1", "LINE2")
+        )
+        for i in range(3):
+            sku = self.create_sku(ingredients=[f"ingr {i}"])
+            SkuManufacturingLine.objects.create(sku=sku, line=line)
+            SkuManufacturingLine.objects.create(sku=sku, line=other)
+        # Ordering by a many-valued relation must not split the aggregated rows
+        response = export_skus(
+            Sku.objects.order_by("-number", "manufacturing_lines__shortname")
+        )
+        rows = list(csv.reader(io.StringIO(b"".join(response).decode())))
+        self.assertEqual(["3", "2", "1"], [row[0] for row in rows[1:]])
+        shortnames = [row[HEADERS["skus"].index("ML Shortnames")] for row in rows[1:]]
+        self.assertEqual(["LINE1,LINE2"] * 3, shortnames)
+
+    def test_export_drilldown(self):
+        sku = self.create_sku(ingredients=["flour"])
+        customer = Customer.objects.create(id=7, name="Customer 7")
+        Sale.objects.create(
+            sku=sku, year=2018, week=3, customer=customer, sales=4, price="2.5"
+        )
+        response = export_drilldown(Sale.objects.select_related("customer"))
+        rows = list(csv.reader(io.StringIO(b"".join(response).decode())))
+        self.assertEqual(
+            ["2018", "3", "7", "Customer 7", "4.000000", "2.50", "10.0"], rows[1]
+        )
+
+
+class ExportJobTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_run_export(self):
+        skus = [self.create_sku(ingredients=[f"ingr {i}"]) for i in range(3)]
+        params = {
+            "skus": [sku.number for sku in reversed(skus)],
+            "formulas": True,
+            "product_lines": False,
+        }
+        job = run_export_async("skus", params)
+        self.assertEqual(ExportJob.PENDING, job.status)
+        # Identical exports reuse the same job, even before it finishes
+        self.assertEqual(job, run_export_async("skus", dict(params)))
+
+        run_export_job(job)
+        job.refresh_from_db()
+        self.assertEqual(ExportJob.SUCCESS, job.status)
+        self.assertEqual("archive.zip", job.filename)
+        with default_storage.open(job.path, "rb") as file:
+            archive = zipfile.ZipFile(io.BytesIO(file.read()))
+        rows = list(csv.reader(io.StringIO(archive.read("skus.csv").decode())))
+        self.assertEqual(
+            [str(sku.number) for sku in reversed(skus)], [row[0] for row in rows[1:]]
+        )
+        self.assertEqual(
+            f"/export/download/{job.pk}", export_job_status(job)["download_url"]
+        )
+
+        # Once the cache expires, the export is run again
+        ExportJob.objects.filter(pk=job.pk).update(
+            create_time=timezone.now() - timedelta(seconds=settings.EXPORT_CACHE_TTL)
+        )
+        self.assertNotEqual(job, run_export_async("skus", params))
+
+    def test_failed_export(self):
+        def export(params):
+            raise RuntimeError(f"Unable to export {params['skus']}")
+
+        with patch.dict(ASYNC_EXPORTS, failing=AsyncExport(export, ())):
+            job = run_export_async("failing", {"skus": [1]})
+            run_export_job(job)
+            job.refresh_from_db()
+            self.assertEqual(ExportJob.FAILURE, job.status)
+            self.assertEqual("Unable to export [1]", job.error)
+            self.assertIsNone(export_job_status(job)["download_url"])
+            # Failed exports are not reused
+            self.assertNotEqual(job, run_export_async("failing", {"skus": [1]}))
+
+    def test_purge_expired(self):
+        sku = self.create_sku(ingredients=["flour"])
+        params = {"skus": [sku.number], "formulas": False, "product_lines": False}
+        job = run_export_async("skus", params)
+        run_export_job(job)
+        job.refresh_from_db()
+        recent = run_export_async("skus", dict(params, formulas=True))
+        run_export_job(recent)
+        self.assertEqual(0, ExportJob.purge_expired())
+
+        ExportJob.objects.filter(pk=job.pk).update(
+            create_time=timezone.now() - timedelta(seconds=settings.EXPORT_CACHE_TTL)
+        )
+        self.assertTrue(default_storage.exists(job.path))
+        self.assertEqual(1, ExportJob.purge_expired())
+        self.assertFalse(default_storage.exists(job.path))
+        self.assertEqual([recent], list(ExportJob.objects.all()))
+
+
+class DependencyReportTest(BaseTestCase):
+    def test_report(self):
+        flour = self.create_ingredient("flour")
+        sugar = self.create_ingredient("sugar")
+        salt = self.create_ingredient("salt")
+        formula = self.create_formula(ingredients=[flour, sugar])
+        skus = [self.create_sku(formula=formula) for _ in range(2)]
+        other = self.create_sku(ingredients=[flour])
+        with self.assertNumQueries(1):
+            response = generate_ingredient_dependency_report(
+                Ingredient.objects.filter(pk__in=[flour.pk, sugar.pk, salt.pk])
+            )
+            rows = list(csv.reader(io.StringIO(b"".join(response).decode())))
+        expected = [
+            [str(ingr.number), ingr.name, str(sku.number), sku.name]
+            for ingr, sku in [
+                (flour, skus[0]),
+                (flour, skus[1]),
+                (flour, other),
+                (sugar, skus[0]),
+                (sugar, skus[1]),
+            ]
+        ]
+        self.assertEqual(expected, rows[1:])
@@ -0,0 +1,413 @@
+import csv
+import io
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from meals import bulk_import, utils
+from meals.exceptions import UserFacingException
+from meals.forms import ImportForm
+from meals.importers import (
+    CollisionOccurredException,
+    DuplicateException,
+    FormulaImporter,
+    IngredientImporter,
+    IntegrityException,
+    ProductLineImporter,
+    Resolver,
+    SkuImporter,
+)
+from meals.models import (
+    Customer,
+    Formula,
+    ImportTransaction,
+    Ingredient,
+    ManufacturingLine,
+    ProductLine,
+    Sale,
+    Sku,
+    Vendor,
+)
+from .test_base import BaseTestCase
+
+
+def to_lines(header, rows):
+    stream = io.StringIO()
+    writer = csv.writer(stream, dialect="unix")
+    writer.writerow(header)
+    writer.writerows(rows)
+    return stream.getvalue().splitlines()
+
+
+class SkuImportTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product_line = self.create_product_line()
+        self.formula = self.create_formula(ingredients=["flour"])
+        # Bypass ManufacturingLine.save(), which sets up permissions
+        ManufacturingLine.objects.bulk_create(
+            ManufacturingLine(name=name, shortname=name) for name in ("LINE1", "LINE2")
+        )
+
+    def sku_row(self, number, name=None, upc=None):
+        return [
+            number,
+            name or f"SKU {number}",
+            upc or utils.generate_random_upc(),
+            utils.generate_random_upc(),
+            "12 oz",
+            10,
+            self.product_line.name,
+            self.formula.number,
+            "1.5",
+            "LINE1, LINE2",
+            "10",
+            "$1.00",
+            "$2.00",
+            "",
+        ]
+
+    def do_import(self, rows):
+        importer = SkuImporter("skus.csv")
+        return importer, importer.do_import(to_lines(SkuImporter.header, rows))
+
+
+class SkuImporterTest(SkuImportTestCase):
+    def test_import(self):
+        _, result = self.do_import([self.sku_row(number) for number in range(1, 21)])
+        self.assertEqual((20, 0, 0), result)
+        self.assertEqual(20, Sku.objects.count())
+        self.assertEqual(
+            ["LINE1", "LINE2"],
+            list(
+                Sku.objects.get(number=5)
+                .manufacturing_lines.order_by("shortname")
+                .values_list("shortname", flat=True)
+            ),
+        )
+
+    def test_query_count(self):
+        def count_queries(numbers):
+            with CaptureQueriesContext(connection) as queries:
+                self.do_import([self.sku_row(number) for number in numbers])
+            return len(queries)
+
+        # The number of queries does not grow with the number of rows
+        self.assertEqual(count_queries(range(1, 3)), count_queries(range(10, 40)))
+
+    def test_collision(self):
+        sku = self.create_sku(formula=self.formula, product_line=self.product_line)
+        customer = Customer.objects.create(id=1, name="Customer")
+        Sale.objects.create(
+            sku=sku, year=2018, week=1, customer=customer, sales=1, price=1
+        )
+        row = self.sku_row(sku.number, name="New name", upc=sku.case_upc.upc_number)
+        importer = SkuImporter("skus.csv")
+        with self.assertRaises(CollisionOccurredException):
+            importer.do_import(to_lines(SkuImporter.header, [row, self.sku_row(100)]))
+        self.assertEqual("SKU #1", Sku.objects.get(number=sku.number).name)
+        self.assertFalse(Sku.objects.filter(number=100).exists())
+
+        self.assertEqual((1, 1, 0), importer.commit())
+        self.assertEqual("New name", Sku.objects.get(number=sku.number).name)
+        self.assertTrue(Sku.objects.filter(number=100).exists())
+        # The SKU is updated in place, so its sales are kept
+        self.assertEqual(1, Sale.objects.filter(sku=sku).count())
+
+    def test_identical(self):
+        self.do_import([self.sku_row(1)])
+        sku = Sku.objects.get(number=1)
+        row = self.sku_row(1, upc=sku.case_upc.upc_number)
+        row[3] = sku.unit_upc.upc_number
+        self.assertEqual((0, 0, 1), self.do_import([row])[1])
+
+    def test_errors(self):
+        row = self.sku_row(2)
+        with self.assertRaisesRegex(DuplicateException, r"skus\.csv:4:[\s\S]*line 3"):
+            self.do_import([self.sku_row(1), row, row])
+        row = self.sku_row(3)
+        row[9] = "LINE1, LINE3"
+        with self.assertRaisesRegex(IntegrityException, r"skus\.csv:3") as cm:
+            self.do_import([self.sku_row(1), row])
+        self.assertEqual("LINE3", cm.exception.fk_value)
+        self.assertFalse(Sku.objects.exists())
+
+    @override_settings(IMPORT_PARSE_WORKERS=2, IMPORT_PARSE_CHUNK_ROWS=4)
+    def test_parallel_parse(self):
+        def upload(rows):
+            content = "\n".join(to_lines(SkuImporter.header, rows)).encode()
+            return {"skus": SimpleUploadedFile("skus.csv", content)}
+
+        rows = [self.sku_row(number) for number in range(1, 20)]
+        with self.assertLogs(bulk_import.logger, level="INFO") as cm:
+            inserted, _ = bulk_import.process_csv_files(upload(rows), "session")
+        self.assertInAny("Parsed 19 rows in 5 chunks", cm.output)
+        self.assertEqual(19, inserted["SKU"])
+        self.assertEqual(
+            list(range(1, 20)), list(Sku.objects.values_list("number", flat=True))
+        )
+
+        # Errors are reported at the first row which fails, in any chunk
+        rows = [self.sku_row(number) for number in range(20, 40)]
+        rows[13][2] = "123"
+        rows[17][0] = "abc"
+        with self.assertRaisesRegex(UserFacingException, r"skus\.csv:15: 123"):
+            bulk_import.process_csv_files(upload(rows), "session")
+        self.assertEqual(19, Sku.objects.count())
+
+
+class DryRunTest(SkuImportTestCase):
+    def test_dry_run(self):
+        sku = self.create_sku(formula=self.formula, product_line=self.product_line)
+        row = self.sku_row(sku.number, name="New name", upc=sku.case_upc.upc_number)
+        importer = SkuImporter("skus.csv")
+        with CaptureQueriesContext(connection) as queries:
+            report = importer.dry_run(
+                to_lines(SkuImporter.header, [row, self.sku_row(100)])
+            )
+        self.assertFalse(
+            any(query["sql"].startswith(("INSERT", "UPDATE")) for query in queries)
+        )
+        self.assertEqual(2, report.num_rows)
+        self.assertEqual([100], [instance.number for instance in report.inserted])
+        self.assertEqual("New name", report.updated[0].new_instance.name)
+        self.assertEqual(["parse", "resolve", "classify"], list(report.timings))
+        self.assertFalse(Sku.objects.filter(number=100).exists())
+
+        # The dry run may still be committed
+        self.assertEqual((1, 1, 0), importer.commit())
+        self.assertIn("write", importer.report().timings)
+        self.assertEqual("New name", Sku.objects.get(number=sku.number).name)
+
+    def test_preview(self):
+        product_lines = to_lines(ProductLineImporter.header, [["New line"]])
+        row = self.sku_row(1)
+        row[6] = "New line"
+        skus = to_lines(SkuImporter.header, [row])
+        files = {
+            "skus": io.BytesIO("\n".join(skus).encode()),
+            "product_lines": io.BytesIO("\n".join(product_lines).encode()),
+        }
+        for name, stream in files.items():
+            stream.name = f"{name}.csv"
+        reports = bulk_import.preview_csv_files(files)
+        self.assertEqual(
+            [("product_lines.csv", 1), ("skus.csv", 1)],
+            [(report.filename, len(report.inserted)) for report in reports],
+        )
+        self.assertIn("write", reports[1].timings)
+        self.assertIn("total", reports[1].throughput())
+        # Nothing is kept
+        self.assertFalse(ProductLine.objects.filter(name="New line").exists())
+        self.assertFalse(Sku.objects.exists())
+
+
+class ResolverTest(SkuImportTestCase):
+    def test_shared_lookups(self):
+        resolver = Resolver()
+        ProductLineImporter("product_lines.csv", resolver).do_import(
+            to_lines(ProductLineImporter.header, [["New line"]])
+        )
+        rows = [self.sku_row(1), self.sku_row(2)]
+        for row in rows:
+            row[6] = "New line"
+        SkuImporter("skus.csv", resolver).do_import(
+            to_lines(SkuImporter.header, rows[:1])
+        )
+        stats = resolver.stats()
+        # The product line created earlier in the import is found without a query
+        self.assertEqual((1, 0), stats["ProductLine.name"])
+        self.assertEqual((0, 1), stats["Formula.number"])
+
+        with CaptureQueriesContext(connection) as queries:
+            SkuImporter("skus.csv", resolver).do_import(
+                to_lines(SkuImporter.header, rows[1:])
+            )
+        stats = resolver.stats()
+        self.assertEqual((2, 0), stats["ProductLine.name"])
+        self.assertEqual((1, 1), stats["Formula.number"])
+        self.assertEqual((2, 2), stats["ManufacturingLine.shortname"])
+        self.assertFalse(
+            any(
+                query["sql"].startswith('SELECT "meals_formula"."name"')
+                for query in queries.captured_queries
+            )
+        )
+        self.assertEqual(2, Sku.objects.filter(product_line__name="New line").count())
+
+
+class ImportTransactionTest(SkuImportTestCase):
+    def upload(self, rows):
+        content = "\n".join(to_lines(SkuImporter.header, rows)).encode()
+        return {"skus": SimpleUploadedFile("skus.csv", content)}
+
+    def test_staged_import(self):
+        sku = self.create_sku(formula=self.formula, product_line=self.product_line)
+        row = self.sku_row(sku.number, name="New name", upc=sku.case_upc.upc_number)
+        with self.assertRaises(CollisionOccurredException):
+            bulk_import.process_csv_files(
+                self.upload([row, self.sku_row(100)]), "session"
+            )
+        self.assertFalse(Sku.objects.filter(number=100).exists())
+
+        self.assertTrue(bulk_import.has_ongoing_transaction("session"))
+        self.assertFalse(bulk_import.has_ongoing_transaction("other session"))
+        collisions = bulk_import.get_transaction("session")["skus.csv"]
+        self.assertEqual(1, len(collisions))
+        self.assertEqual(str(sku.number), collisions[0]["pk"])
+        self.assertIn(["Name", "SKU #1", "New name"], collisions[0]["differences"])
+        tx = ImportTransaction.objects.get(session_key="session")
+        self.assertEqual(
+            len(tx.collisions) + sum(len(file.content) for file in tx.files.all()),
+            tx.size,
+        )
+
+        self.assertEqual(
+            ({"skus.csv": 1}, {"skus.csv": 1}, {"skus.csv": 0}),
+            bulk_import.force_save("session", force=True),
+        )
+        self.assertEqual("New name", Sku.objects.get(number=sku.number).name)
+        self.assertTrue(Sku.objects.filter(number=100).exists())
+        self.assertFalse(bulk_import.has_ongoing_transaction("session"))
+
+    def test_collisions_in_every_file(self):
+        sku = self.create_sku(formula=self.formula, product_line=self.product_line)
+        flour = Ingredient.objects.get(name="flour")
+        files = self.upload(
+            [self.sku_row(sku.number, name="New name", upc=sku.case_upc.upc_number)]
+        )
+        ingredients = [[flour.number, "flour", "New vendor", "1 kg", "$1.00", ""]]
+        files["ingredients"] = SimpleUploadedFile(
+            "ingredients.csv",
+            "\n".join(to_lines(IngredientImporter.header, ingredients)).encode(),
+        )
+        with self.assertRaises(CollisionOccurredException):
+            bulk_import.process_csv_files(files, "session")
+        collisions = bulk_import.get_transaction("session")
+        self.assertEqual({"ingredients.csv", "skus.csv"}, set(collisions))
+        self.assertIn(
+            ["Vendor", str(flour.vendor), "New vendor"],
+            collisions["ingredients.csv"][0]["differences"],
+        )
+        # Nothing is imported until the collisions of both files are reviewed
+        self.assertEqual(
+            flour.vendor.info, Ingredient.objects.get(pk=flour.pk).vendor.info
+        )
+
+        _, updated, _ = bulk_import.force_save("session", force=True)
+        self.assertEqual({"ingredients.csv": 1, "skus.csv": 1}, updated)
+        self.assertEqual("New vendor", Ingredient.objects.get(pk=flour.pk).vendor.info)
+        self.assertEqual("New name", Sku.objects.get(number=sku.number).name)
+
+    def test_changed_since_review(self):
+        sku = self.create_sku(formula=self.formula, product_line=self.product_line)
+        row = self.sku_row(sku.number, name="New name", upc=sku.case_upc.upc_number)
+        with self.assertRaises(CollisionOccurredException):
+            bulk_import.process_csv_files(
+                self.upload([row, self.sku_row(100)]), "session"
+            )
+        Sku.objects.filter(number=sku.number).update(comment="Changed meanwhile")
+        with self.assertRaisesRegex(UserFacingException, "changed since"):
+            bulk_import.force_save("session", force=True)
+        self.assertEqual("SKU #1", Sku.objects.get(number=sku.number).name)
+        self.assertFalse(Sku.objects.filter(number=100).exists())
+        self.assertFalse(bulk_import.has_ongoing_transaction("session"))
+
+    def test_decimal_differences(self):
+        sku = self.create_sku(
+            formula=self.formula,
+            product_line=self.product_line,
+            formula_scale=Decimal("1.5"),
+        )
+        row = self.sku_row(sku.number, name="New name", upc=sku.case_upc.upc_number)
+        with self.assertRaises(CollisionOccurredException):
+            bulk_import.process_csv_files(self.upload([row]), "session")
+        differences = bulk_import.get_transaction("session")["skus.csv"][0][
+            "differences"
+        ]
+        names = {name for name, _, _ in differences}
+        # 1.500000 in the database is the same as 1.5 in the file
+        self.assertNotIn(Sku._meta.get_field("formula_scale").verbose_name, names)
+        self.assertIn(["Manufacturing Rate", "1.000000", "10"], differences)
+
+    def test_expired(self):
+        sku = self.create_sku(formula=self.formula, product_line=self.product_line)
+        row = self.sku_row(sku.number, name="New name", upc=sku.case_upc.upc_number)
+        with self.assertRaises(CollisionOccurredException):
+            bulk_import.process_csv_files(self.upload([row]), "session")
+        ImportTransaction.objects.update(
+            create_time=timezone.now()
+            - timedelta(seconds=settings.IMPORT_TRANSACTION_TTL)
+        )
+        self.assertFalse(bulk_import.has_ongoing_transaction("session"))
+        self.assertEqual(({}, {}, {}), bulk_import.force_save("session", force=True))
+        self.assertEqual("SKU #1", Sku.objects.get(number=sku.number).name)
+
+    @override_settings(IMPORT_TRANSACTION_MAX_SIZE=10)
+    def test_too_large(self):
+        sku = self.create_sku(formula=self.formula, product_line=self.product_line)
+        row = self.sku_row(sku.number, name="New name", upc=sku.case_upc.upc_number)
+        with self.assertRaisesRegex(UserFacingException, "too large"):
+            bulk_import.process_csv_files(self.upload([row]), "session")
+        self.assertFalse(ImportTransaction.objects.exists())
+
+
+class ZipImportTest(SkuImportTestCase):
+    def test_import_zip(self):
+        self.create_ingredient("sugar")
+        formulas = to_lines(
+            FormulaImporter.header,
+            [["", "Cake", "1", "1 kg", ""], ["", "Cake", "2", "2 kg", ""]],
+        )
+        skus = to_lines(SkuImporter.header, [self.sku_row(1, name="Cake, large")])
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("import/formulas.csv", "\r\n".join(formulas))
+            zip_file.writestr("import/skus.csv", "\r\n".join(skus))
+        form = ImportForm(
+            {},
+            {"zip": SimpleUploadedFile("import.zip", archive.getvalue())},
+            session_key="session",
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        inserted, _ = form.cleaned_data
+        self.assertEqual({"Formula": 2, "SKU": 1}, dict(inserted))
+        formula = Formula.objects.get(name="Cake")
+        self.assertEqual(2, formula.formulaingredient_set.count())
+        self.assertEqual("Cake, large", Sku.objects.get(number=1).name)
+
+
+class IngredientImporterTest(BaseTestCase):
+    def test_import(self):
+        self.create_ingredient("flour")
+        rows = [
+            [number, f"ingr {i}", f"Vendor {i % 2}", "1 kg", "$1.00", ""]
+            for i, number in enumerate(["10", "11", "", "12"])
+        ]
+        importer = IngredientImporter("ingredients.csv")
+        result = importer.do_import(to_lines(IngredientImporter.header, rows))
+        self.assertEqual((4, 0, 0), result)
+        # Ingredients without a number are numbered after the largest one
+        self.assertEqual("2", Ingredient.objects.get(name="ingr 2").number)
+        # New vendors are created once each
+        self.assertEqual(
+            2, Vendor.objects.filter(info__in=["Vendor 0", "Vendor 1"]).count()
+        )
+
+    def test_formula_cost(self):
+        formula = self.create_formula(ingredients=["flour"])
+        self.assertEqual(Decimal(1), formula.ingredient_cost)
+        flour = Ingredient.objects.get(name="flour")
+        row = [flour.number, "flour", "Test vendor", "10 kg", "$20.00", ""]
+        importer = IngredientImporter("ingredients.csv")
+        with self.assertRaises(CollisionOccurredException):
+            importer.do_import(to_lines(IngredientImporter.header, [row]))
+        importer.commit()
+        self.assertEqual(Decimal(2), Formula.objects.get(pk=formula.pk).cost)
@@ -1,4 +1,17 @@
-from meals.models import Unit
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from meals.models import (
+    Formula,
+    FormulaIngredient,
+    Goal,
+    GoalItem,
+    Ingredient,
+    Unit,
+    User,
+)
 from .test_base import BaseTestCase
 
 
@@ -36,4 +49,84 @@ class ModelsTest(BaseTestCase):
 
         for test_case, msg in test_cases:
             with self.assertRaises(RuntimeError, msg=msg):
-                Unit.from_exp(test_case)
\ No newline at end of file
+                Unit.from_exp(test_case)
+
+    def test_unit_registry(self):
+        registry = Unit.registry()
+        gram = registry.get("g")
+        with self.assertNumQueries(0):
+            self.assertEqual((25.0, gram), Unit.from_exp("25 grams"))
+            self.assertEqual(gram.scale_factor, registry.scale_factor(gram.pk))
+            self.assertIs(registry, Unit.registry())
+        with self.assertRaises(Unit.DoesNotExist):
+            registry.get_or_raise("furlong")
+
+        # Saving a unit drops the registry, which is loaded again when next used
+        Unit.objects.get(symbol="g").save()
+        self.assertIsNot(registry, Unit.registry())
+
+    def test_ingredient_quantities(self):
+        flour, sugar = self.create_ingredient("flour"), self.create_ingredient("sugar")
+        cake = self.create_formula(ingredients=[flour, sugar])
+        bread = self.create_formula(ingredients=[flour])
+        FormulaIngredient.objects.filter(formula=bread).update(
+            quantity=500, unit=Unit.registry().get("g")
+        )
+        cake_sku = self.create_sku(formula=cake, formula_scale=2)
+        bread_sku = self.create_sku(formula=bread)
+        user = User.objects.create(username="user", netid="user")
+        goals = [
+            Goal.objects.create(name=name, user=user, deadline="2019-01-01")
+            for name in ("Goal 1", "Goal 2")
+        ]
+        GoalItem.objects.create(goal=goals[0], sku=cake_sku, quantity=3)
+        GoalItem.objects.create(goal=goals[0], sku=bread_sku, quantity=4)
+        GoalItem.objects.create(goal=goals[1], sku=cake_sku, quantity=1)
+
+        def quantities(goal_ids):
+            return {
+                Ingredient.objects.get(pk=pk).name: quantity
+                for pk, quantity in Goal.ingredient_quantities(goal_ids).items()
+            }
+
+        with self.assertNumQueries(1):
+            Goal.ingredient_quantities([goal.pk for goal in goals])
+        # Flour: 1 kg * 2 * (3 + 1) for cakes, and 500 g * 4 for bread
+        self.assertEqual(
+            {"flour": Decimal(10), "sugar": Decimal(8)},
+            quantities([goal.pk for goal in goals]),
+        )
+        self.assertEqual(
+            {"flour": Decimal(8), "sugar": Decimal(6)}, quantities([goals[0].pk])
+        )
+
+    def test_formula_cost(self):
+        flour, sugar = self.create_ingredient("flour"), self.create_ingredient("sugar")
+        cake = self.create_formula(ingredients=[flour, sugar])
+        bread = self.create_formula(ingredients=[flour])
+
+        def costs():
+            return Formula.ingredient_costs([cake.pk, bread.pk])
+
+        # 1 kg of each ingredient, which costs $10 for 10 kg
+        self.assertEqual({cake.pk: Decimal(2), bread.pk: Decimal(1)}, costs())
+
+        flour = Ingredient.objects.get(pk=flour.pk)
+        flour.comment = "Unrelated"
+        with CaptureQueriesContext(connection) as queries:
+            flour.save()
+        self.assertFalse(any("meals_formula" in q["sql"] for q in queries))
+        flour.cost = 20
+        flour.save()
+        self.assertEqual({cake.pk: Decimal(3), bread.pk: Decimal(2)}, costs())
+
+        FormulaIngredient.objects.get(formula=cake, ingredient=sugar).delete()
+        self.assertEqual(Decimal(2), Formula.objects.get(pk=cake.pk).ingredient_cost)
+        flour.delete()
+        self.assertEqual({cake.pk: Decimal(0), bread.pk: Decimal(0)}, costs())
+
+        # Costs which were never computed are computed when looked up
+        Formula.objects.update(cost=None)
+        self.assertEqual({cake.pk: Decimal(0), bread.pk: Decimal(0)}, costs())
+        with self.assertNumQueries(1):
+            costs()
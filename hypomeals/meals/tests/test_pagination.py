@@ -0,0 +1,63 @@
+from meals.models import Customer, Sale
+from meals.pagination import KeysetPaginator, approximate_count
+from .test_base import BaseTestCase
+
+ORDERING = ("year", "week", "customer_id", "id")
+
+
+class KeysetPaginatorTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sku = self.create_sku(ingredients=["flour"])
+        customers = [Customer.objects.create(id=i, name=f"C{i}") for i in (1, 2)]
+        Sale.objects.bulk_create(
+            Sale(
+                sku=self.sku, year=year, week=week, customer=customer, sales=1, price=1
+            )
+            for year in (2017, 2018)
+            for week in range(1, 6)
+            for customer in customers
+        )
+        self.expected = list(Sale.objects.order_by(*ORDERING))
+
+    def test_forward_and_back(self):
+        paginator = KeysetPaginator(Sale.objects.all(), 6, ORDERING)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(
+                paginator.page(
+                    pages[-1].next_page_number(), after=pages[-1].next_cursor
+                )
+            )
+        self.assertEqual([1, 2, 3, 4], [page.number for page in pages])
+        self.assertEqual(self.expected, [sale for page in pages for sale in page])
+        self.assertFalse(pages[0].has_previous())
+
+        # Walking back from the last page should retrieve the same pages
+        back = paginator.page(3, before=pages[-1].previous_cursor)
+        self.assertEqual(list(pages[2]), list(back))
+        self.assertTrue(back.has_next())
+        first = paginator.page(1, before=pages[1].previous_cursor)
+        self.assertEqual(list(pages[0]), list(first))
+        self.assertFalse(first.has_previous())
+
+    def test_single_page(self):
+        paginator = KeysetPaginator(Sale.objects.all(), None, ORDERING)
+        page = paginator.page()
+        self.assertEqual(self.expected, list(page))
+        self.assertFalse(page.has_next())
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Sale.objects.all(), 6, ORDERING)
+        with self.assertRaises(ValueError):
+            paginator.page(2, after="not a cursor")
+
+    def test_count(self):
+        self.assertIsInstance(approximate_count(Sale.objects.all()), int)
+        paginator = KeysetPaginator(Sale.objects.all(), 6, ORDERING)
+        self.assertEqual((20, False), (paginator.count, paginator.count_is_approximate))
+        # The planner's estimate is used when it exceeds the threshold
+        paginator = KeysetPaginator(
+            Sale.objects.all(), 6, ORDERING, approximate_count_threshold=0
+        )
+        self.assertTrue(paginator.count_is_approximate)
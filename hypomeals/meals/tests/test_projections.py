@@ -0,0 +1,58 @@
+import statistics
+from decimal import Decimal
+
+from meals.models import Customer, Sale, SalesRollup
+from meals.projections import SalesHistory, project_sales
+from .test_base import BaseTestCase
+
+
+class ProjectionTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = Customer.objects.create(id=1, name="Customer 1")
+
+    def create_sales(self, sku, rows):
+        Sale.objects.bulk_create(
+            Sale(
+                sku=sku,
+                year=year,
+                week=week,
+                customer=self.customer,
+                sales=sales,
+                price=1,
+            )
+            for year, week, sales in rows
+        )
+        for year in {row[0] for row in rows}:
+            SalesRollup.rebuild(sku, year)
+
+    def test_project(self):
+        sku = self.create_sku(ingredients=["flour"])
+        # Week 10 is within the window, week 30 is not
+        self.create_sales(
+            sku,
+            [(2015, 10, 10), (2016, 10, 20), (2017, 10, 30), (2018, 10, 40)]
+            + [(2015, 30, 30), (2016, 30, 20), (2017, 30, 10), (2018, 30, 40)],
+        )
+        with self.assertNumQueries(1):
+            projection = project_sales([sku.number], 2015, 2018, 5, 15)[sku.number]
+        yearly = [Decimal(10), Decimal(20), Decimal(30), Decimal(40)]
+        self.assertEqual(dict(zip(range(2015, 2019), yearly)), projection.yearly)
+        self.assertEqual(statistics.mean(yearly), projection.mean)
+        self.assertAlmostEqual(statistics.stdev(yearly), projection.std, places=5)
+        self.assertEqual(Decimal(10), projection.trend)
+        self.assertEqual(Decimal(50), projection.trend_projection)
+        # 1/4, 1/2, 3/4 and 1/2 of each year's sales fall within the window
+        self.assertEqual(Decimal("0.5"), projection.seasonality)
+
+    def test_batch(self):
+        skus = [self.create_sku(ingredients=[f"ingr {i}"]) for i in range(3)]
+        for i, sku in enumerate(skus[:2]):
+            self.create_sales(sku, [(2018, 1, i + 1)])
+        history = SalesHistory.load([sku.number for sku in skus], 2017, 2018)
+        self.assertEqual((3, 2, 53), history.sales.shape)
+        projections = history.project(1, 52)
+        self.assertEqual([sku.number for sku in skus], list(projections))
+        self.assertEqual(Decimal(2), projections[skus[1].number].yearly[2018])
+        self.assertIsNone(projections[skus[2].number].seasonality)
+        self.assertEqual(Decimal(0), projections[skus[2].number].mean)
@@ -0,0 +1,448 @@
+import threading
+import time
+from decimal import Decimal
+
+import redis
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from meals.forms import SaleFilterForm
+from meals.models import (
+    Customer,
+    Sale,
+    SalesFetchState,
+    SalesReadiness,
+    SalesRollup,
+    Sku,
+)
+from meals.sales import (
+    RateLimiter,
+    SalesException,
+    SalesFetcher,
+    SalesRow,
+    SharedRateLimiter,
+    ensure_customers,
+    parse_sales_rows,
+    query_sku_sales,
+    save_sku_sales,
+)
+from meals.sales_stub import make_server, generate_sales_html
+from meals.views.sales import _sales_summary, _sku_revenues
+from .test_base import BaseTestCase
+
+
+class SalesRollupTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sku = self.create_sku(ingredients=["flour"])
+        self.customers = [
+            Customer.objects.create(id=i, name=f"Customer {i}") for i in (1, 2)
+        ]
+
+    def create_sales(self, year, rows):
+        Sale.objects.bulk_create(
+            Sale(
+                sku=self.sku,
+                year=year,
+                week=week,
+                customer=self.customers[customer],
+                sales=sales,
+                price=price,
+            )
+            for week, customer, sales, price in rows
+        )
+
+    def test_rebuild(self):
+        """Rollup rows should be kept at the yearly, per-customer and weekly grains"""
+        self.create_sales(
+            2018, [(1, 0, 10, "1.50"), (1, 1, 20, "2.00"), (2, 0, 5, "1.00")]
+        )
+        self.assertEqual(5, SalesRollup.rebuild(self.sku, 2018))
+
+        rollups = SalesRollup.objects.filter(sku=self.sku, year=2018)
+        yearly = rollups.get(week__isnull=True, customer__isnull=True)
+        self.assertEqual(Decimal(35), yearly.sales)
+        self.assertEqual(Decimal("60"), yearly.revenue)
+        first_customer = rollups.get(week__isnull=True, customer=self.customers[0])
+        self.assertEqual(Decimal(15), first_customer.sales)
+        self.assertEqual(Decimal("20"), first_customer.revenue)
+        week_one = rollups.get(week=1, customer__isnull=True)
+        self.assertEqual(Decimal(30), week_one.sales)
+        self.assertEqual(Decimal("55"), week_one.revenue)
+
+    def test_rebuild_replaces_year(self):
+        """Rebuilding a year should only replace the rollup of that year"""
+        self.create_sales(2017, [(1, 0, 10, "1.00")])
+        self.create_sales(2018, [(1, 0, 10, "1.00")])
+        SalesRollup.rebuild(self.sku, 2017)
+        SalesRollup.rebuild(self.sku, 2018)
+
+        Sale.objects.filter(sku=self.sku, year=2018).delete()
+        self.assertEqual(0, SalesRollup.rebuild(self.sku, 2018))
+        self.assertFalse(SalesRollup.objects.filter(year=2018).exists())
+        self.assertEqual(3, SalesRollup.objects.filter(year=2017).count())
+
+
+class SalesSummaryTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = Customer.objects.create(id=1, name="Customer 1")
+
+    def create_sku_with_sales(self, rows):
+        sku = self.create_sku(ingredients=[f"Ingr for SKU {self.last_sku + 1}"])
+        Sale.objects.bulk_create(
+            Sale(
+                sku=sku,
+                year=year,
+                week=1,
+                customer=self.customer,
+                sales=sales,
+                price=price,
+            )
+            for year, sales, price in rows
+        )
+        for year in {row[0] for row in rows}:
+            SalesRollup.rebuild(sku, year)
+        # Reload so that decimal fields are not left as their float defaults
+        return Sku.objects.get(pk=sku.pk)
+
+    def test_summary(self):
+        sku = self.create_sku_with_sales([(2017, 10, "2.00"), (2018, 30, "1.00")])
+        (summary,) = _sales_summary([sku], None, 2010)
+        self.assertEqual(sku.number, summary[0])
+        self.assertEqual(Decimal(50), summary[2], "Total revenue mismatch")
+        self.assertEqual(Decimal(10), summary[3], "Default run size is 10 hours")
+        # The formula uses 1kg of an ingredient costing $10 per 10kg
+        self.assertEqual(Decimal(1), summary[4], "Ingredient cost mismatch")
+        self.assertEqual(Decimal("1.25"), summary[8], "Avg revenue mismatch")
+        self.assertEqual(
+            [(2017, sku.number, sku.name, Decimal(20), Decimal(2))],
+            summary[-1][:1],
+        )
+
+    def test_constant_queries(self):
+        """The number of queries should not depend on the number of SKUs"""
+        skus = [self.create_sku_with_sales([(2018, 10, "1.00")]) for _ in range(5)]
+        with self.assertNumQueries(3):
+            summaries = _sales_summary(skus, None, 2010)
+        self.assertEqual([sku.number for sku in skus], [s[0] for s in summaries])
+        with self.assertNumQueries(3):
+            _sales_summary(skus[:1], [self.customer], 2010)
+
+
+class SaleFilterFormTest(BaseTestCase):
+    def test_weekly_revenues(self):
+        sku = self.create_sku(ingredients=["flour"])
+        customers = [
+            Customer.objects.create(id=i, name=f"Customer {i}") for i in (1, 2)
+        ]
+        Sale.objects.bulk_create(
+            Sale(sku=sku, year=2018, week=week, customer=customer, sales=10, price=2)
+            for week in (1, 2, 30)
+            for customer in customers
+        )
+        SalesRollup.rebuild(sku, 2018)
+        params = {
+            "sku": sku.number,
+            "customer": "",
+            "page_num": 1,
+            "num_per_page": 50,
+            "start": "2018-01-01",
+            "end": "2018-06-01",
+        }
+        form = SaleFilterForm(params)
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.assertNumQueries(1):
+            revenues = form.weekly_revenues()
+        self.assertEqual([(2018, 1, Decimal(40)), (2018, 2, Decimal(40))], revenues)
+        form = SaleFilterForm({**params, "customer": "Customer 1"})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(
+            [(2018, 1, Decimal(20)), (2018, 2, Decimal(20))], form.weekly_revenues()
+        )
+
+
+class SaleQueryPlanTest(BaseTestCase):
+    """Guards against hot sales queries regressing to sequential scans"""
+
+    def setUp(self):
+        super().setUp()
+        self.sku = self.create_sku(ingredients=["flour"])
+        customer = Customer.objects.create(id=1, name="Customer 1")
+        Sale.objects.bulk_create(
+            Sale(
+                sku=self.sku,
+                year=year,
+                week=week,
+                customer=customer,
+                sales=10,
+                price=1,
+            )
+            for year in (2017, 2018)
+            for week in range(1, 53)
+        )
+        SalesRollup.rebuild(self.sku, 2017)
+        SalesRollup.rebuild(self.sku, 2018)
+        # The test tables are tiny, so make the planner pick an index if it can
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+
+    def explain(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN " + context.captured_queries[-1]["sql"])
+            return "\n".join(row[0] for row in cursor.fetchall())
+
+    def explain_sale_filter(self, customer):
+        form = SaleFilterForm(
+            {
+                "sku": self.sku.number,
+                "customer": customer,
+                "page_num": 1,
+                "num_per_page": 50,
+                "start": "2017-06-01",
+                "end": "2018-06-01",
+            }
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        return self.explain(lambda: list(form.query().page(1)))
+
+    def test_sale_filter_query(self):
+        plan = self.explain_sale_filter("")
+        self.assertIn("sale_sku_year_week_idx", plan)
+        self.assertNotIn("Sort", plan, "Sales should be read in index order")
+        # Either composite index suits a filter on customers, depending on costs
+        plan = self.explain_sale_filter("Customer 1")
+        self.assertRegex(plan, r"sale_sku_(year_week|customer_year)_idx")
+        self.assertNotIn("Seq Scan on meals_sale", plan)
+
+    def test_sku_revenues_query(self):
+        plan = self.explain(lambda: _sku_revenues([self.sku], None, 2010))
+        self.assertNotIn("Seq Scan", plan)
+        self.assertIn("meals_salesrollup", plan)
+
+
+class SalesFetcherTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = make_server(num_customers=3)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(20)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2 - 0.01)
+
+    def test_shared_rate_limiter(self):
+        # Nothing listens on port 1, so only this process is limited
+        limiter = SharedRateLimiter(20, "redis://127.0.0.1:1/0", "test-rate-limit")
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.2 - 0.01)
+        try:
+            redis.Redis.from_url(settings.CELERY_BROKER_URL).delete("test-rate-limit")
+        except redis.RedisError:
+            self.skipTest("Redis is not available")
+        # Limiters in different processes share their slots through Redis
+        limiters = [
+            SharedRateLimiter(20, settings.CELERY_BROKER_URL, "test-rate-limit")
+            for _ in range(2)
+        ]
+        start = time.monotonic()
+        for i in range(6):
+            limiters[i % 2].wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.25 - 0.01)
+
+    def test_fetch_many(self):
+        fetcher = SalesFetcher(
+            url=self.url,
+            max_workers=4,
+            session=requests.Session(),
+            rate_limiter=RateLimiter(),
+        )
+        pairs = [(sku, year) for sku in (1, 2, 3) for year in (2017, 2018)]
+        results = list(fetcher.fetch_many(pairs + [(1, "bad")]))
+        self.assertEqual(len(pairs) + 1, len(results))
+        fetched = {pair for pair, data, error in results if error is None}
+        self.assertEqual(set(pairs), fetched)
+        for (_, year), data, error in results:
+            if error is None:
+                self.assertEqual(3 * 52, len(data.rows))
+                self.assertEqual({year}, {row.year for row in data.rows})
+                self.assertEqual(64, len(data.digest))
+
+    def test_query_sku_sales(self):
+        sku = self.create_sku(ingredients=["flour"])
+        with override_settings(SALES_INTERFACE_URL=self.url):
+            self.assertEqual(3 * 52, query_sku_sales(sku.number, 2018))
+        self.assertEqual(3 * 52, Sale.objects.filter(sku=sku, year=2018).count())
+        self.assertEqual(3, Customer.objects.count())
+        self.assertTrue(SalesRollup.objects.filter(sku=sku, year=2018).exists())
+
+    def test_incremental_refresh(self):
+        sku = self.create_sku(ingredients=["flour"])
+        with override_settings(SALES_INTERFACE_URL=self.url):
+            self.assertEqual(3 * 52, query_sku_sales(sku.number, 2018))
+            state = SalesFetchState.objects.get(sku=sku, year=2018)
+            self.assertEqual((2018, 52), state.high_water_mark)
+            # An identical response should not touch the Sale table: only the SKU
+            # is checked (before and after fetching) and the fetch state is read
+            with self.assertNumQueries(3):
+                self.assertEqual(0, query_sku_sales(sku.number, 2018, incremental=True))
+
+    def test_incremental_save(self):
+        sku = self.create_sku(ingredients=["flour"])
+        rows = [
+            SalesRow(2018, week, 1, "Customer 1", Decimal(10), Decimal(1))
+            for week in (1, 2, 3)
+        ]
+        save_sku_sales(sku.number, 2018, rows, digest="a")
+        first_week = Sale.objects.get(sku=sku, week=1)
+        # Only weeks that changed should be replaced
+        rows.append(SalesRow(2018, 4, 1, "Customer 1", Decimal(5), Decimal(1)))
+        self.assertEqual(
+            1, save_sku_sales(sku.number, 2018, rows, digest="b", incremental=True)
+        )
+        self.assertTrue(Sale.objects.filter(pk=first_week.pk).exists())
+        self.assertEqual(4, Sale.objects.filter(sku=sku, year=2018).count())
+        state = SalesFetchState.objects.get(sku=sku, year=2018)
+        self.assertEqual(("b", 4), (state.digest, state.last_week))
+        yearly = SalesRollup.objects.get(
+            sku=sku, year=2018, week__isnull=True, customer__isnull=True
+        )
+        self.assertEqual(Decimal(35), yearly.sales)
+
+    def test_incremental_save_corrects_earlier_weeks(self):
+        sku = self.create_sku(ingredients=["flour"])
+        rows = [
+            SalesRow(2018, week, 1, "Customer 1", Decimal(10), Decimal(1))
+            for week in (1, 2, 3)
+        ]
+        save_sku_sales(sku.number, 2018, rows, digest="a")
+        # A correction to the first week, and the second week withdrawn
+        rows = [rows[0]._replace(sales=Decimal(20)), rows[2]]
+        self.assertEqual(
+            1, save_sku_sales(sku.number, 2018, rows, digest="b", incremental=True)
+        )
+        self.assertEqual(
+            [(1, Decimal(20)), (3, Decimal(10))],
+            list(
+                Sale.objects.filter(sku=sku, year=2018)
+                .order_by("week")
+                .values_list("week", "sales")
+            ),
+        )
+        self.assertEqual("b", SalesFetchState.objects.get(sku=sku, year=2018).digest)
+        # Fetching the same data again should find nothing to change
+        self.assertEqual(
+            0, save_sku_sales(sku.number, 2018, rows, digest="c", incremental=True)
+        )
+        yearly = SalesRollup.objects.get(
+            sku=sku, year=2018, week__isnull=True, customer__isnull=True
+        )
+        self.assertEqual(Decimal(30), yearly.sales)
+
+    def test_sales_readiness(self):
+        cache.clear()
+        skus = [self.create_sku(ingredients=[f"ingr {i}"]) for i in range(2)]
+        self.assertEqual(2, SalesReadiness.pending().count())
+        self.assertEqual(2, SalesReadiness.pending_count())
+        this_year = timezone.now().year
+        for year in range(settings.SALES_YEAR_START, this_year + 1):
+            save_sku_sales(skus[0].number, year, [])
+        # Fetching a year again must not count it twice
+        save_sku_sales(skus[0].number, this_year, [])
+        self.assertTrue(Sku.objects.get(pk=skus[0].pk).sales_ready)
+        self.assertFalse(skus[1].sales_ready)
+        with self.assertNumQueries(1):
+            self.assertEqual([skus[1]], list(SalesReadiness.pending()))
+        with self.assertNumQueries(1):
+            self.assertFalse(SalesReadiness.all_ready())
+        # The count is tracked without counting SKUs again
+        self.create_sku(ingredients=["ingr 2"])
+        with self.assertNumQueries(0):
+            self.assertEqual(2, SalesReadiness.pending_count())
+
+    def test_ensure_customers(self):
+        Customer.objects.create(id=1, name="Customer 1")
+        customers = {number: f"Customer {number}" for number in range(1, 101)}
+        # One query for existing customers, and one insert for the missing ones
+        with self.assertNumQueries(2):
+            self.assertEqual(100, ensure_customers(customers))
+        self.assertEqual(
+            set(customers.items()), set(Customer.objects.values_list("id", "name"))
+        )
+
+    def test_ensure_customers_name_conflict(self):
+        Customer.objects.create(id=1, name="Customer 1")
+        with self.assertRaisesRegex(SalesException, r"#2 .* #1: Customer 1"):
+            ensure_customers({2: "Customer 1"})
+        with self.assertRaisesRegex(SalesException, r"#4 .* #3: Customer 3"):
+            ensure_customers({3: "Customer 3", 4: "Customer 3"})
+        self.assertEqual([1], list(Customer.objects.values_list("id", flat=True)))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+
+class SalesParserTest(BaseTestCase):
+    def test_parse_rows(self):
+        html = generate_sales_html(42, 2018, num_customers=2, num_weeks=3).encode()
+        # Chunk boundaries should not matter
+        chunks = [html[i : i + 7] for i in range(0, len(html), 7)]
+        rows = list(parse_sales_rows(chunks))
+        self.assertEqual(6, len(rows))
+        self.assertEqual([(1, 1), (1, 2), (2, 1)], [r[1:3] for r in rows[:3]])
+        self.assertIsInstance(rows[0], SalesRow)
+        self.assertEqual("Customer 2", rows[1].customer_name)
+        self.assertIsInstance(rows[0].price, Decimal)
+
+    def test_header_order(self):
+        html = (
+            b"<html><body><table>"
+            b"<tr><td>price/case</td><td>sales</td><td>cust_name</td>"
+            b"<td>cust#</td><td>week</td><td>year</td></tr>"
+            b"<tr><td> 1.50 </td><td>10</td><td>Foo</td><td>7</td><td>3</td>"
+            b"<td>2019</td></tr>"
+            b"</table></body></html>"
+        )
+        self.assertEqual(
+            [SalesRow(2019, 3, 7, "Foo", Decimal(10), Decimal("1.50"))],
+            list(parse_sales_rows([html])),
+        )
+
+    def test_malformed_row(self):
+        html = (
+            b"<table><tr><td>year</td><td>week</td><td>cust#</td><td>cust_name</td>"
+            b"<td>sales</td><td>price/case</td></tr>"
+            b"<tr><td>2019</td><td>1</td><td>7</td><td>Foo</td><td>10</td>"
+            b"<td>1.50</td></tr>"
+            b"<tr><td>2019</td><td>2</td><td>7</td><td>Foo</td><td>N/A</td>"
+            b"<td>1.50</td></tr>"
+            b"</table>"
+        )
+        rows = parse_sales_rows([html])
+        self.assertEqual(1, next(rows).week)
+        with self.assertRaisesRegex(SalesException, r"'N/A'.*'sales'.*#2"):
+            next(rows)
+        html = html.replace(b"<td>2</td>", b"<td></td>")
+        with self.assertRaisesRegex(SalesException, r"'week' of sales record #2"):
+            list(parse_sales_rows([html]))
+
+    def test_missing_table(self):
+        with self.assertRaises(SalesException):
+            list(parse_sales_rows([b"<html><body><p>Not found</p></body></html>"]))
+        with self.assertRaises(SalesException):
+            list(parse_sales_rows([b"<table><tr><td>year</td></tr></table>"]))
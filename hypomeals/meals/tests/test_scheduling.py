@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from django.utils import timezone
+
+from meals.scheduling import FreeBlocks
+from .test_base import BaseTestCase
+
+
+class FreeBlocksTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        tz = timezone.get_current_timezone()
+        self.time = lambda day, hour: tz.localize(datetime(2019, 2, day, hour, 0, 0))
+        # 2, 10 and 5 work hours, on Feb 21, 22 and 23
+        self.blocks = FreeBlocks(
+            [
+                (self.time(21, 8), self.time(21, 10)),
+                (self.time(22, 8), self.time(22, 18)),
+                (self.time(23, 13), self.time(23, 18)),
+            ]
+        )
+
+    def test_earliest_fit(self):
+        """The earliest block long enough for an item should be found"""
+        self.assertEqual(0, self.blocks.earliest_fit(2))
+        self.assertEqual(1, self.blocks.earliest_fit(3))
+        self.assertIsNone(self.blocks.earliest_fit(11))
+        self.blocks.update(1, self.time(22, 15), self.time(22, 18))
+        self.assertEqual(2, self.blocks.earliest_fit(4))
+        self.blocks.update(0, self.time(21, 10), self.time(21, 10))
+        self.assertEqual(1, self.blocks.earliest_fit(1))
+
+    def test_latest_fit(self):
+        """The latest start before a deadline should be found"""
+        self.assertEqual(
+            (2, self.time(23, 15)), self.blocks.latest_fit(3, self.time(23, 18))
+        )
+        # Only the part of a block before the deadline counts
+        self.assertEqual(
+            (1, self.time(22, 15)), self.blocks.latest_fit(3, self.time(23, 14))
+        )
+        self.assertEqual(
+            (1, self.time(22, 13)), self.blocks.latest_fit(3, self.time(22, 16))
+        )
+        self.assertEqual(
+            (0, self.time(21, 8)), self.blocks.latest_fit(2, self.time(22, 9))
+        )
+        self.assertIsNone(self.blocks.latest_fit(3, self.time(22, 10)))
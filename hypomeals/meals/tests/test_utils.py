@@ -133,3 +133,35 @@ class UtilsTest(BaseTestCase):
             print("end:     ", end_time.strftime("%Y-%m-%d %H:%M:%S %Z%z"))
             print("expected:", expected.strftime("%Y-%m-%d %H:%M:%S %Z%z"))
             self.assertEqual(end_time, expected, msg)
+
+    def test_downsample(self):
+        """Downsampling should keep the endpoints and any spikes"""
+        points = [(x, 1.0) for x in range(100)]
+        points[37] = (37, 50.0)
+        points[71] = (71, -50.0)
+        selected = utils.downsample(points, 10)
+        self.assertEqual(10, len(selected))
+        self.assertEqual(sorted(selected), selected)
+        self.assertEqual((0, 99), (selected[0], selected[-1]))
+        self.assertIn(37, selected)
+        self.assertIn(71, selected)
+        self.assertEqual([0, 1], utils.downsample(points[:2], 10))
+
+    def test_compute_work_hours(self):
+        """Counting work hours should undo compute_end_time()"""
+        tz = timezone.get_current_timezone()
+        for start_hour in (1, 8, 9, 18, 20):
+            start_time = tz.localize(datetime(2019, 2, 21, start_hour, 0, 0))
+            for hours in (0.5, 4, 10, 10.5, 24):
+                end_time = utils.compute_end_time(start_time, hours)
+                self.assertAlmostEqual(
+                    hours, utils.compute_work_hours(start_time, end_time)
+                )
+        start_time = tz.localize(datetime(2019, 2, 21, 9, 0, 0))
+        self.assertEqual(0, utils.compute_work_hours(start_time, start_time))
+        self.assertEqual(
+            0,
+            utils.compute_work_hours(
+                start_time, tz.localize(datetime(2019, 2, 20, 9, 0, 0))
+            ),
+        )
@@ -24,6 +24,7 @@ urlpatterns = [
     path("sales/summary/", views.sales_summary, name="sales_summary"),
     path("sales/drilldown/<int:sku_pk>", views.sales_drilldown, name="drilldown"),
     path("sales/sales-projection", views.sales_projection, name="sales_projection"),
+    path("sales/sales-projections", views.sales_projections, name="sales_projections"),
     path("ac-customers", views.autocomplete_customers, name="autocomplete_customers"),
     # SKU views
     path("sku", views.sku, name="sku"),
@@ -73,6 +74,8 @@ urlpatterns = [
     path("import/", views.import_page, name="import"),
     path("import/success/", views.import_success, name="import_success"),
     path("import/collision/", views.collision, name="collision"),
+    path("export/status/<int:job_id>", views.export_status, name="export_status"),
+    path("export/download/<int:job_id>", views.export_download, name="export_download"),
     # Manufacturing goal views
     path("goal/new/", views.edit_goal, name="add_goal"),
     path("goal/<int:goal_id>", views.edit_goal, name="edit_goal"),
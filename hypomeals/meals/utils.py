@@ -11,7 +11,7 @@ from collections import defaultdict
 from datetime import datetime, timedelta, time as dtime
 from decimal import Decimal
 from functools import wraps
-from typing import Type, Tuple, Callable
+from typing import Type, Tuple, Callable, List, Sequence
 
 import magic
 from django.conf import settings
@@ -526,6 +526,29 @@ def compute_end_time(start_time: datetime, num_hours: float) -> datetime:
     return end_time
 
 
+def _work_hours_to(moment: datetime) -> float:
+    """
+    :return: the number of work hours from a fixed point in the past to a moment
+    """
+    moment = moment.astimezone(timezone.get_current_timezone())
+    day_start = _get_localized_time_for_date(moment, WORK_HOURS_START)
+    hours_into_day = (moment - day_start).total_seconds() / SECONDS_PER_HOUR
+    return moment.toordinal() * WORK_HOURS_PER_DAY + min(
+        max(hours_into_day, 0), WORK_HOURS_PER_DAY
+    )
+
+
+def compute_work_hours(start_time: datetime, end_time: datetime) -> float:
+    """
+    Computes the number of work hours of manufacturing lines between two times, i.e.,
+    the inverse of compute_end_time().
+    :param start_time: the start of the time span
+    :param end_time: the end of the time span
+    :return: the number of work hours, or 0 if end_time is before start_time
+    """
+    return max(_work_hours_to(end_time) - _work_hours_to(start_time), 0)
+
+
 def compute_start_time(end_time: datetime, num_hours: float) -> datetime:
     """
     Computes manufacturing start time, taking into consideration work hours of
@@ -606,6 +629,62 @@ def chunked_read(file, chunk_size=1024):
         yield data
 
 
+def chunked(iterable, chunk_size):
+    """
+    Splits an iterable into lists of at most chunk_size items
+    :param iterable: any iterable
+    :param chunk_size: the maximum number of items in each chunk
+    :return: a generator of lists
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def downsample(points: Sequence[Tuple[float, float]], threshold: int) -> List[int]:
+    """
+    Picks a subset of points that preserves the shape of a line chart, using the
+    Largest-Triangle-Three-Buckets algorithm. Unlike taking every k-th point, peaks
+    and troughs are kept. The first and last points are always kept.
+    :param points: (x, y) pairs, sorted by x
+    :param threshold: the maximum number of points to keep
+    :return: the sorted indices of the points kept
+    """
+    num_points = len(points)
+    if threshold >= num_points:
+        return list(range(num_points))
+    if threshold < 3:
+        raise ValueError("At least 3 points must be kept")
+    # Every point but the first and last falls into one of (threshold - 2) buckets
+    bucket_size = (num_points - 2) / (threshold - 2)
+    selected = [0]
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        # The third vertex is the average of the next bucket (or the last point)
+        next_start, next_end = end, min(int((bucket + 2) * bucket_size) + 1, num_points)
+        next_points = points[next_start:next_end]
+        avg_x = sum(x for x, _ in next_points) / len(next_points)
+        avg_y = sum(y for _, y in next_points) / len(next_points)
+        prev_x, prev_y = points[selected[-1]]
+        best, best_area = start, -1
+        for i in range(start, end):
+            x, y = points[i]
+            area = abs(
+                (prev_x - avg_x) * (y - prev_y) - (prev_x - x) * (avg_y - prev_y)
+            )
+            if area > best_area:
+                best, best_area = i, area
+        selected.append(best)
+    selected.append(num_points - 1)
+    return selected
+
+
 def parse_usd(expression: str) -> float:
     match = USD_EXP_REGEX.fullmatch(expression)
     if not match:
@@ -1,46 +1,39 @@
 # pylint: disable-msg=protected-access
 import logging
+from typing import Dict, Any
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models.fields.related import RelatedField
-from django.shortcuts import render, redirect
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404
+from django.shortcuts import render, redirect, get_object_or_404
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
-from meals import auth
+from meals import auth, utils
+from meals.bulk_export import ASYNC_EXPORTS, export_job_status
 from meals.bulk_import import (
     has_ongoing_transaction,
     get_transaction,
     clear_transaction,
     force_save,
 )
-from meals.importers import CollisionOccurredException, CollisionException
+from meals.importers import CollisionOccurredException
+from meals.models import ExportJob
 from ..forms import ImportForm
 
 logger = logging.getLogger(__name__)
 
 
-def _render_collision(collision: CollisionException):
-    """Renders a collision as two table entries (<td>s)"""
-    old, new = collision.old_instance, collision.new_instance
-    if not new.pk:
-        new.pk = "<Autogenerated>"
-    differences = {}
-    for field in old._meta.fields:
-        if field.primary_key:
-            continue
-        old_value = getattr(old, field.name, None)
-        new_value = getattr(new, field.name, None)
-        if isinstance(field, RelatedField):
-            old_value = str(old_value)
-            new_value = str(new_value)
-        if old_value != new_value:
-            differences[field.verbose_name] = (old_value, new_value)
-
+def _render_collision(collision: Dict[str, Any]):
+    """
+    Renders a collision as two table entries (<td>s)
+    :param collision: a summary of the collision, as returned by summarize_collision()
+    """
     old_ul = ""
     new_ul = ""
-    for field_name, (old_value, new_value) in differences.items():
+    for field_name, old_value, new_value in collision["differences"]:
         if not old_value:
             old_value = "<empty>"
         if not new_value:
@@ -51,7 +44,7 @@ def _render_collision(collision: CollisionException):
     new_ul = format_html("<ul>{}</ul>", mark_safe(new_ul))
     return format_html(
         "<td>{}</td><td>{}</td><td>{}</td>",
-        old.pk,
+        collision["pk"],
         mark_safe(old_ul),
         mark_safe(new_ul),
     )
@@ -114,7 +107,7 @@ def collision(request):
         rendered_transaction = []
         total_conflicts = 0
         for filename in sorted(transaction.keys()):
-            collisions = transaction[filename].collisions
+            collisions = transaction[filename]
             total_conflicts += len(collisions)
             rendered_transaction.append(
                 (filename, [_render_collision(c) for c in collisions])
@@ -171,3 +164,29 @@ def import_success(request, inserted=None, updated=None, ignored=None):
         },
     )
     return response
+
+
+def _get_export_job(request, job_id):
+    job = get_object_or_404(ExportJob, pk=job_id)
+    if not request.user.has_perms(ASYNC_EXPORTS[job.kind].perms):
+        raise PermissionDenied("You do not have permission to view this export.")
+    return job
+
+
+@login_required
+@utils.ajax_view
+def export_status(request, job_id):
+    return {"error": None, "resp": export_job_status(_get_export_job(request, job_id))}
+
+
+@login_required
+def export_download(request, job_id):
+    job = _get_export_job(request, job_id)
+    if job.status != ExportJob.SUCCESS:
+        raise Http404("The export is not ready yet.")
+    return FileResponse(
+        default_storage.open(job.path, "rb"),
+        as_attachment=True,
+        filename=job.filename,
+        content_type=job.content_type,
+    )
@@ -40,6 +40,7 @@ def add_formula(request):
                     saved.append(form.save(instance, commit=False))
                 if saved:
                     FormulaIngredient.objects.bulk_create(saved)
+                Formula.update_costs([instance.pk])
             messages.info(request, f"Successfully inserted {len(saved)} ingredients.")
             message = f"Formula '{instance.name}' added successfully"
             if request.is_ajax():
@@ -143,6 +144,7 @@ def edit_formula(request, formula_number):
                     saved.append(form.save(formula, commit=False))
                 if saved:
                     FormulaIngredient.objects.bulk_create(saved)
+                Formula.update_costs([formula.pk])
             messages.info(request, f"Successfully inserted {len(saved)} ingredients.")
             message = f"Formula '{formula.name}' edited successfully"
             if request.is_ajax():
@@ -1,10 +1,9 @@
 # pylint: disable-msg=unexpected-keyword-arg
 
-import csv
+import itertools
 import json
 import logging
 import operator
-import tempfile
 import time
 from decimal import Decimal
 
@@ -13,12 +12,13 @@ from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 from django.db import transaction
 from django.db.models import Q
-from django.http import HttpResponse, JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.utils import timezone
 from django.utils.datetime_safe import datetime
 
 from meals import auth, scheduling, utils
+from meals.bulk_export import stream_csv
 from meals.constants import WORK_HOURS_END
 from meals.exceptions import UserFacingException
 from meals.forms import (
@@ -34,7 +34,9 @@ from meals.models import (
     GoalItem,
     GoalSchedule,
     FormulaIngredient,
+    Ingredient,
     ManufacturingLine,
+    Unit,
 )
 from meals.utils import SortedDefaultDict
 
@@ -137,34 +139,27 @@ def edit_goal(request, goal_id=-1):
 )
 def export_csv(_, goal_id):  # placeholder for the "request" instance we are not using
     goal = get_object_or_404(Goal, pk=goal_id)
-    items = goal.details.all()
-    tf = tempfile.mktemp()
-    with open(tf, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["SKU#", "SKU Name", "SKU Quantity"])
-        for item in items:
-            writer.writerow([item.sku.number, item.sku.verbose_name, item.quantity])
-    resp = HttpResponse(open(tf).read(), content_type="text/csv")
+    items = goal.details.select_related("sku")
+    rows = itertools.chain(
+        [["SKU#", "SKU Name", "SKU Quantity"]],
+        (
+            [item.sku.number, item.sku.verbose_name, item.quantity]
+            for item in items.iterator()
+        ),
+    )
+    resp = StreamingHttpResponse(stream_csv(rows), content_type="text/csv")
     resp["Content-Disposition"] = f"attachment;filename=goal_{goal.name}.csv"
     return resp
 
 
-def _calculate_report(goal, result=None):
+def _calculate_report(goals):
     # Result is always in packages
-    if result is None:
-        result = SortedDefaultDict(lambda: Decimal(0.0), key=operator.attrgetter("pk"))
-    for item in goal.details.all():
-        for formula_item in item.sku.formula.formulaingredient_set.all():
-            unit_scale = (
-                formula_item.unit.scale_factor
-                / formula_item.ingredient.unit.scale_factor
-            )
-            result[formula_item.ingredient] += (
-                formula_item.quantity
-                * item.sku.formula_scale
-                * unit_scale
-                * item.quantity
-            )
+    result = SortedDefaultDict(lambda: Decimal(0.0), key=operator.attrgetter("pk"))
+    quantities = Goal.ingredient_quantities([goal.pk for goal in goals])
+    units = Unit.registry()
+    for ingredient in Ingredient.objects.filter(pk__in=quantities):
+        ingredient.unit = units.by_id(ingredient.unit_id)
+        result[ingredient] = quantities[ingredient.pk]
     logger.info("Report: %s", result)
     return result
 
@@ -178,7 +173,7 @@ def _calculate_report(goal, result=None):
 def view_calculations(request, goal_id):
     to_print = request.GET.get("print", "0") == "1"
     goal = get_object_or_404(Goal, pk=goal_id)
-    report = _calculate_report(goal)
+    report = _calculate_report([goal])
     return render(
         request,
         template_name="meals/goal/report.html",
@@ -188,23 +183,21 @@ def view_calculations(request, goal_id):
 
 def _generate_calculation(request, goal_id, output_format="csv"):
     goal = get_object_or_404(Goal, pk=goal_id)
-    report = _calculate_report(goal)
+    report = _calculate_report([goal])
     if output_format.casefold() == "csv":
-        tf = tempfile.mktemp()
-        with open(tf, "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(["Ingr#", "Name", "Amount (packages)", "Amount"])
-            for ingr, amount in report.items():
-                total_amount = round(amount * ingr.size, 2)
-                writer.writerow(
-                    [
-                        ingr.number,
-                        ingr.name,
-                        round(amount, 2),
-                        f"{total_amount} {ingr.unit.symbol}",
-                    ]
-                )
-        response = HttpResponse(open(tf).read(), content_type="text/csv")
+        rows = itertools.chain(
+            [["Ingr#", "Name", "Amount (packages)", "Amount"]],
+            (
+                [
+                    ingr.number,
+                    ingr.name,
+                    round(amount, 2),
+                    f"{round(amount * ingr.size, 2)} {ingr.unit.symbol}",
+                ]
+                for ingr, amount in report.items()
+            ),
+        )
+        response = StreamingHttpResponse(stream_csv(rows), content_type="text/csv")
         response["Content-Disposition"] = f"attachment;filename={goal.name}_report.csv"
     else:
         messages.error(request, f"Unsupported format: {output_format}")
@@ -424,9 +417,7 @@ def schedule_report(request):
     ingredients = FormulaIngredient.objects.filter(formula_id__in=formula_ids)
     goal_ids = set(schedules.values_list("goal_item__goal", flat=True))
     goal_objs = Goal.objects.filter(pk__in=goal_ids)
-    result = SortedDefaultDict(lambda: Decimal(0.0), key=operator.attrgetter("pk"))
-    for goal in goal_objs:
-        _calculate_report(goal, result=result)
+    result = _calculate_report(goal_objs)
     return render(
         request,
         template_name="meals/goal/schedule_report.html",
@@ -13,7 +13,7 @@ from django.views.decorators.http import require_POST
 
 from meals import auth
 from meals.forms import IngredientFilterForm, EditIngredientForm
-from meals.models import Ingredient
+from meals.models import Formula, Ingredient
 from ..bulk_export import export_ingredients, generate_ingredient_dependency_report
 
 logger = logging.getLogger(__name__)
@@ -131,7 +131,9 @@ def remove_ingredients(request):
     to_remove = jsonpickle.loads(request.POST.get("to_remove", "[]"))
     try:
         with transaction.atomic():
+            formula_numbers = list(Formula.using_ingredients(to_remove))
             _, deleted = Ingredient.objects.filter(pk__in=to_remove).delete()
+            Formula.update_costs(formula_numbers)
             num_deleted = deleted["meals.Ingredient"]
         return JsonResponse(
             {"error": None, "resp": f"Successfully removed {num_deleted} Ingredients"}
@@ -1,8 +1,6 @@
 #pylint: disable-msg=too-many-branches
 import json
 import logging
-import operator
-import statistics
 import time
 from collections import defaultdict
 from datetime import datetime, timedelta
@@ -10,7 +8,8 @@ from decimal import Decimal
 
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.db.models import Sum, F
+from django.db.models import Sum, Count
+from django.http import JsonResponse
 from django.shortcuts import render
 from django.template.loader import render_to_string
 
@@ -18,8 +17,21 @@ from meals import auth, utils
 from meals.constants import SALES_WAIT_TIME_MINUTES
 from meals.exceptions import UserFacingException
 from meals.forms import SaleFilterForm, ProductLineFilterForm, ProjectionsFilterForm
-from meals.models import Sku, Sale, ProductLine, Customer, GoalItem
-from meals.bulk_export import export_drilldown, export_sales_summary
+from meals.models import (
+    Sku,
+    SalesRollup,
+    SalesReadiness,
+    ProductLine,
+    Customer,
+    GoalItem,
+    Formula,
+)
+from meals.bulk_export import (
+    export_drilldown,
+    export_job_status,
+    export_sales_summary,
+    run_export_async,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -46,10 +58,6 @@ def sales_drilldown(request, sku_pk):
         body = request.POST.copy()
         body["sku"] = sku.number
         form = SaleFilterForm(body)
-        if form.is_valid():
-            sales = form.query()
-        else:
-            sales = Paginator([], 50)
     else:
         sku = Sku.objects.get(pk=sku_pk)
         params = {
@@ -65,28 +73,21 @@ def sales_drilldown(request, sku_pk):
             params["customer"] = customer_name
 
         form = SaleFilterForm(params)
-        if form.is_valid():
-            sales = form.query()
-        else:
-            sales = Paginator([], 50)
-    page = getattr(form, "cleaned_data", {"page_num": 1}).get("page_num", 1)
-    if page > sales.num_pages:
-        page = 1
-        form.initial["page_num"] = 1
-    revenues = defaultdict(lambda: Decimal(0))
-    for sale in sales.object_list:
-        iso_week = f"{sale.year}/{sale.week}"
-        revenues[iso_week] += sale.revenue
+    if form.is_valid():
+        sales = form.query()
+        if export:
+            return export_drilldown(sales.object_list)
+        page = form.page(sales)
+        revenues = form.weekly_revenues()
+    else:
+        page = Paginator([], 50).page(1)
+        revenues = []
     end = time.time()
-    if export:
-        return export_drilldown(sales.object_list)
-    page_start = max(page - 3, 1)
-    page_end = min(page + 4, sales.num_pages + 1)
-
-    x_axis, y_axis = list(revenues.keys()), list(revenues.values())
-    if len(x_axis) > GRAPH_DATA_POINTS:
-        x_axis = x_axis[:: int(len(x_axis) / GRAPH_DATA_POINTS)]
-        y_axis = y_axis[:: int(len(y_axis) / GRAPH_DATA_POINTS)]
+
+    points = [(year * 53 + week, float(revenue)) for year, week, revenue in revenues]
+    chart = [revenues[i] for i in utils.downsample(points, GRAPH_DATA_POINTS)]
+    x_axis = [f"{year}/{week}" for year, week, _ in chart]
+    y_axis = [revenue for _, _, revenue in chart]
     now = datetime.now()
     end_year = now.year
     begin_year = end_year - 9
@@ -94,38 +95,27 @@ def sales_drilldown(request, sku_pk):
     if customer_names:
         customers = Customer.objects.filter(name__in=customer_names)
     else:
-        customers = Customer.objects.all()
-    rev_sum, num_sales, sku_ten_year = _sku_revenue(sku, customers, begin_year)
-    sku_summary_report = [_sku_summary(sku, rev_sum, num_sales, sku_ten_year)]
+        customers = None
+    sku_summary_report = _sales_summary([sku], customers, begin_year)
     return render(
         request,
         template_name="meals/sales/drilldown.html",
         context={
             "sku": sku,
-            "sales": sales.page(page),
+            "sales": page,
             "chart_data_x": json.dumps(x_axis),
             "chart_data_y": json.dumps([str(y) for y in y_axis]),
             "form": form,
-            "pages": range(page_start, page_end),
-            "current_page": page,
             "duration": "{:0.3f}".format(end - start),
             "sku_summary": sku_summary_report,
         },
     )
 
 
-def _sku_summary(sku, rev_sum, num_sales, sku_info):
-    activities_sku = GoalItem.objects.filter(sku=sku)
-    manufacture_run_size = Decimal(0)
-    for activity in activities_sku:
-        manufacture_run_size += activity.quantity
-    if activities_sku:
-        avg_run_size = manufacture_run_size / Decimal(len(activities_sku))
-    else:
-        avg_run_size = sku.manufacturing_rate * Decimal(10.0)
+def _sku_summary(sku, rev_sum, num_sales, sku_info, avg_run_size, ingredient_cost):
     setup_cost_per_case = sku.setup_cost / avg_run_size
     run_cost_per_case = sku.run_cost
-    cogs = setup_cost_per_case + run_cost_per_case + sku.ingredient_cost
+    cogs = setup_cost_per_case + run_cost_per_case + ingredient_cost
     if num_sales == 0:
         avg_rev_per_case = Decimal(0)
     else:
@@ -137,7 +127,7 @@ def _sku_summary(sku, rev_sum, num_sales, sku_info):
         sku.name,
         rev_sum,
         avg_run_size,
-        sku.ingredient_cost,
+        ingredient_cost,
         setup_cost_per_case,
         run_cost_per_case,
         cogs,
@@ -149,37 +139,132 @@ def _sku_summary(sku, rev_sum, num_sales, sku_info):
 
 
 def _sales_ready():
-    return all(map(operator.attrgetter("sales_ready"), Sku.objects.all()))
+    return SalesReadiness.all_ready()
 
 
 def _time_estimate():
-    cnt = 0
-    for sku in Sku.objects.all():
-        if not sku.sales_ready:
-            cnt += 1
-    return cnt * SALES_WAIT_TIME_MINUTES
+    return SalesReadiness.pending_count() * SALES_WAIT_TIME_MINUTES
 
 
-def _sku_revenue(sku, customers, begin_year):
-    sku_ten_year = []
-    rev_sum = Decimal(0)
-    num_sales = Decimal(0)
+def _sku_revenues(skus, customers, begin_year):
+    """
+    Computes the revenue of many SKUs since begin_year from the precomputed sales
+    rollup, using a single query.
+    :param skus: the SKUs whose revenue is computed
+    :param customers: an iterable of customers to restrict the revenue to. If None,
+        revenue from all customers is included.
+    :param begin_year: the first year to include
+    :return: a dict mapping from SKU number to a 3-tuple (total revenue, total number
+        of sales, yearly breakdown)
+    """
+    names = {sku.number: sku.name for sku in skus}
+    result = {number: (Decimal(0), Decimal(0), []) for number in names}
+    if customers is None:
+        rollups = SalesRollup.objects.filter(customer__isnull=True)
+    else:
+        rollups = SalesRollup.objects.filter(customer__in=customers)
     sales_all = (
-        Sale.objects.filter(sku=sku, customer__in=customers, year__gte=begin_year)
-        .order_by("year")
-        .values("year")
-        .annotate(revenue=Sum(F("sales") * F("price")), count=Sum(F("sales")))
+        rollups.filter(sku__in=names.keys(), week__isnull=True, year__gte=begin_year)
+        .order_by("sku", "year")
+        .values("sku", "year")
+        .annotate(revenue=Sum("revenue"), count=Sum("sales"))
     )
     for sales_per_year in sales_all:
+        number = sales_per_year["sku"]
         year = sales_per_year["year"]
         sales_tot = sales_per_year["revenue"]
         num_tot = sales_per_year["count"]
+        rev_sum, num_sales, sku_ten_year = result[number]
         sku_ten_year.append(
-            (year, sku.number, sku.name, sales_tot, sales_tot / num_tot)
+            (year, number, names[number], sales_tot, sales_tot / num_tot)
+        )
+        result[number] = (rev_sum + sales_tot, num_sales + num_tot, sku_ten_year)
+    return result
+
+
+def _avg_run_sizes(skus):
+    """
+    Computes the average manufacturing run size of many SKUs, using a single query.
+    SKUs that were never part of a manufacturing goal are assumed to run for 10
+    hours.
+    :param skus: the SKUs whose average run size is computed
+    :return: a dict mapping from SKU number to the average run size
+    """
+    run_sizes = {sku.number: sku.manufacturing_rate * Decimal(10.0) for sku in skus}
+    activities = (
+        GoalItem.objects.filter(sku__in=run_sizes.keys())
+        .order_by()
+        .values("sku")
+        .annotate(total=Sum("quantity"), count=Count("pk"))
+    )
+    for activity in activities:
+        run_sizes[activity["sku"]] = activity["total"] / Decimal(activity["count"])
+    return run_sizes
+
+
+def _sales_summary(skus, customers, begin_year):
+    """
+    Computes the sales summary of many SKUs with a fixed number of queries,
+    regardless of the number of SKUs.
+    :param skus: a list of SKUs to summarize
+    :param customers: an iterable of customers to restrict the revenue to. If None,
+        revenue from all customers is included.
+    :param begin_year: the first year to include in the revenue
+    :return: a list of summary tuples (see `_sku_summary`), in the same order as skus
+    """
+    revenues = _sku_revenues(skus, customers, begin_year)
+    run_sizes = _avg_run_sizes(skus)
+    formula_costs = Formula.ingredient_costs({sku.formula_id for sku in skus})
+    summary = []
+    for sku in skus:
+        rev_sum, num_sales, sku_ten_year = revenues[sku.number]
+        ingredient_cost = (
+            formula_costs.get(sku.formula_id, Decimal(0)) * sku.formula_scale
+        )
+        summary.append(
+            _sku_summary(
+                sku,
+                rev_sum,
+                num_sales,
+                sku_ten_year,
+                run_sizes[sku.number],
+                ingredient_cost,
+            )
         )
-        rev_sum += sales_tot
-        num_sales += num_tot
-    return rev_sum, num_sales, sku_ten_year
+    return summary
+
+
+def sales_summary_report(pls, customers):
+    """
+    Computes the sales summary of every SKU in some product lines, over the last ten
+    years
+    :param pls: a list of product lines to summarize
+    :param customers: an iterable of customers to restrict the revenue to. If None,
+        revenue from all customers is included.
+    :return: a list of (product line name, SKU summaries, total revenue, yearly
+        revenue) tuples, one for each product line
+    """
+    begin_year = datetime.now().year - 9
+    skus = list(Sku.objects.filter(product_line__in=pls))
+    sku_summaries = _sales_summary(skus, customers, begin_year)
+    pl_reports = defaultdict(list)
+    for sku, sku_summary_report in zip(skus, sku_summaries):
+        pl_reports[sku.product_line_id].append(sku_summary_report)
+    sales_summary_result = []
+    for pl in pls:
+        logger.info("PL Name: %s", pl.name)
+        pl_summary_report = pl_reports[pl.pk]
+        pl_rev = 0
+        pl_rev_yearly = {}
+        for sku_summary_report in pl_summary_report:
+            pl_rev += sku_summary_report[2]
+            for data in sku_summary_report[-1]:
+                if data[0] not in pl_rev_yearly:
+                    pl_rev_yearly[data[0]] = data[3]
+                else:
+                    pl_rev_yearly[data[0]] += data[3]
+        sales_summary_result.append((pl.name, pl_summary_report, pl_rev, pl_rev_yearly))
+    return sales_summary_result
 
 
 @login_required
@@ -205,24 +290,85 @@ def sales_projection(request):
 
     params = {"start": start_date, "end": end_date}
     form = ProjectionsFilterForm(params)
-    if form.is_valid():
-        data = form.query(sku_number)
-    else:
-        data = {}
+    projection = form.query(sku_number) if form.is_valid() else None
 
-    if data:
-        avg = statistics.mean(data.values())
-        std = statistics.stdev(data.values())
+    if projection:
+        data = projection.yearly
+        avg = projection.mean
+        std = projection.std
     else:
+        data = {}
         avg = std = Decimal("0.0")
     form_html = render_to_string(
         request=request,
         template_name="meals/sales/projection.html",
-        context={"data": data, "form": form, "sku": sku, "avg": avg, "std": std},
+        context={
+            "data": data,
+            "form": form,
+            "sku": sku,
+            "avg": avg,
+            "std": std,
+            "projection": projection,
+        },
     )
     return form_html
 
 
+@login_required
+@auth.permission_required_ajax(
+    perm=("meals.view_sale",),
+    msg="You do not have permission to view the sales projection",
+    reason="Only Analysts amy view sales projections.",
+)
+@utils.ajax_view
+def sales_projections(request):
+    """
+    Projects the sales of many SKUs at once. Expects a comma-separated list of SKU
+    numbers in "skus", and optionally "start" and "end" dates.
+    """
+    try:
+        sku_numbers = {
+            int(number) for number in request.GET.get("skus", "").split(",") if number
+        }
+    except ValueError:
+        raise UserFacingException("Invalid request: SKU numbers must be integers")
+    if not sku_numbers:
+        raise UserFacingException("Invalid request: no SKU was provided")
+    found = set(
+        Sku.objects.filter(number__in=sku_numbers).values_list("number", flat=True)
+    )
+    if found != sku_numbers:
+        missing = ", ".join(map(str, sorted(sku_numbers - found)))
+        raise UserFacingException(f"Invalid request: SKU #{missing} cannot be found.")
+
+    start_date = request.GET.get("start", None) or datetime.now() - timedelta(days=10)
+    end_date = request.GET.get("end", None) or datetime.now()
+    form = ProjectionsFilterForm({"start": start_date, "end": end_date})
+    if not form.is_valid():
+        raise UserFacingException(f"Invalid request: {form.errors.as_text()}")
+    projections = form.query_many(sku_numbers)
+    return {
+        "error": None,
+        "resp": {
+            number: {
+                "yearly": {
+                    year: str(sales) for year, sales in projection.yearly.items()
+                },
+                "mean": str(projection.mean),
+                "std": str(projection.std),
+                "trend": str(projection.trend),
+                "trend_projection": str(projection.trend_projection),
+                "seasonality": (
+                    str(projection.seasonality)
+                    if projection.seasonality is not None
+                    else None
+                ),
+            }
+            for number, projection in projections.items()
+        },
+    }
+
+
 @login_required
 @auth.permission_required_ajax(
     perm=(
@@ -237,7 +383,16 @@ def sales_projection(request):
 )
 def sales_summary(request):
     export = request.GET.get("export", "0") == "1"
+    export_async = request.GET.get("async", "0") == "1"
     if not _sales_ready():
+        if export_async:
+            return JsonResponse(
+                {
+                    "error": "Sales records are still being retrieved. "
+                    f"Please try again in {_time_estimate()} minutes.",
+                    "resp": None,
+                }
+            )
         return render(
             request,
             template_name="meals/sales/sku_not_ready.html",
@@ -249,10 +404,7 @@ def sales_summary(request):
         if form.is_valid():
             product_lines, customers = form.query()
         else:
-            product_lines, customers = (
-                Paginator(ProductLine.objects.all(), 50),
-                Customer.objects.all(),
-            )
+            product_lines, customers = Paginator(ProductLine.objects.all(), 50), None
     else:
         params = {
             "product_lines": "",
@@ -279,10 +431,7 @@ def sales_summary(request):
         if form.is_valid():
             product_lines, customers = form.query()
         else:
-            product_lines, customers = (
-                Paginator(ProductLine.objects.all(), 50),
-                Customer.objects.all(),
-            )
+            product_lines, customers = Paginator(ProductLine.objects.all(), 50), None
 
     page = getattr(form, "cleaned_data", {"page_num": 1}).get("page_num", 1)
     if page > product_lines.num_pages:
@@ -290,27 +439,18 @@ def sales_summary(request):
         # number of pages, just start over from the first page.
         page = 1
         form.initial["page_num"] = 1
-    sales_summary_result = []
-    for pl in product_lines.page(page):
-        logger.info("PL Name: %s", pl.name)
-        skus = Sku.objects.filter(product_line=pl)
-        now = datetime.now()
-        end_year = now.year
-        begin_year = end_year - 9
-        pl_summary_report = []
-        pl_rev = 0
-        pl_rev_yearly = {}
-        for sku in skus:
-            rev_sum, num_sales, sku_ten_year = _sku_revenue(sku, customers, begin_year)
-            sku_summary_report = _sku_summary(sku, rev_sum, num_sales, sku_ten_year)
-            pl_summary_report.append(sku_summary_report)
-            pl_rev += rev_sum
-            for data in sku_ten_year:
-                if data[0] not in pl_rev_yearly:
-                    pl_rev_yearly[data[0]] = data[3]
-                else:
-                    pl_rev_yearly[data[0]] += data[3]
-        sales_summary_result.append((pl.name, pl_summary_report, pl_rev, pl_rev_yearly))
+    pls = list(product_lines.page(page))
+    if export and export_async:
+        job = run_export_async(
+            "sales_summary",
+            {
+                "product_lines": [pl.pk for pl in pls],
+                "customers": (None if customers is None else [c.pk for c in customers]),
+            },
+            user=request.user,
+        )
+        return JsonResponse({"error": None, "resp": export_job_status(job)})
+    sales_summary_result = sales_summary_report(pls, customers)
     if export:
         return export_sales_summary(sales_summary_result)
     drilldown_params = "?customer=" + form.data["customers"]
@@ -15,7 +15,7 @@ from django.views.decorators.http import require_POST
 from meals import auth
 from meals.forms import SkuFilterForm, EditSkuForm
 from meals.models import Sku, ManufacturingLine, SkuManufacturingLine
-from ..bulk_export import export_skus
+from ..bulk_export import export_job_status, export_skus, run_export_async
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +31,7 @@ def sku(request):
     export = request.GET.get("export", "0") == "1"
     export_formulas = request.GET.get("formulas", "0") == "1"
     export_product_lines = request.GET.get("pl", "0") == "1"
+    export_async = request.GET.get("async", "0") == "1"
     logger.info(
         "Exporting [SKU Formulas Product Lines] = [%s %s %s]",
         export,
@@ -70,6 +71,17 @@ def sku(request):
         page = 1
         form.initial["page_num"] = 1
     end = time.time()
+    if export and export_async:
+        job = run_export_async(
+            "skus",
+            {
+                "skus": list(skus.object_list.values_list("number", flat=True)),
+                "formulas": export_formulas,
+                "product_lines": export_product_lines,
+            },
+            user=request.user,
+        )
+        return JsonResponse({"error": None, "resp": export_job_status(job)})
     if export:
         return export_skus(
             skus.object_list,